@@ -0,0 +1,336 @@
+# -*- coding: utf-8 -*-
+
+"""
+Throughput benchmarks for pyssh.
+
+Like the test suite, these benchmarks asume that your system has a ssh
+server listening on localhost that accepts pubkey authentication for
+the current user.
+
+Usage::
+
+    python bench.py execute --size 67108864
+    sudo python bench.py sftp-get --latency 50
+    python bench.py sftp-compress --size 268435456
+    python bench.py threads --size 16777216 --max-threads 64
+
+The ``--latency`` option simulates a high latency link adding a netem
+delay to the loopback interface during the run (needs root and ``tc``).
+"""
+
+from __future__ import print_function, unicode_literals
+
+import argparse
+import contextlib
+import io
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import pyssh
+
+
+def _report(name, total_bytes, elapsed):
+    mbps = (total_bytes / (1024.0 * 1024.0)) / elapsed if elapsed > 0 else float("inf")
+    print("{0:<32} {1:>12} bytes {2:>10.3f} s {3:>10.2f} MB/s".format(
+        name, total_bytes, elapsed, mbps))
+
+
+def bench_execute(session, args):
+    """
+    Measure lazy command output throughput for several chunk sizes.
+    """
+    command = "head -c {0} /dev/zero".format(args.size)
+
+    for chunk_size in (10, 1024, 4096, 16384, 65536, 262144):
+        start = time.time()
+        total = 0
+        for chunk in session.execute(command, lazy=True, chunk_size=chunk_size):
+            total += len(chunk)
+
+        _report("execute chunk_size={0}".format(chunk_size),
+                total, time.time() - start)
+
+
+def _make_file(path, size):
+    with io.open(path, "wb") as f:
+        chunk = os.urandom(1024 * 1024)
+        while size > 0:
+            f.write(chunk[:size])
+            size -= len(chunk)
+
+
+def bench_sftp_get(session, args):
+    """
+    Compare the serial sftp download loop with pipelined downloads
+    using several window depths.
+    """
+    remote_path = "/tmp/pyssh-bench.remote"
+    local_path = "/tmp/pyssh-bench.local"
+    _make_file(remote_path, args.size)
+
+    try:
+        with session.create_sftp() as sftp:
+            for window in (None, 4, 16, 64):
+                start = time.time()
+                sftp.get(remote_path, local_path, window=window)
+                _report("sftp get window={0}".format(window or 1),
+                        os.path.getsize(local_path), time.time() - start)
+    finally:
+        for path in (remote_path, local_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def bench_sftp_streams(session, args):
+    """
+    Compare pipelined sftp downloads over one and several channels.
+    """
+    remote_path = "/tmp/pyssh-bench.remote"
+    local_path = "/tmp/pyssh-bench.local"
+    _make_file(remote_path, args.size)
+
+    try:
+        with session.create_sftp() as sftp:
+            for streams in (1, 2, 4, 8):
+                start = time.time()
+                sftp.get(remote_path, local_path, window=16, streams=streams)
+                _report("sftp get streams={0}".format(streams),
+                        os.path.getsize(local_path), time.time() - start)
+    finally:
+        for path in (remote_path, local_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def bench_sftp_put(session, args):
+    """
+    Compare the serial sftp upload loop with pipelined uploads
+    using several window depths.
+    """
+    remote_path = "/tmp/pyssh-bench.remote"
+    local_path = "/tmp/pyssh-bench.local"
+    _make_file(local_path, args.size)
+
+    try:
+        with session.create_sftp() as sftp:
+            for window in (None, 4, 16, 64):
+                start = time.time()
+                sftp.put(local_path, remote_path, window=window)
+                _report("sftp put window={0}".format(window or 1),
+                        args.size, time.time() - start)
+    finally:
+        for path in (remote_path, local_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _make_text_file(path, size):
+    # Log like lines: compress about 5-10 times with gzip or zstd
+    with io.open(path, "wb") as f:
+        line = 0
+        while size > 0:
+            chunk = "".join("2024-01-01 00:00:{0:02d} INFO request {1} served in {2} ms\n".format(
+                i % 60, line + i, (line + i) % 997) for i in range(10000)).encode("ascii")
+            f.write(chunk[:size])
+            size -= len(chunk)
+            line += 10000
+
+
+def bench_sftp_compress(session, args):
+    """
+    Compare plain sftp transfers of compressible data with transfers
+    compressed by a remote command and with ssh transport compression.
+    """
+    remote_path = "/tmp/pyssh-bench.remote"
+    local_path = "/tmp/pyssh-bench.local"
+    _make_text_file(remote_path, args.size)
+
+    codecs = [None, "gzip"]
+    try:
+        import zstandard  # noqa
+        codecs.append("zstd")
+    except ImportError:
+        pass
+
+    try:
+        with session.create_sftp() as sftp:
+            for compress in codecs:
+                start = time.time()
+                sftp.get(remote_path, local_path, window=16, compress=compress)
+                _report("sftp get compress={0}".format(compress),
+                        args.size, time.time() - start)
+
+            for compress in codecs:
+                start = time.time()
+                sftp.put(local_path, remote_path, window=16, compress=compress)
+                _report("sftp put compress={0}".format(compress),
+                        args.size, time.time() - start)
+
+        compressed_session = pyssh.new_session(hostname=args.hostname, port=args.port,
+                                               username=args.username, compression=True)
+        with compressed_session, compressed_session.create_sftp() as sftp:
+            start = time.time()
+            sftp.get(remote_path, local_path, window=16)
+            _report("sftp get session compression",
+                    args.size, time.time() - start)
+
+            start = time.time()
+            sftp.put(local_path, remote_path, window=16)
+            _report("sftp put session compression",
+                    args.size, time.time() - start)
+    finally:
+        for path in (remote_path, local_path):
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def _run_threads(sessions, func):
+    # Run func(session) on a thread per session, all of them started at
+    # once. Returns the sum of the values returned and the wall time.
+    started = threading.Event()
+    totals = []
+    errors = []
+
+    def run(session):
+        started.wait()
+        try:
+            totals.append(func(session))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(x,)) for x in sessions]
+    for thread in threads:
+        thread.start()
+
+    start = time.time()
+    started.set()
+    for thread in threads:
+        thread.join()
+    elapsed = time.time() - start
+
+    if errors:
+        raise errors[0]
+    return sum(totals), elapsed
+
+
+def bench_threads(session, args):
+    """
+    Aggregate throughput of 1 to --max-threads threads, each one with its
+    own session, reading command output (default and fill modes) and
+    downloading a file with sftp (small and large read requests).
+    Command output modes also report the mean size of the chunks read.
+    """
+    command = "head -c {0} /dev/zero".format(args.size)
+    remote_path = "/tmp/pyssh-bench.remote"
+    _make_file(remote_path, args.size)
+
+    # Number of chunks read by each thread of the last execute run
+    chunk_counts = []
+
+    def execute(chunk_size, fill):
+        def run(s):
+            total = 0
+            count = 0
+            for chunk in s.execute(command, lazy=True, chunk_size=chunk_size, fill=fill):
+                total += len(chunk)
+                count += 1
+            chunk_counts.append(count)
+            return total
+        return run
+
+    def sftp_get(chunk_size):
+        def run(s):
+            local_path = "/tmp/pyssh-bench.local.{0}".format(id(s))
+            try:
+                with s.create_sftp() as sftp:
+                    sftp.get(remote_path, local_path, window=16, chunk_size=chunk_size)
+                return os.path.getsize(local_path)
+            finally:
+                if os.path.exists(local_path):
+                    os.remove(local_path)
+        return run
+
+    modes = [
+        ("execute chunk_size=64K", execute(64 * 1024, False)),
+        ("execute chunk_size=1M", execute(1024 * 1024, False)),
+        ("execute fill chunk_size=1M", execute(1024 * 1024, True)),
+        ("sftp get chunk_size=16K", sftp_get(16 * 1024)),
+        ("sftp get chunk_size=64K", sftp_get(64 * 1024)),
+    ]
+
+    counts = [x for x in (1, 2, 4, 8, 16, 32, 64) if x <= args.max_threads]
+    sessions = [session]
+
+    # Connect now, not on the first timed run
+    session.execute("true")
+
+    try:
+        # Connected sequentially, sshd throttles concurrent handshakes
+        while len(sessions) < counts[-1]:
+            sessions.append(pyssh.new_session(hostname=args.hostname, port=args.port,
+                                              username=args.username, connect_on_init=True))
+
+        for name, func in modes:
+            for count in counts:
+                del chunk_counts[:]
+                total, elapsed = _run_threads(sessions[:count], func)
+                _report("{0} threads={1}".format(name, count), total, elapsed)
+                if chunk_counts:
+                    print("{0:<32} {1:>12} bytes per chunk".format(
+                        "", total // max(1, sum(chunk_counts))))
+    finally:
+        for extra in sessions[1:]:
+            extra.close()
+        os.remove(remote_path)
+
+
+@contextlib.contextmanager
+def _simulated_latency(delay_ms):
+    if not delay_ms:
+        yield
+        return
+
+    device = ["dev", "lo", "root"]
+    subprocess.check_call(["tc", "qdisc", "add"] + device +
+                          ["netem", "delay", "{0}ms".format(delay_ms)])
+    try:
+        yield
+    finally:
+        subprocess.check_call(["tc", "qdisc", "del"] + device)
+
+
+BENCHMARKS = {
+    "execute": bench_execute,
+    "sftp-get": bench_sftp_get,
+    "sftp-put": bench_sftp_put,
+    "sftp-streams": bench_sftp_streams,
+    "sftp-compress": bench_sftp_compress,
+    "threads": bench_threads,
+}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="pyssh throughput benchmarks")
+    parser.add_argument("benchmark", choices=sorted(BENCHMARKS))
+    parser.add_argument("--hostname", default="localhost")
+    parser.add_argument("--port", default="22")
+    parser.add_argument("--username", default=None)
+    parser.add_argument("--size", type=int, default=32 * 1024 * 1024,
+                        help="amount of bytes transferred on each run")
+    parser.add_argument("--latency", type=int, default=0,
+                        help="simulated loopback latency in milliseconds")
+    parser.add_argument("--max-threads", type=int, default=64,
+                        help="maximum number of threads of the threads benchmark")
+    args = parser.parse_args(argv)
+
+    with _simulated_latency(args.latency):
+        with pyssh.new_session(hostname=args.hostname, port=args.port,
+                               username=args.username) as session:
+            BENCHMARKS[args.benchmark](session, args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
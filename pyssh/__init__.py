@@ -4,12 +4,16 @@ from __future__ import unicode_literals
 import warnings
 
 from .session import Session
+from .options import SessionOptions
 from .sftp import Sftp
+from .fanout import Fanout
+from .pool import SessionPool
 
 
 def new_session(hostname="localhost", port="22", username=None,
                 password=None, passphrase=None, connect_on_init=False,
-                verify_knownhost_callback=None):
+                verify_knownhost_callback=None, compression=None, compression_level=None,
+                options=None, connect_timeout=None, timeout=None):
     """
     Shortcut method for create new session instance.
 
@@ -25,11 +29,20 @@ def new_session(hostname="localhost", port="22", username=None,
     :param str passphrase: passphrase in case you would authenticate with pubkey
     :param bool connect_on_init: determines the lazyness of connection with
                                  remote server.
+    :param compression: ssh transport compression (see
+                        :py:class:`~pyssh.session.Session`)
+    :param int compression_level: zlib compression level, from 1 to 9
+    :param options: :py:class:`~pyssh.options.SessionOptions` instance
+    :param float connect_timeout: seconds waiting for the connection
+    :param float timeout: default maximum seconds of each operation (see
+                          :py:class:`~pyssh.session.Session`)
     """
 
     session = Session(hostname=hostname, port=port, username=username,
                       password=password, passphrase=passphrase,
-                      verify_knownhost_callback=verify_knownhost_callback)
+                      verify_knownhost_callback=verify_knownhost_callback,
+                      compression=compression, compression_level=compression_level,
+                      options=options, connect_timeout=connect_timeout, timeout=timeout)
     if connect_on_init:
         session._connect_if_not_connected()
     return session
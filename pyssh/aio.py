@@ -0,0 +1,473 @@
+# -*- coding: utf-8 -*-
+
+"""
+asyncio front-end for pyssh (python >= 3.5).
+
+Sessions are switched to libssh non-blocking mode and their socket is
+registered on the event loop, so a single thread can drive many sessions
+and commands at same time. A coroutine that gets ``SSH_AGAIN`` from libssh
+waits until the session socket is ready (or another coroutine made progress
+on the same session) and retries the call.
+"""
+
+import asyncio
+import contextlib
+import io
+import os
+import stat
+
+from . import api
+from . import compat
+from . import exceptions as exp
+from . import result
+from . import sftp
+from .session import Session
+
+
+# Maximum seconds a coroutine sleeps without retrying its libssh call.
+# Guards against data buffered by libssh while serving other channels.
+POLL_INTERVAL = 1.0
+
+
+class AsyncSession(object):
+    """
+    asyncio version of :py:class:`pyssh.session.Session`.
+
+    Accepts the same parameters as :py:class:`~pyssh.session.Session`.
+    Connection is lazy and happens on first use or explicitly
+    awaiting :py:meth:`connect`.
+
+    :ivar session_wrapper: wrapped :py:class:`pyssh.session.Session`
+    :ivar pointer session: c ssh session pointer
+    """
+
+    def __init__(self, *args, **kwargs):
+        self.session_wrapper = Session(*args, **kwargs)
+        self.session = self.session_wrapper.session
+
+        self._waiters = []
+        self._connecting = None
+        self._reading_fd = None
+        self._writing_fd = None
+
+    def _watch(self, loop):
+        fd = api.library.ssh_get_fd(self.session)
+
+        if self._reading_fd is None:
+            loop.add_reader(fd, self._wakeup)
+            self._reading_fd = fd
+
+        write_pending = api.library.ssh_get_poll_flags(self.session) & api.SSH_WRITE_PENDING
+        if write_pending and self._writing_fd is None:
+            loop.add_writer(fd, self._wakeup)
+            self._writing_fd = fd
+
+    def _unwatch(self):
+        if self._reading_fd is None and self._writing_fd is None:
+            return
+
+        loop = asyncio.get_event_loop()
+
+        if self._reading_fd is not None:
+            loop.remove_reader(self._reading_fd)
+            self._reading_fd = None
+
+        if self._writing_fd is not None:
+            loop.remove_writer(self._writing_fd)
+            self._writing_fd = None
+
+    def _wakeup(self):
+        waiters, self._waiters = self._waiters, []
+        for future in waiters:
+            if not future.done():
+                future.set_result(None)
+
+        self._unwatch()
+
+    async def _wait(self):
+        """
+        Wait until the session socket is ready or another coroutine
+        made progress on this session.
+        """
+        loop = asyncio.get_event_loop()
+
+        if api.library.ssh_get_fd(self.session) < 0:
+            await asyncio.sleep(0.01)
+            return
+
+        future = loop.create_future()
+        self._waiters.append(future)
+        self._watch(loop)
+
+        try:
+            await asyncio.wait([future], timeout=POLL_INTERVAL)
+        finally:
+            if future in self._waiters:
+                self._waiters.remove(future)
+            if not self._waiters:
+                self._unwatch()
+
+    async def _call(self, func, *args, again=(api.SSH_AGAIN,)):
+        """
+        Call a non-blocking libssh function until it returns something
+        other than the `again` return codes.
+        """
+        while True:
+            ret = func(*args)
+            if ret not in again:
+                # Wake other coroutines, this call may have read
+                # data that belongs to them.
+                self._wakeup()
+                return ret
+
+            await self._wait()
+
+    @contextlib.contextmanager
+    def _blocking(self):
+        # Parts of libssh (sftp handshake, open and close) only work in
+        # blocking mode. These are short calls that block the event loop
+        # for about one round trip.
+        api.library.ssh_set_blocking(self.session, 1)
+        try:
+            yield
+        finally:
+            api.library.ssh_set_blocking(self.session, 0)
+
+    async def connect(self):
+        """
+        Connect and authenticate with remote server if not connected.
+
+        Coroutines calling it at same time share a single connection
+        attempt, and all of them get its error if it fails.
+        """
+        wrapper = self.session_wrapper
+        if wrapper._closed:
+            raise exp.SshError("Session aleady closed.")
+
+        if wrapper._connected:
+            return
+
+        if self._connecting is None:
+            self._connecting = asyncio.ensure_future(self._connect())
+
+        # Shielded: a cancelled caller must not abort the attempt
+        # others are waiting for.
+        await asyncio.shield(self._connecting)
+
+    async def _connect(self):
+        wrapper = self.session_wrapper
+        api.library.ssh_set_blocking(self.session, 0)
+
+        ret = await self._call(api.library.ssh_connect, self.session)
+        if ret != api.SSH_OK:
+            remote_msg = compat.to_text(api.library.ssh_get_error(self.session))
+            msg = ("Unable to connect to remote server. "
+                   "(Return code: {0}, Return message: {1})")
+            raise exp.ConnectionError(msg.format(ret, remote_msg))
+
+        wrapper._verify_knownhost()
+
+        ret = await self._call(wrapper._userauth, again=(api.SSH_AUTH_AGAIN, api.SSH_AGAIN))
+        wrapper._check_userauth(ret)
+
+        # Only now, other callers must not use a session that is not
+        # authenticated yet.
+        wrapper._connected = True
+
+    async def execute(self, command, lazy=False, chunk_size=result.DEFAULT_CHUNK_SIZE):
+        """
+        Execute command on remote host.
+
+        :param str command: command string
+        :param bool lazy: return a :py:class:`AsyncLazyResult` to be
+                          consumed with ``async for`` instead of a
+                          completely read :py:class:`AsyncResult`.
+        :param int chunk_size: maximum number of bytes read at once
+        """
+        await self.connect()
+
+        if isinstance(command, compat.text_type):
+            command = compat.to_bytes(command)
+
+        if lazy:
+            return AsyncLazyResult(self, command, chunk_size=chunk_size)
+
+        _result = AsyncResult(self, command, chunk_size=chunk_size, stderr_limit=None)
+        await _result._consume()
+        return _result
+
+    async def create_sftp(self):
+        """
+        Create a new sftp session throught current ssh channel.
+
+        :rtype: :py:class:`AsyncSftp`
+        """
+        await self.connect()
+
+        with self._blocking():
+            return AsyncSftp(self, sftp.Sftp(self.session_wrapper))
+
+    def close(self):
+        """
+        Close initialized ssh connection.
+        """
+        if self._connecting is not None and not self._connecting.done():
+            self._connecting.cancel()
+        if self._waiters:
+            self._wakeup()
+        self.session_wrapper.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class AsyncLazyResult(result.LazyResult):
+    """
+    Lazy command execution result consumed with ``async for``.
+    """
+
+    def __init__(self, async_session, command, chunk_size=result.DEFAULT_CHUNK_SIZE,
+                 stderr_limit=result.DEFAULT_STDERR_LIMIT):
+        super(AsyncLazyResult, self).__init__(async_session.session, command, chunk_size=chunk_size,
+                                              stderr_limit=stderr_limit)
+        self.async_session = async_session
+
+    async def _aopen_channel(self):
+        if self._consumed:
+            raise RuntimeError("Result are consumed")
+
+        self._consumed = True
+        self._finished = False
+
+        if self._buffer is None:
+            self._allocate_buffer()
+
+        self.channel = api.library.ssh_channel_new(self.session)
+
+        ret = await self.async_session._call(api.library.ssh_channel_open_session, self.channel)
+        if ret != api.SSH_OK:
+            raise RuntimeError("Error code: {0}".format(ret))
+
+        ret = await self.async_session._call(api.library.ssh_channel_request_exec,
+                                             self.channel, self.command)
+        if ret != api.SSH_OK:
+            msg = api.library.ssh_get_error(self.session)
+            raise RuntimeError("Error {0}: {1}".format(ret, msg.decode('utf-8')))
+
+    async def _aclose_channel(self):
+        await self.async_session._call(api.library.ssh_channel_send_eof, self.channel)
+
+        # Without blocking libssh returns -1 until exit status arrives
+        while True:
+            return_code = api.library.ssh_channel_get_exit_status(self.channel)
+            if return_code != -1 or api.library.ssh_channel_is_closed(self.channel) != 0:
+                break
+            await self.async_session._wait()
+
+        self._return_code = return_code
+        api.library.ssh_channel_free(self.channel)
+        self.channel = None
+        self._finished = True
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if not self._consumed:
+            await self._aopen_channel()
+
+        while self._pending or not self._finished:
+            if not self._pending:
+                chunks = self._read_available()
+                if chunks is None:
+                    await self._aclose_channel()
+                    break
+
+                if not chunks:
+                    await self.async_session._wait()
+                    continue
+
+                self.async_session._wakeup()
+                self._pending.extend(chunks)
+
+            stream, chunk = self._pending.popleft()
+            if stream == result.STDOUT:
+                return chunk
+
+            self._capture_stderr(chunk)
+
+        raise StopAsyncIteration()
+
+    async def as_bytes(self, stream=result.STDOUT):
+        """
+        Launch the command and return a result as bytes.
+
+        :param str stream: ``"stdout"`` or ``"stderr"``
+        """
+        chunks = []
+        async for chunk in self:
+            chunks.append(chunk)
+
+        if stream == result.STDERR:
+            return self.stderr
+        return b"".join(chunks)
+
+    async def as_str(self, stream=result.STDOUT):
+        """
+        Launch the command and return a result as unicode string
+        """
+        return (await self.as_bytes(stream)).decode("utf-8")
+
+    async def wait(self):
+        """
+        Waits a complete command execution and returns the return code
+        """
+        async for _ in self:
+            pass
+        return self.return_code
+
+
+class AsyncResult(AsyncLazyResult):
+    """
+    Consumed version of :py:class:`AsyncLazyResult`, returned by
+    awaiting :py:meth:`AsyncSession.execute`.
+    """
+
+    _data = None
+
+    async def _consume(self):
+        self._data = []
+        async for chunk in self:
+            self._data.append(chunk)
+
+    def as_bytes(self, stream=result.STDOUT):
+        """
+        Return a cached result.
+        """
+        if stream == result.STDERR:
+            return self.stderr
+        return b"".join(self._data)
+
+    def as_str(self, stream=result.STDOUT):
+        return self.as_bytes(stream).decode("utf-8")
+
+    def wait(self):
+        return self.return_code
+
+
+class AsyncSftp(object):
+    """
+    asyncio sftp wrapper with pipelined get and put.
+
+    :ivar sftp_wrapper: wrapped :py:class:`pyssh.sftp.Sftp`
+    """
+
+    def __init__(self, async_session, sftp_wrapper):
+        self.async_session = async_session
+        self.sftp_wrapper = sftp_wrapper
+
+    async def get(self, remote_path, local_path, window=16, chunk_size=None):
+        """
+        Get a remote file to local keeping up to `window` read
+        requests in flight.
+
+        :param str remote_path: remote file path
+        :param str local_path:  local file path
+        :param int window: number of read requests kept in flight
+        :param int chunk_size: size of each read request
+        """
+        remote_path = compat.to_bytes(remote_path)
+        if chunk_size is None:
+            chunk_size = self.sftp_wrapper.buffer_size
+
+        with self.async_session._blocking():
+            remote_file_ptr = self.sftp_wrapper._open_remote_file(remote_path)
+
+        try:
+            with self.async_session._blocking():
+                total_size = self.sftp_wrapper._get_file_metadata(remote_file_ptr).st_size
+
+            api.library.sftp_file_set_nonblocking(remote_file_ptr)
+            replies = sftp._read_pipelined(remote_file_ptr, total_size, window, chunk_size)
+
+            with io.open(local_path, "wb") as f:
+                writer = sftp._LocalWriter(f)
+                for reply in replies:
+                    if reply is None:
+                        await self.async_session._wait()
+                        continue
+
+                    writer.write(*reply)
+
+            if writer.offset < total_size:
+                raise exp.SftpError("Remote file truncated while downloading "
+                                    "({0} of {1} bytes)".format(writer.offset, total_size))
+        finally:
+            with self.async_session._blocking():
+                api.library.sftp_close(remote_file_ptr)
+
+    async def put(self, path, remote_path, window=16, chunk_size=None):
+        """
+        Puts the local file to remote host keeping up to `window` writes
+        unacknowledged. Without asynchronous sftp io in libssh (< 0.11)
+        the file is written in blocking mode.
+
+        :param str path: local file path
+        :param str remote_path: remote file path
+        :param int window: number of unacknowledged writes kept in flight
+        :param int chunk_size: size of each write request
+        """
+        if not os.path.exists(path):
+            raise RuntimeError("Path {0} does not exists".format(path))
+
+        remote_path = compat.to_bytes(remote_path, "utf-8")
+        if chunk_size is None:
+            chunk_size = self.sftp_wrapper.buffer_size
+
+        access_type = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        with self.async_session._blocking():
+            remote_file_ptr = api.library.sftp_open(self.sftp_wrapper.sftp, remote_path,
+                                                    access_type, stat.S_IRWXU)
+
+        if remote_file_ptr is None:
+            msg = api.library.ssh_get_error(self.async_session.session)
+            raise exp.ConnectionError("Error raised by ssh: {0}".format(msg.decode("utf-8")))
+
+        try:
+            with io.open(path, "rb") as f:
+                chunks = iter(lambda: f.read(chunk_size), b"")
+
+                if not api.HAS_SFTP_AIO:
+                    with self.async_session._blocking():
+                        sftp._write_chunks(remote_file_ptr, chunks)
+                    return
+
+                api.library.sftp_file_set_nonblocking(remote_file_ptr)
+                max_write = self.sftp_wrapper._max_write_length()
+                for _ in sftp._write_pipelined(remote_file_ptr, chunks, window, max_write):
+                    await self.async_session._wait()
+        finally:
+            with self.async_session._blocking():
+                api.library.sftp_close(remote_file_ptr)
+
+    def close(self):
+        with self.async_session._blocking():
+            self.sftp_wrapper.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args, **kwargs):
+        self.close()
+
+
+def new_session(hostname="localhost", port="22", **kwargs):
+    """
+    Shortcut method for create new :py:class:`AsyncSession` instance.
+    Accepts the same parameters as :py:func:`pyssh.new_session` except
+    `connect_on_init`; await :py:meth:`AsyncSession.connect` instead.
+    """
+    return AsyncSession(hostname=hostname, port=port, **kwargs)
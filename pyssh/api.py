@@ -16,6 +16,9 @@ SSH_ERROR = -1
 SSH_AGAIN = -2
 SSH_EOF = -127
 
+SSH_TIMEOUT_INFINITE = -1
+SSH_TIMEOUT_DEFAULT = -2
+
 SSH_OPTIONS_HOST = 0
 SSH_OPTIONS_PORT = 1
 SSH_OPTIONS_PORT_STR = 2
@@ -23,7 +26,48 @@ SSH_OPTIONS_FD = 3
 SSH_OPTIONS_USER = 4
 SSH_OPTIONS_SSH_DIR = 5
 SSH_OPTIONS_IDENTITY = 6
-# TODO...
+SSH_OPTIONS_ADD_IDENTITY = 7
+SSH_OPTIONS_KNOWNHOSTS = 8
+SSH_OPTIONS_TIMEOUT = 9
+SSH_OPTIONS_TIMEOUT_USEC = 10
+SSH_OPTIONS_SSH1 = 11
+SSH_OPTIONS_SSH2 = 12
+SSH_OPTIONS_LOG_VERBOSITY = 13
+SSH_OPTIONS_LOG_VERBOSITY_STR = 14
+SSH_OPTIONS_CIPHERS_C_S = 15
+SSH_OPTIONS_CIPHERS_S_C = 16
+SSH_OPTIONS_COMPRESSION_C_S = 17
+SSH_OPTIONS_COMPRESSION_S_C = 18
+SSH_OPTIONS_PROXYCOMMAND = 19
+SSH_OPTIONS_BINDADDR = 20
+SSH_OPTIONS_STRICTHOSTKEYCHECK = 21
+SSH_OPTIONS_COMPRESSION = 22
+SSH_OPTIONS_COMPRESSION_LEVEL = 23
+SSH_OPTIONS_KEY_EXCHANGE = 24
+SSH_OPTIONS_HOSTKEYS = 25
+SSH_OPTIONS_GSSAPI_SERVER_IDENTITY = 26
+SSH_OPTIONS_GSSAPI_CLIENT_IDENTITY = 27
+SSH_OPTIONS_GSSAPI_DELEGATE_CREDENTIALS = 28
+SSH_OPTIONS_HMAC_C_S = 29
+SSH_OPTIONS_HMAC_S_C = 30
+SSH_OPTIONS_PASSWORD_AUTH = 31
+SSH_OPTIONS_PUBKEY_AUTH = 32
+SSH_OPTIONS_KBDINT_AUTH = 33
+SSH_OPTIONS_GSSAPI_AUTH = 34
+SSH_OPTIONS_GLOBAL_KNOWNHOSTS = 35
+SSH_OPTIONS_NODELAY = 36
+SSH_OPTIONS_PUBLICKEY_ACCEPTED_TYPES = 37
+SSH_OPTIONS_PROCESS_CONFIG = 38
+SSH_OPTIONS_REKEY_DATA = 39
+SSH_OPTIONS_REKEY_TIME = 40
+SSH_OPTIONS_RSA_MIN_SIZE = 41
+SSH_OPTIONS_IDENTITY_AGENT = 42
+SSH_OPTIONS_IDENTITIES_ONLY = 43
+
+SSH_CLOSED = 0x01
+SSH_READ_PENDING = 0x02
+SSH_CLOSED_ERROR = 0x04
+SSH_WRITE_PENDING = 0x08
 
 SSH_AUTH_SUCCESS = 0
 SSH_AUTH_DENIED = 1
@@ -33,12 +77,53 @@ SSH_AUTH_AGAIN = 4
 SSH_AUTH_ERROR = -1
 
 
+class Timeval(ctypes.Structure):
+    _fields_ = [("tv_sec", ctypes.c_long),
+                ("tv_usec", ctypes.c_long),]
+
+
+SSH_FILEXFER_TYPE_REGULAR = 1
+SSH_FILEXFER_TYPE_DIRECTORY = 2
+SSH_FILEXFER_TYPE_SYMLINK = 3
+SSH_FILEXFER_TYPE_SPECIAL = 4
+SSH_FILEXFER_TYPE_UNKNOWN = 5
+
+SSH_FX_OK = 0
+SSH_FX_EOF = 1
+SSH_FX_NO_SUCH_FILE = 2
+SSH_FX_PERMISSION_DENIED = 3
+
+
 class SftpAttributes(ctypes.Structure):
     _fields_ = [("name", ctypes.c_char_p),
                 ("longname", ctypes.c_char_p),
                 ("flags", ctypes.c_uint32),
                 ("type", ctypes.c_uint8),
-                ("size", ctypes.c_uint64),]
+                ("size", ctypes.c_uint64),
+                ("uid", ctypes.c_uint32),
+                ("gid", ctypes.c_uint32),
+                ("owner", ctypes.c_char_p),
+                ("group", ctypes.c_char_p),
+                ("permissions", ctypes.c_uint32),
+                ("atime64", ctypes.c_uint64),
+                ("atime", ctypes.c_uint32),
+                ("atime_nseconds", ctypes.c_uint32),
+                ("createtime", ctypes.c_uint64),
+                ("createtime_nseconds", ctypes.c_uint32),
+                ("mtime64", ctypes.c_uint64),
+                ("mtime", ctypes.c_uint32),
+                ("mtime_nseconds", ctypes.c_uint32),
+                ("acl", ctypes.c_void_p),
+                ("extended_count", ctypes.c_uint32),
+                ("extended_type", ctypes.c_void_p),
+                ("extended_data", ctypes.c_void_p),]
+
+
+class SftpLimits(ctypes.Structure):
+    _fields_ = [("max_packet_length", ctypes.c_uint64),
+                ("max_read_length", ctypes.c_uint64),
+                ("max_write_length", ctypes.c_uint64),
+                ("max_open_handles", ctypes.c_uint64)]
 
 
 try:
@@ -52,7 +137,29 @@ try:
     library.ssh_connect.restype = ctypes.c_int
 
     library.ssh_disconnect.argtypes = [ctypes.c_void_p]
+
+    library.ssh_is_connected.argtypes = [ctypes.c_void_p]
+    library.ssh_is_connected.restype = ctypes.c_int
+
+    library.ssh_set_blocking.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    library.ssh_set_blocking.restype = None
+
+    library.ssh_is_blocking.argtypes = [ctypes.c_void_p]
+    library.ssh_is_blocking.restype = ctypes.c_int
+
+    library.ssh_get_fd.argtypes = [ctypes.c_void_p]
+    library.ssh_get_fd.restype = ctypes.c_int
+
+    library.ssh_get_poll_flags.argtypes = [ctypes.c_void_p]
+    library.ssh_get_poll_flags.restype = ctypes.c_int
+
+    library.ssh_send_ignore.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    library.ssh_send_ignore.restype = ctypes.c_int
     library.ssh_options_set.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_void_p]
+    library.ssh_options_set.restype = ctypes.c_int
+
+    library.ssh_options_parse_config.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    library.ssh_options_parse_config.restype = ctypes.c_int
 
     library.ssh_userauth_password.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_char_p]
     library.ssh_userauth_password.restype = ctypes.c_int
@@ -75,12 +182,29 @@ try:
     library.ssh_channel_read_nonblocking.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
     library.ssh_channel_read_nonblocking.restype = ctypes.c_int
 
+    library.ssh_channel_read_timeout.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint32,
+                                                 ctypes.c_int, ctypes.c_int]
+    library.ssh_channel_read_timeout.restype = ctypes.c_int
+
     library.ssh_channel_write.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint]
     library.ssh_channel_write.restype = ctypes.c_int
 
     library.ssh_channel_send_eof.argtypes = [ctypes.c_void_p]
     library.ssh_channel_send_eof.restype = ctypes.c_int
 
+    library.ssh_channel_window_size.argtypes = [ctypes.c_void_p]
+    library.ssh_channel_window_size.restype = ctypes.c_uint32
+
+    library.ssh_channel_poll.argtypes = [ctypes.c_void_p, ctypes.c_int]
+    library.ssh_channel_poll.restype = ctypes.c_int
+
+    library.ssh_channel_poll_timeout.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.c_int]
+    library.ssh_channel_poll_timeout.restype = ctypes.c_int
+
+    library.ssh_channel_select.argtypes = [ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(ctypes.c_void_p),
+                                           ctypes.POINTER(ctypes.c_void_p), ctypes.POINTER(Timeval)]
+    library.ssh_channel_select.restype = ctypes.c_int
+
     library.ssh_channel_is_eof.argtypes = [ctypes.c_void_p]
     library.ssh_channel_is_eof.restype = ctypes.c_int
 
@@ -129,14 +253,49 @@ try:
     library.sftp_free.argtypes = [ctypes.c_void_p]
 
     library.sftp_fstat.argtypes = [ctypes.c_void_p]
-    library.sftp_fstat.restype = SftpAttributes
-    library.sftp_fstat.restype = ctypes.c_void_p
+    library.sftp_fstat.restype = ctypes.POINTER(SftpAttributes)
+
+    library.sftp_stat.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    library.sftp_stat.restype = ctypes.POINTER(SftpAttributes)
+
+    library.sftp_lstat.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    library.sftp_lstat.restype = ctypes.POINTER(SftpAttributes)
+
+    library.sftp_attributes_free.argtypes = [ctypes.POINTER(SftpAttributes)]
+    library.sftp_attributes_free.restype = None
+
+    library.sftp_opendir.argtypes = [ctypes.c_void_p, ctypes.c_char_p]
+    library.sftp_opendir.restype = ctypes.c_void_p
+
+    library.sftp_readdir.argtypes = [ctypes.c_void_p, ctypes.c_void_p]
+    library.sftp_readdir.restype = ctypes.POINTER(SftpAttributes)
+
+    library.sftp_dir_eof.argtypes = [ctypes.c_void_p]
+    library.sftp_dir_eof.restype = ctypes.c_int
+
+    library.sftp_closedir.argtypes = [ctypes.c_void_p]
+    library.sftp_closedir.restype = ctypes.c_int
+
+    library.sftp_mkdir.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint]
+    library.sftp_mkdir.restype = ctypes.c_int
+
+    library.sftp_utimes.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.POINTER(Timeval)]
+    library.sftp_utimes.restype = ctypes.c_int
+
+    library.sftp_get_error.argtypes = [ctypes.c_void_p]
+    library.sftp_get_error.restype = ctypes.c_int
 
     library.sftp_open.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_int]
     library.sftp_open.restype = ctypes.c_void_p
 
     library.sftp_close.argtypes = [ctypes.c_void_p]
 
+    library.sftp_file_set_nonblocking.argtypes = [ctypes.c_void_p]
+    library.sftp_file_set_nonblocking.restype = None
+
+    library.sftp_file_set_blocking.argtypes = [ctypes.c_void_p]
+    library.sftp_file_set_blocking.restype = None
+
     library.sftp_write.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_uint]
     library.sftp_write.restype = ctypes.c_int
 
@@ -149,9 +308,48 @@ try:
     library.sftp_read.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint]
     library.sftp_read.restype = ctypes.c_int
 
+    library.sftp_async_read_begin.argtypes = [ctypes.c_void_p, ctypes.c_uint32]
+    library.sftp_async_read_begin.restype = ctypes.c_int
+
+    library.sftp_async_read.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_uint32, ctypes.c_uint32]
+    library.sftp_async_read.restype = ctypes.c_int
+
     # Forward
     library.ssh_channel_open_forward.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int, ctypes.c_char_p, ctypes.c_int]
     library.ssh_channel_open_forward.restype = ctypes.c_int
 
+    library.ssh_channel_listen_forward.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int,
+                                                   ctypes.POINTER(ctypes.c_int)]
+    library.ssh_channel_listen_forward.restype = ctypes.c_int
+
+    library.ssh_channel_accept_forward.argtypes = [ctypes.c_void_p, ctypes.c_int, ctypes.POINTER(ctypes.c_int)]
+    library.ssh_channel_accept_forward.restype = ctypes.c_void_p
+
+    library.ssh_channel_cancel_forward.argtypes = [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int]
+    library.ssh_channel_cancel_forward.restype = ctypes.c_int
+
 except (AttributeError, OSError, IOError):
     warnings.warn("ssh shared library not found or incompatible")
+
+
+# SFTP asynchronous io api (only available on libssh >= 0.11)
+try:
+    library.sftp_aio_begin_write.argtypes = [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_size_t,
+                                             ctypes.POINTER(ctypes.c_void_p)]
+    library.sftp_aio_begin_write.restype = ctypes.c_ssize_t
+
+    library.sftp_aio_wait_write.argtypes = [ctypes.POINTER(ctypes.c_void_p)]
+    library.sftp_aio_wait_write.restype = ctypes.c_ssize_t
+
+    library.sftp_aio_free.argtypes = [ctypes.c_void_p]
+    library.sftp_aio_free.restype = None
+
+    library.sftp_limits.argtypes = [ctypes.c_void_p]
+    library.sftp_limits.restype = ctypes.POINTER(SftpLimits)
+
+    library.sftp_limits_free.argtypes = [ctypes.POINTER(SftpLimits)]
+    library.sftp_limits_free.restype = None
+
+    HAS_SFTP_AIO = True
+except (NameError, AttributeError):
+    HAS_SFTP_AIO = False
@@ -11,12 +11,25 @@ if six.PY2:
             return data.encode(encoding)
         return data
 
+    def to_name(data):
+        # Remote file names not valid in utf-8 are kept as bytes
+        try:
+            return data.decode("utf-8")
+        except UnicodeDecodeError:
+            return data
+
 else:
     def to_bytes(data, encoding="utf-8"):
         if isinstance(data, text_type):
-            return bytes(data, encoding)
+            # Undoes the surrogateescape decoding of to_name
+            return data.encode(encoding, "surrogateescape")
         return data
 
+    def to_name(data):
+        # Remote file names not valid in utf-8 keep their bytes as
+        # lone surrogates, encoded back by to_bytes (like os.fsdecode)
+        return data.decode("utf-8", "surrogateescape")
+
 def to_text(data, encoding="utf-8"):
     if isinstance(data, binary_type):
         return data.decode(encoding)
@@ -22,3 +22,20 @@ class ResourceManagementError(SshError):
 
 class HostVerificationError(SshError):
     pass
+
+
+class TimeoutError(SshError):
+    pass
+
+
+class ConnectTimeoutError(TimeoutError, ConnectionError):
+    """
+    The connection to the remote host was not established before the
+    connect timeout.
+    """
+
+
+class DeadlineExceeded(TimeoutError):
+    """
+    An operation did not complete before its deadline.
+    """
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import collections
+import threading
+import time
+
+from six.moves import queue as _queue
+
+from . import compat
+from . import exceptions as exp
+from .session import Session
+
+
+DEFAULT_CONCURRENCY = 16
+
+
+class HostResult(object):
+    """
+    Outcome of a command execution on a single host.
+
+    :ivar str hostname: remote host
+    :ivar result: :py:class:`pyssh.result.Result` instance or None
+        if the execution failed.
+    :ivar error: exception raised while connecting or executing the
+        command, or None on success.
+    :ivar float elapsed: seconds spent on this host.
+    """
+
+    def __init__(self, hostname, result=None, error=None, elapsed=0.0):
+        self.hostname = hostname
+        self.result = result
+        self.error = error
+        self.elapsed = elapsed
+
+    @property
+    def ok(self):
+        return self.error is None
+
+    @property
+    def timed_out(self):
+        return isinstance(self.error, exp.TimeoutError)
+
+    def __repr__(self):
+        status = "ok" if self.ok else repr(self.error)
+        return "<HostResult {0} {1} {2:.3f}s>".format(self.hostname, status, self.elapsed)
+
+
+class FanoutStats(object):
+    """
+    Aggregate timing statistics of a fanout execution.
+
+    Statistics are updated as results are yielded, so they can be
+    inspected while the execution is still in progress.
+    """
+
+    def __init__(self):
+        self.succeeded = 0
+        self.failed = 0
+        self.timed_out = 0
+        self.wall_time = 0.0
+        self.timings = []
+
+    def _add(self, host_result):
+        if host_result.ok:
+            self.succeeded += 1
+        elif host_result.timed_out:
+            self.timed_out += 1
+        else:
+            self.failed += 1
+
+        self.timings.append(host_result.elapsed)
+
+    @property
+    def total(self):
+        return len(self.timings)
+
+    @property
+    def min(self):
+        return min(self.timings) if self.timings else 0.0
+
+    @property
+    def max(self):
+        return max(self.timings) if self.timings else 0.0
+
+    @property
+    def mean(self):
+        return sum(self.timings) / len(self.timings) if self.timings else 0.0
+
+    def percentile(self, percent):
+        """
+        Return the per host elapsed time below which `percent` percent
+        of the hosts are.
+
+        :param float percent: value between 0 and 100
+        :rtype: float
+        """
+        if not self.timings:
+            return 0.0
+
+        timings = sorted(self.timings)
+        index = int(round((len(timings) - 1) * percent / 100.0))
+        return timings[index]
+
+    def __repr__(self):
+        return ("<FanoutStats total={0} succeeded={1} failed={2} timed_out={3} "
+                "wall={4:.3f}s mean={5:.3f}s max={6:.3f}s>").format(
+                    self.total, self.succeeded, self.failed, self.timed_out,
+                    self.wall_time, self.mean, self.max)
+
+
+class Fanout(object):
+    """
+    Execute a command on many hosts concurrently.
+
+    Every host gets its own :py:class:`pyssh.session.Session`, opened
+    in a bounded pool of threads. Iterating over a Fanout instance yields
+    :py:class:`HostResult` instances in completion order.
+
+    Hosts can be hostnames or dicts with :py:class:`~pyssh.session.Session`
+    parameters (`hostname`, `port`, `username`, ...) that override the
+    common ones passed as keyword arguments.
+
+    A host that exceeds `timeout` is reported as failed with
+    :py:class:`pyssh.exceptions.TimeoutError` and its slot is given to the
+    next host. The timeout is also passed to the session, as connect
+    timeout (unless given in the session parameters) and as deadline of
+    the command, so the thread of an abandoned host gives up soon after.
+
+    :param list hosts: list of hostnames or dicts of session parameters
+    :param str command: command string
+    :param int concurrency: maximum number of hosts processed at same time
+    :param float timeout: maximum seconds spent on a single host
+    :param session_kwargs: common :py:class:`~pyssh.session.Session` parameters
+    """
+
+    def __init__(self, hosts, command, concurrency=DEFAULT_CONCURRENCY,
+                 timeout=None, **session_kwargs):
+        if concurrency < 1:
+            raise ValueError("concurrency should be a positive integer")
+
+        self.hosts = list(hosts)
+        self.command = command
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.session_kwargs = session_kwargs
+        self.stats = FanoutStats()
+
+    def _host_params(self, host):
+        params = dict(self.session_kwargs)
+        if isinstance(host, dict):
+            params.update(host)
+        else:
+            params["hostname"] = host
+        return params
+
+    def _run(self, job_id, params, results):
+        started = time.time()
+        session = None
+
+        deadline = None
+        if self.timeout is not None:
+            deadline = started + self.timeout
+            params.setdefault("connect_timeout", self.timeout)
+
+        try:
+            session = Session(**params)
+            _result = session.execute(self.command, deadline=deadline)
+        except Exception as e:
+            results.put((job_id, None, e, time.time() - started))
+        else:
+            results.put((job_id, _result, None, time.time() - started))
+        finally:
+            if session is not None:
+                session.close()
+
+    def __iter__(self):
+        results = _queue.Queue()
+        pending = collections.deque(enumerate(self.hosts))
+        running = {}
+
+        started = time.time()
+
+        while pending or running:
+            while pending and len(running) < self.concurrency:
+                job_id, host = pending.popleft()
+                params = self._host_params(host)
+                running[job_id] = (compat.to_text(params["hostname"]), time.time())
+
+                thread = threading.Thread(target=self._run, args=(job_id, params, results))
+                thread.daemon = True
+                thread.start()
+
+            wait = None
+            if self.timeout is not None:
+                oldest = min(job_started for _, job_started in running.values())
+                wait = max(0, oldest + self.timeout - time.time())
+
+            try:
+                job_id, _result, error, elapsed = results.get(timeout=wait)
+            except _queue.Empty:
+                now = time.time()
+                for job_id, (hostname, job_started) in list(running.items()):
+                    if now - job_started >= self.timeout:
+                        del running[job_id]
+                        error = exp.TimeoutError("Timeout executing command on {0}".format(hostname))
+                        yield self._report(HostResult(hostname, error=error,
+                                                      elapsed=now - job_started), started)
+                continue
+
+            # Late result of a host already reported as timed out
+            if job_id not in running:
+                continue
+
+            hostname, _ = running.pop(job_id)
+            yield self._report(HostResult(hostname, _result, error, elapsed), started)
+
+    def _report(self, host_result, started):
+        self.stats._add(host_result)
+        self.stats.wall_time = time.time() - started
+        return host_result
+
+
+def execute(hosts, command, concurrency=DEFAULT_CONCURRENCY, timeout=None, **session_kwargs):
+    """
+    Shortcut for execute a command on many hosts concurrently.
+
+    :returns: iterable of :py:class:`HostResult` in completion order,
+        with aggregate statistics on its `stats` attribute.
+    :rtype: :py:class:`Fanout`
+    """
+    return Fanout(hosts, command, concurrency=concurrency, timeout=timeout,
+                  **session_kwargs)
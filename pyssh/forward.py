@@ -1,54 +1,687 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
-import warnings
-
-# def read_until_fail(sock):
-#     retval = []
-#     more_data=True
-#     while more_data:
-#         try:
-#             read_data = sock.recv(1024)
-#             retval.append(read_data)
-#             more_data = len(read_data)>0
-#         except:
-#             more_data=False
-#     return "".join(retval)
-
-
-#class Forward(object):
-#    channel = None
-#
-#    def __init__(self, session, local_host, local_port,  remote_host, remote_port):
-#        self.local_port = local_port
-#        self.local_host = local_host
-#        self.remote_port = remote_port
-#        self.remote_host = remote_host
-#        self.session_wrapper = session
-#        self.session = session.session
-#
-#    def start(self):
-#        self.channel = api.library.ssh_channel_new(self.session)
-#        if self.channel is None:
-#            raise RuntimeError("Error open new channel")
-#
-#        ret = api.library.ssh_channel_open_forward(self.channel,
-#            self.remote_host, self.remote_port, self.local_host, self.local_port)
-#
-#        if ret != api.SSH_OK:
-#            raise RuntimeError("Error code: {0}".format(ret))
-#
-#
-#        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-#        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-#        sock.bind((self.local_host, self.local_port))
-#        sock.listen(100)
-#
-#    def stop(self):
-#        if self.channel is not None:
-#            api.library.ssh_channel_close(self.channel)
-#            api.library.ssh_channel_free(self.channel)
-#            self.channel = None
-#
-#    def __del__(self):
-#        self.stop()
+
+import collections
+import ctypes
+import errno
+import socket
+import threading
+import time
+
+try:
+    import selectors
+except ImportError:
+    # python < 3.4
+    selectors = None
+
+from . import api
+from . import compat
+from . import exceptions as exp
+
+
+BUFFER_SIZE = 256 * 1024
+POLL_INTERVAL = 0.05
+CONNECT_TIMEOUT = 5
+
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR)
+
+
+class ForwardStats(object):
+    """
+    Counters of a forward, updated while it runs.
+
+    :ivar int connections: number of accepted connections
+    :ivar int active: number of connections being relayed
+    :ivar int failed: number of connections whose channel could not be opened
+    :ivar int bytes_sent: bytes relayed from local connections to the channels
+    :ivar int bytes_received: bytes relayed from the channels to local connections
+    :ivar open_latencies: seconds spent opening the channel of the last
+        (up to 1024) connections
+    """
+
+    def __init__(self):
+        self.connections = 0
+        self.active = 0
+        self.failed = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.open_latencies = collections.deque(maxlen=1024)
+
+    @property
+    def mean_open_latency(self):
+        if not self.open_latencies:
+            return 0.0
+        return sum(self.open_latencies) / len(self.open_latencies)
+
+    @property
+    def max_open_latency(self):
+        return max(self.open_latencies) if self.open_latencies else 0.0
+
+    def __repr__(self):
+        return ("<ForwardStats connections={0} active={1} failed={2} sent={3} "
+                "received={4} open_latency={5:.3f}s>").format(
+                    self.connections, self.active, self.failed, self.bytes_sent,
+                    self.bytes_received, self.mean_open_latency)
+
+
+class _Tunnel(object):
+    """
+    A local socket relayed to a channel.
+    """
+
+    def __init__(self, sock, channel):
+        self.sock = sock
+        self.channel = channel
+
+        # Data read from the socket not yet accepted by the channel window
+        self.to_channel = b""
+        # Data read from the channel not yet sent to the socket
+        self.to_socket = bytearray()
+
+        self.socket_eof = False
+        self.channel_eof = False
+        self.events = 0
+
+
+class Forwarder(object):
+    """
+    Relay of local sockets to channels of one session.
+
+    All sockets and the session connection are watched from a single
+    event loop: socket data is written to its channel as far as the
+    channel window allows and channel data is read without blocking and
+    sent back to its socket. A slow peer only stops reading from its own
+    connection.
+
+    A libssh session can not be used from several threads, so while the
+    loop runs in background (see :py:meth:`start`) the session should not
+    be used for anything else.
+    """
+
+    def __init__(self, session):
+        if selectors is None:
+            raise RuntimeError("Port forwarding needs python >= 3.4")
+
+        self.session_wrapper = session
+        self.session = session.session
+        self.stats = ForwardStats()
+
+        self._selector = selectors.DefaultSelector()
+        self._tunnels = {}
+        self._listeners = []
+        # Channels waiting for the server to confirm the open
+        self._opening = []
+
+        self._buffer = bytearray(BUFFER_SIZE)
+        self._buffer_ptr = (ctypes.c_char * BUFFER_SIZE).from_buffer(self._buffer)
+
+        self._stop = threading.Event()
+        self._thread = None
+        self._closed = False
+
+    def _listen(self, host, port, backlog=128):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind((host, port))
+        sock.listen(backlog)
+        sock.setblocking(False)
+
+        self._listeners.append(sock)
+        self._selector.register(sock, selectors.EVENT_READ, self._on_accept)
+        return sock
+
+    def _on_accept(self, listener, events):
+        while True:
+            try:
+                sock, address = listener.accept()
+            except socket.error as e:
+                if e.errno in _WOULD_BLOCK:
+                    return
+                raise
+
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.stats.connections += 1
+            self._on_connection(listener, sock, address)
+
+    def _on_connection(self, listener, sock, address):
+        """
+        Called with each accepted connection.
+        """
+        raise NotImplementedError()
+
+    def _open_forward(self, host, port, address, callback):
+        # Open a direct-tcpip channel to host:port and call `callback` with
+        # it, or with None if the server refuses it, once the server
+        # replies. Many opens can be waiting for a reply at same time.
+        channel = api.library.ssh_channel_new(self.session)
+        if channel is None:
+            raise exp.ConnectionError("Error open new channel")
+
+        opening = (channel, compat.to_bytes(host), port, compat.to_bytes(address[0]),
+                   address[1], time.time(), callback)
+        if not self._continue_open(opening):
+            self._opening.append(opening)
+
+    def _continue_open(self, opening):
+        # Returns False while the server has not replied.
+        channel, host, port, originator, originator_port, started, callback = opening
+
+        ret = api.library.ssh_channel_open_forward(channel, host, port, originator, originator_port)
+        if ret == api.SSH_AGAIN:
+            return False
+
+        if ret != api.SSH_OK:
+            api.library.ssh_channel_free(channel)
+            self.stats.failed += 1
+            callback(None)
+        else:
+            self.stats.open_latencies.append(time.time() - started)
+            callback(channel)
+        return True
+
+    def _poll(self):
+        """
+        Called on each loop iteration, after socket events are handled.
+        """
+        opening, self._opening = self._opening, []
+        for item in opening:
+            if not self._continue_open(item):
+                self._opening.append(item)
+
+    def _shutdown(self):
+        """
+        Called on close, once the loop is stopped.
+        """
+
+    def _add_tunnel(self, sock, channel):
+        tunnel = _Tunnel(sock, channel)
+        self._tunnels[sock] = tunnel
+        self.stats.active += 1
+        self._update(tunnel)
+        return tunnel
+
+    def _close_tunnel(self, tunnel):
+        if tunnel.events:
+            self._selector.unregister(tunnel.sock)
+        del self._tunnels[tunnel.sock]
+        self.stats.active -= 1
+
+        tunnel.sock.close()
+        api.library.ssh_channel_close(tunnel.channel)
+        api.library.ssh_channel_free(tunnel.channel)
+
+    def _update(self, tunnel):
+        # Watch the socket for reads only when the channel took all the
+        # previous data, and for writes only when there is data to send.
+        events = 0
+        if not tunnel.socket_eof and not tunnel.to_channel:
+            events |= selectors.EVENT_READ
+        if tunnel.to_socket:
+            events |= selectors.EVENT_WRITE
+
+        if events == tunnel.events:
+            return
+
+        if not events:
+            self._selector.unregister(tunnel.sock)
+        elif not tunnel.events:
+            self._selector.register(tunnel.sock, events, self._on_socket)
+        else:
+            self._selector.modify(tunnel.sock, events, self._on_socket)
+        tunnel.events = events
+
+    def _on_socket(self, sock, events):
+        tunnel = self._tunnels.get(sock)
+        if tunnel is None:
+            return
+
+        if events & selectors.EVENT_READ and not tunnel.to_channel:
+            try:
+                data = sock.recv(BUFFER_SIZE)
+            except socket.error as e:
+                if e.errno not in _WOULD_BLOCK:
+                    self._close_tunnel(tunnel)
+                    return
+            else:
+                if data:
+                    tunnel.to_channel = data
+                else:
+                    tunnel.socket_eof = True
+                    api.library.ssh_channel_send_eof(tunnel.channel)
+
+        self._relay(tunnel)
+
+    def _write_channel(self, tunnel):
+        while tunnel.to_channel:
+            window = api.library.ssh_channel_window_size(tunnel.channel)
+            if window == 0:
+                return True
+
+            chunk = tunnel.to_channel[:window]
+            written = api.library.ssh_channel_write(tunnel.channel, chunk, len(chunk))
+            if written < 0:
+                return False
+
+            self.stats.bytes_sent += written
+            tunnel.to_channel = tunnel.to_channel[written:]
+        return True
+
+    def _read_channel(self, tunnel):
+        # Returns True if the channel may have more data buffered.
+        room = BUFFER_SIZE - len(tunnel.to_socket)
+        if tunnel.channel_eof or room <= 0:
+            return False
+
+        readed = api.library.ssh_channel_read_nonblocking(tunnel.channel, self._buffer_ptr, room, 0)
+        if readed > 0:
+            tunnel.to_socket += self._buffer[:readed]
+            self.stats.bytes_received += readed
+            return readed == room
+
+        if readed == api.SSH_EOF or (readed == 0 and api.library.ssh_channel_is_eof(tunnel.channel)):
+            tunnel.channel_eof = True
+        elif readed < 0:
+            raise exp.ConnectionError("Error reading forwarded channel")
+        return False
+
+    def _write_socket(self, tunnel):
+        if tunnel.to_socket:
+            try:
+                sent = tunnel.sock.send(tunnel.to_socket)
+            except socket.error as e:
+                if e.errno not in _WOULD_BLOCK:
+                    return False
+                sent = 0
+            del tunnel.to_socket[:sent]
+
+        if tunnel.channel_eof and not tunnel.to_socket:
+            try:
+                tunnel.sock.shutdown(socket.SHUT_WR)
+            except socket.error:
+                pass
+        return True
+
+    def _relay(self, tunnel):
+        # Move data both ways, returns True if the channel may have
+        # more data buffered.
+        try:
+            more = self._read_channel(tunnel)
+        except exp.ConnectionError:
+            self._close_tunnel(tunnel)
+            return False
+
+        if not self._write_channel(tunnel) or not self._write_socket(tunnel):
+            self._close_tunnel(tunnel)
+            return False
+
+        if not tunnel.to_socket:
+            finished = tunnel.channel_eof and tunnel.socket_eof and not tunnel.to_channel
+            if finished or api.library.ssh_channel_is_closed(tunnel.channel):
+                self._close_tunnel(tunnel)
+                return False
+
+        self._update(tunnel)
+        return more
+
+    def serve_forever(self):
+        """
+        Run the relay loop in the current thread until :py:meth:`close`
+        is called.
+        """
+        self.session_wrapper._connect_if_not_connected()
+
+        session_fd = api.library.ssh_get_fd(self.session)
+        session_events = selectors.EVENT_READ
+        self._selector.register(session_fd, session_events, None)
+
+        # Channel opens and writes must not wait for the server while
+        # other connections are waiting to be relayed.
+        api.library.ssh_set_blocking(self.session, 0)
+
+        try:
+            timeout = POLL_INTERVAL
+            while not self._stop.is_set():
+                for key, events in self._selector.select(timeout):
+                    if key.data is not None:
+                        key.data(key.fileobj, events)
+
+                self._poll()
+
+                # Channel data may be waiting in libssh buffers without
+                # the session socket being readable, so all tunnels are
+                # polled after each wakeup.
+                more = False
+                for tunnel in list(self._tunnels.values()):
+                    more = self._relay(tunnel) or more
+                timeout = 0 if more else POLL_INTERVAL
+
+                # Wake up when libssh can flush its pending output
+                events = selectors.EVENT_READ
+                if api.library.ssh_get_poll_flags(self.session) & api.SSH_WRITE_PENDING:
+                    events |= selectors.EVENT_WRITE
+                if events != session_events:
+                    self._selector.modify(session_fd, events, None)
+                    session_events = events
+        finally:
+            api.library.ssh_set_blocking(self.session, 1)
+            self._selector.unregister(session_fd)
+
+    def start(self):
+        """
+        Run the relay loop in a background thread.
+        """
+        self._thread = threading.Thread(target=self.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def close(self):
+        """
+        Stop the relay loop and close all connections and listeners.
+        """
+        if self._closed:
+            return
+        self._closed = True
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+        self._shutdown()
+
+        for item in self._opening:
+            api.library.ssh_channel_free(item[0])
+            item[-1](None)
+        self._opening = []
+
+        for tunnel in list(self._tunnels.values()):
+            self._close_tunnel(tunnel)
+        for sock in self._listeners:
+            self._selector.unregister(sock)
+            sock.close()
+        self._selector.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+
+class LocalForward(Forwarder):
+    """
+    Forward connections to a local port to `remote_host`:`remote_port`
+    through the ssh server, like ``ssh -L``.
+
+    Every accepted connection gets its own direct-tcpip channel.
+
+    :param session: :py:class:`pyssh.session.Session` instance
+    :param int local_port: local port to listen on, 0 for any free port
+    :param str remote_host: host to connect to from the server
+    :param int remote_port: port to connect to from the server
+    :param str local_host: local address to listen on
+
+    :ivar int local_port: local port listening
+    """
+
+    def __init__(self, session, local_port, remote_host, remote_port, local_host="127.0.0.1"):
+        super(LocalForward, self).__init__(session)
+
+        self.remote_host = remote_host
+        self.remote_port = remote_port
+        self.local_host = local_host
+
+        sock = self._listen(local_host, local_port)
+        self.local_port = sock.getsockname()[1]
+
+    def _on_connection(self, listener, sock, address):
+        def opened(channel):
+            if channel is None:
+                sock.close()
+            else:
+                self._add_tunnel(sock, channel)
+
+        self._open_forward(self.remote_host, self.remote_port, address, opened)
+
+
+class RemoteForward(Forwarder):
+    """
+    Forward connections to `remote_port` of the ssh server to
+    `local_host`:`local_port`, like ``ssh -R``.
+
+    The server accepts the connections and hands each one to the session
+    as a new channel, then a connection to the local target is opened and
+    relayed to it.
+
+    :param session: :py:class:`pyssh.session.Session` instance
+    :param int remote_port: port to listen on the server, 0 for any free port
+    :param str local_host: host to connect to from this side
+    :param int local_port: port to connect to from this side
+    :param str remote_host: address to listen on the server
+
+    :ivar int remote_port: port listening on the server
+    """
+
+    def __init__(self, session, remote_port, local_host, local_port, remote_host="localhost"):
+        super(RemoteForward, self).__init__(session)
+
+        self.local_host = local_host
+        self.local_port = local_port
+        self.remote_host = remote_host
+
+        bound_port = ctypes.c_int(0)
+        ret = api.library.ssh_channel_listen_forward(self.session, compat.to_bytes(remote_host),
+                                                     remote_port, ctypes.byref(bound_port))
+        if ret != api.SSH_OK:
+            msg = api.library.ssh_get_error(self.session)
+            raise exp.ConnectionError("Error raised by ssh: {0}".format(msg.decode("utf-8")))
+
+        self.remote_port = bound_port.value or remote_port
+
+    def _poll(self):
+        super(RemoteForward, self)._poll()
+
+        port = ctypes.c_int(0)
+        while True:
+            channel = api.library.ssh_channel_accept_forward(self.session, 0, ctypes.byref(port))
+            if channel is None:
+                break
+
+            self.stats.connections += 1
+            started = time.time()
+
+            # The target is expected to be local or close, so it is
+            # connected without leaving the loop.
+            try:
+                sock = socket.create_connection((self.local_host, self.local_port),
+                                                timeout=CONNECT_TIMEOUT)
+            except socket.error:
+                self.stats.failed += 1
+                api.library.ssh_channel_close(channel)
+                api.library.ssh_channel_free(channel)
+                continue
+
+            sock.setblocking(False)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self.stats.open_latencies.append(time.time() - started)
+            self._add_tunnel(sock, channel)
+
+    def _shutdown(self):
+        if not self.session_wrapper._closed:
+            api.library.ssh_channel_cancel_forward(self.session, compat.to_bytes(self.remote_host),
+                                                   self.remote_port)
+
+
+SOCKS_VERSION = 5
+SOCKS_NO_AUTHENTICATION = 0
+SOCKS_NO_ACCEPTABLE_METHODS = 0xff
+SOCKS_CONNECT = 1
+SOCKS_ADDRESS_IPV4 = 1
+SOCKS_ADDRESS_DOMAIN = 3
+SOCKS_ADDRESS_IPV6 = 4
+SOCKS_SUCCEEDED = 0
+SOCKS_GENERAL_FAILURE = 1
+SOCKS_HOST_UNREACHABLE = 4
+SOCKS_COMMAND_NOT_SUPPORTED = 7
+SOCKS_ADDRESS_NOT_SUPPORTED = 8
+
+
+def _parse_socks_request(data):
+    """
+    Parse a SOCKS5 request, returns ``(command, host, port, length)``
+    or None if `data` does not hold the whole request yet.
+    """
+    if len(data) < 5:
+        return None
+
+    address_type = data[3]
+    if address_type == SOCKS_ADDRESS_IPV4:
+        start, length = 4, 4
+    elif address_type == SOCKS_ADDRESS_IPV6:
+        start, length = 4, 16
+    elif address_type == SOCKS_ADDRESS_DOMAIN:
+        start, length = 5, data[4]
+    else:
+        raise ValueError("Unsupported address type {0}".format(address_type))
+
+    end = start + length + 2
+    if len(data) < end:
+        return None
+
+    address = bytes(data[start:start + length])
+    if address_type == SOCKS_ADDRESS_IPV4:
+        host = socket.inet_ntop(socket.AF_INET, address)
+    elif address_type == SOCKS_ADDRESS_IPV6:
+        host = socket.inet_ntop(socket.AF_INET6, address)
+    else:
+        host = address.decode("idna")
+
+    port = data[end - 2] << 8 | data[end - 1]
+    return data[1], host, port, end
+
+
+def _socks_reply(status):
+    return bytes(bytearray([SOCKS_VERSION, status, 0, SOCKS_ADDRESS_IPV4, 0, 0, 0, 0, 0, 0]))
+
+
+class _SocksHandshake(object):
+    def __init__(self, address):
+        self.address = address
+        self.data = bytearray()
+        self.greeted = False
+
+
+class SocksProxy(Forwarder):
+    """
+    SOCKS5 proxy, like ``ssh -D``: every CONNECT request is served with a
+    new direct-tcpip channel of the session, so host names are resolved
+    and connected from the ssh server.
+
+    Only the "no authentication" method and the CONNECT command are
+    supported.
+
+    :param session: :py:class:`pyssh.session.Session` instance
+    :param int local_port: local port to listen on, 0 for any free port
+    :param str local_host: local address to listen on
+
+    :ivar int local_port: local port listening
+    """
+
+    def __init__(self, session, local_port=1080, local_host="127.0.0.1"):
+        super(SocksProxy, self).__init__(session)
+
+        self.local_host = local_host
+        self._handshakes = {}
+
+        sock = self._listen(local_host, local_port)
+        self.local_port = sock.getsockname()[1]
+
+    def _on_connection(self, listener, sock, address):
+        self._handshakes[sock] = _SocksHandshake(address)
+        self._selector.register(sock, selectors.EVENT_READ, self._on_handshake)
+
+    def _end_handshake(self, sock, reply=None):
+        self._selector.unregister(sock)
+        del self._handshakes[sock]
+
+        if reply is not None:
+            try:
+                sock.send(reply)
+            except socket.error:
+                pass
+            sock.close()
+
+    def _on_handshake(self, sock, events):
+        handshake = self._handshakes[sock]
+
+        try:
+            data = sock.recv(4096)
+        except socket.error as e:
+            if e.errno in _WOULD_BLOCK:
+                return
+            data = b""
+
+        if not data:
+            self._end_handshake(sock, b"")
+            return
+
+        handshake.data += data
+        buffer = handshake.data
+
+        if not handshake.greeted:
+            if len(buffer) < 2 or len(buffer) < 2 + buffer[1]:
+                return
+
+            if buffer[0] != SOCKS_VERSION:
+                self._end_handshake(sock, b"")
+                return
+
+            methods = buffer[2:2 + buffer[1]]
+            del buffer[:2 + buffer[1]]
+
+            if SOCKS_NO_AUTHENTICATION not in methods:
+                self._end_handshake(sock, bytes(bytearray([SOCKS_VERSION, SOCKS_NO_ACCEPTABLE_METHODS])))
+                return
+
+            sock.send(bytes(bytearray([SOCKS_VERSION, SOCKS_NO_AUTHENTICATION])))
+            handshake.greeted = True
+
+        try:
+            request = _parse_socks_request(buffer)
+        except ValueError:
+            self._end_handshake(sock, _socks_reply(SOCKS_ADDRESS_NOT_SUPPORTED))
+            return
+
+        if request is None:
+            return
+
+        command, host, port, length = request
+        if command != SOCKS_CONNECT:
+            self._end_handshake(sock, _socks_reply(SOCKS_COMMAND_NOT_SUPPORTED))
+            return
+
+        # Data sent by the client before the reply
+        early_data = bytes(buffer[length:])
+        self._end_handshake(sock)
+
+        def opened(channel):
+            if channel is None:
+                try:
+                    sock.send(_socks_reply(SOCKS_HOST_UNREACHABLE))
+                except socket.error:
+                    pass
+                sock.close()
+                return
+
+            sock.send(_socks_reply(SOCKS_SUCCEEDED))
+            tunnel = self._add_tunnel(sock, channel)
+            tunnel.to_channel = early_data
+            self._relay(tunnel)
+
+        self._open_forward(host, port, handshake.address, opened)
+
+    def _shutdown(self):
+        for sock in list(self._handshakes):
+            self._end_handshake(sock, b"")
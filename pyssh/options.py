@@ -0,0 +1,250 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import ctypes
+
+import six
+
+from . import api
+from . import compat
+
+
+def _text(name, value):
+    if not isinstance(value, (six.text_type, six.binary_type)):
+        raise TypeError("Option {0} should be a string".format(name))
+    return compat.to_bytes(value)
+
+
+def _algorithms(name, value):
+    # List of algorithm names in preference order, or a comma
+    # separated string of them.
+    if isinstance(value, (list, tuple)):
+        value = ",".join(compat.to_text(x) for x in value)
+    return _text(name, value)
+
+
+def _integer(ctype, minimum=None, maximum=None):
+    def encode(name, value):
+        if isinstance(value, bool) or not isinstance(value, six.integer_types):
+            raise TypeError("Option {0} should be an integer".format(name))
+        if ((minimum is not None and value < minimum) or
+                (maximum is not None and value > maximum)):
+            raise ValueError("Option {0} out of range: {1!r}".format(name, value))
+        return ctype(value)
+    return encode
+
+
+def _flag(ctype):
+    def encode(name, value):
+        if not isinstance(value, bool):
+            raise TypeError("Option {0} should be a boolean".format(name))
+        return ctype(value)
+    return encode
+
+
+def _compression(name, value):
+    if value is True:
+        return b"yes"
+    if value is False:
+        return b"no"
+    return _algorithms(name, value)
+
+
+def _timeout(name, value):
+    if isinstance(value, bool) or not isinstance(value, six.integer_types + (float,)):
+        raise TypeError("Option {0} should be a number of seconds".format(name))
+    if value < 0:
+        raise ValueError("Option {0} out of range: {1!r}".format(name, value))
+
+    seconds = int(value)
+    return (ctypes.c_long(seconds), ctypes.c_long(int(round((value - seconds) * 1000000))))
+
+
+# (name, libssh options, encoder) in the order they are applied. The
+# encoded value is set on every listed option, except encoders returning
+# a tuple, which have one value per option.
+_SPECS = [
+    ("ssh_dir", (api.SSH_OPTIONS_SSH_DIR,), _text),
+    ("identities", (api.SSH_OPTIONS_IDENTITY,), None),
+    ("knownhosts", (api.SSH_OPTIONS_KNOWNHOSTS,), _text),
+    ("global_knownhosts", (api.SSH_OPTIONS_GLOBAL_KNOWNHOSTS,), _text),
+    ("timeout", (api.SSH_OPTIONS_TIMEOUT, api.SSH_OPTIONS_TIMEOUT_USEC), _timeout),
+    ("log_verbosity", (api.SSH_OPTIONS_LOG_VERBOSITY,), _integer(ctypes.c_int, 0, 4)),
+    ("ciphers", (api.SSH_OPTIONS_CIPHERS_C_S, api.SSH_OPTIONS_CIPHERS_S_C), _algorithms),
+    ("key_exchange", (api.SSH_OPTIONS_KEY_EXCHANGE,), _algorithms),
+    ("hostkeys", (api.SSH_OPTIONS_HOSTKEYS,), _algorithms),
+    ("hmac", (api.SSH_OPTIONS_HMAC_C_S, api.SSH_OPTIONS_HMAC_S_C), _algorithms),
+    ("publickey_accepted_types", (api.SSH_OPTIONS_PUBLICKEY_ACCEPTED_TYPES,), _algorithms),
+    ("compression", (api.SSH_OPTIONS_COMPRESSION,), _compression),
+    ("compression_level", (api.SSH_OPTIONS_COMPRESSION_LEVEL,), _integer(ctypes.c_int, 1, 9)),
+    ("proxycommand", (api.SSH_OPTIONS_PROXYCOMMAND,), _text),
+    ("bindaddr", (api.SSH_OPTIONS_BINDADDR,), _text),
+    ("strict_host_key_check", (api.SSH_OPTIONS_STRICTHOSTKEYCHECK,), _flag(ctypes.c_int)),
+    ("nodelay", (api.SSH_OPTIONS_NODELAY,), _flag(ctypes.c_int)),
+    ("password_auth", (api.SSH_OPTIONS_PASSWORD_AUTH,), _flag(ctypes.c_int)),
+    ("pubkey_auth", (api.SSH_OPTIONS_PUBKEY_AUTH,), _flag(ctypes.c_int)),
+    ("kbdint_auth", (api.SSH_OPTIONS_KBDINT_AUTH,), _flag(ctypes.c_int)),
+    ("gssapi_auth", (api.SSH_OPTIONS_GSSAPI_AUTH,), _flag(ctypes.c_int)),
+    ("gssapi_server_identity", (api.SSH_OPTIONS_GSSAPI_SERVER_IDENTITY,), _text),
+    ("gssapi_client_identity", (api.SSH_OPTIONS_GSSAPI_CLIENT_IDENTITY,), _text),
+    ("gssapi_delegate_credentials", (api.SSH_OPTIONS_GSSAPI_DELEGATE_CREDENTIALS,), _flag(ctypes.c_int)),
+    ("rekey_data", (api.SSH_OPTIONS_REKEY_DATA,), _integer(ctypes.c_uint64, 0)),
+    ("rekey_time", (api.SSH_OPTIONS_REKEY_TIME,), _integer(ctypes.c_uint32, 0)),
+    ("rsa_min_size", (api.SSH_OPTIONS_RSA_MIN_SIZE,), _integer(ctypes.c_int, 0)),
+    ("identity_agent", (api.SSH_OPTIONS_IDENTITY_AGENT,), _text),
+    ("identities_only", (api.SSH_OPTIONS_IDENTITIES_ONLY,), _flag(ctypes.c_bool)),
+    ("process_config", (api.SSH_OPTIONS_PROCESS_CONFIG,), _flag(ctypes.c_bool)),
+]
+
+_NAMES = frozenset(name for name, _, _ in _SPECS)
+
+
+class SessionOptions(object):
+    """
+    Validated libssh session options, reusable by any number of sessions.
+
+    Values are checked and converted to their C types once, when the
+    instance is created, so applying them to a new session is only a
+    call to ``ssh_options_set`` per option. Options not given keep the
+    libssh defaults. Instances are immutable, use :py:meth:`replace` for
+    a modified copy.
+
+    Hostname, port and user are parameters of
+    :py:class:`~pyssh.session.Session`, not options.
+
+    :param str ssh_dir: ssh directory (default: ``~/.ssh``)
+    :param list identities: private key files tried on pubkey
+                            authentication
+    :param str knownhosts: user known hosts file
+    :param str global_knownhosts: global known hosts file
+    :param float timeout: seconds waiting for the connection and each
+                          blocking operation of libssh
+    :param int log_verbosity: libssh log level, from 0 (none) to 4
+    :param ciphers: cipher algorithms in preference order (both
+                    directions), like ``["aes128-gcm@openssh.com",
+                    "chacha20-poly1305@openssh.com"]``
+    :param key_exchange: key exchange algorithms
+    :param hostkeys: accepted host key algorithms
+    :param hmac: mac algorithms (both directions)
+    :param publickey_accepted_types: public key algorithms used
+                                     for authentication
+    :param compression: compress the ssh transport: True, False or the
+                        algorithms, like ``"zlib@openssh.com,zlib,none"``
+    :param int compression_level: zlib compression level, from 1 to 9
+    :param str proxycommand: command whose standard input and output
+                             are used as the connection (like
+                             ``ProxyCommand`` of OpenSSH)
+    :param str bindaddr: local address to bind to
+    :param bool strict_host_key_check: refuse unknown host keys
+    :param bool nodelay: disable Nagle's algorithm on the socket, it
+                         lowers the latency of small writes
+    :param bool password_auth: allow password authentication
+    :param bool pubkey_auth: allow pubkey authentication
+    :param bool kbdint_auth: allow keyboard interactive authentication
+    :param bool gssapi_auth: allow gssapi authentication
+    :param str gssapi_server_identity: gssapi server identity
+    :param str gssapi_client_identity: gssapi client identity
+    :param bool gssapi_delegate_credentials: delegate gssapi credentials
+    :param int rekey_data: bytes transferred before a rekey
+    :param int rekey_time: seconds before a rekey
+    :param int rsa_min_size: minimum accepted rsa key size in bits
+    :param str identity_agent: ssh agent socket path
+    :param bool identities_only: only use the configured identities
+    :param bool process_config: let libssh read the default ssh config
+                                files when connecting
+    :param config_file: ssh config file (like ``~/.ssh/config``) read
+                        with ``ssh_options_parse_config`` after the other
+                        options are set, or True for the default files
+    """
+
+    def __init__(self, config_file=None, **options):
+        unknown = set(options) - _NAMES
+        if unknown:
+            raise TypeError("Unknown session options: {0}".format(", ".join(sorted(unknown))))
+
+        if config_file is not None and config_file is not True:
+            config_file = _text("config_file", config_file)
+
+        self.config_file = config_file
+        self._options = dict((name, value) for name, value in options.items()
+                             if value is not None)
+
+        # (name, libssh option, C value) in the order they are set
+        values = []
+        for name, constants, encode in _SPECS:
+            value = self._options.get(name)
+            if value is None:
+                continue
+
+            if name == "identities":
+                if isinstance(value, (six.text_type, six.binary_type)):
+                    value = [value]
+                # Each one is put first on the libssh list, before the
+                # default keys: set them in reverse order.
+                for identity in reversed(list(value)):
+                    values.append((name, constants[0], _text(name, identity)))
+                continue
+
+            encoded = encode(name, value)
+            if not isinstance(encoded, tuple):
+                encoded = (encoded,) * len(constants)
+
+            for constant, item in zip(constants, encoded):
+                values.append((name, constant, item))
+
+        self._values = tuple(values)
+
+    def __getattr__(self, name):
+        if name in _NAMES:
+            return self._options.get(name)
+        raise AttributeError(name)
+
+    def __repr__(self):
+        items = sorted(self.as_dict().items())
+        return "SessionOptions({0})".format(", ".join("{0}={1!r}".format(*x) for x in items))
+
+    def as_dict(self):
+        """
+        Options given to this instance.
+
+        :rtype: dict
+        """
+        options = dict(self._options)
+        if self.config_file is not None:
+            options["config_file"] = self.config_file
+        return options
+
+    def replace(self, **changes):
+        """
+        Copy of these options with some of them changed. An option
+        changed to None gets the libssh default.
+
+        :rtype: :py:class:`SessionOptions`
+        """
+        options = self.as_dict()
+        options.update(changes)
+        return SessionOptions(**options)
+
+    def apply(self, session):
+        """
+        Set the options on a libssh session (not connected yet).
+
+        :param session: c ssh session pointer
+        """
+        for name, constant, value in self._values:
+            if isinstance(value, bytes):
+                ret = api.library.ssh_options_set(session, constant, value)
+            else:
+                ret = api.library.ssh_options_set(session, constant, ctypes.byref(value))
+
+            if ret != api.SSH_OK:
+                msg = compat.to_text(api.library.ssh_get_error(session))
+                raise ValueError("Invalid value for option {0}: {1}".format(name, msg))
+
+        if self.config_file is not None:
+            path = None if self.config_file is True else self.config_file
+            ret = api.library.ssh_options_parse_config(session, path)
+            if ret != api.SSH_OK:
+                raise ValueError("Error parsing ssh config file {0}".format(
+                    compat.to_text(path or b"~/.ssh/config")))
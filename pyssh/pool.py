@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import collections
+import contextlib
+import threading
+import time
+
+from . import api
+from . import compat
+from . import exceptions as exp
+from .session import Session
+
+
+class SessionPool(object):
+    """
+    Pool of connected and authenticated sessions.
+
+    Sessions are keyed by (hostname, port, username), so a session is only
+    reused for the same remote endpoint and user. Before handing out an
+    idle session the pool checks it with a cheap probe (an ignore message
+    that needs no reply) and discards it if the connection is gone.
+
+    Idle sessions are closed after `idle_ttl` seconds and, when there are
+    more than `max_idle` of them, the least recently used ones are closed
+    first.
+
+    :param int max_size: maximum number of sessions (in use and idle)
+                         per key. When reached, :py:meth:`acquire` waits
+                         until a session is released.
+    :param int max_idle: maximum number of idle sessions in the pool
+    :param float idle_ttl: seconds an idle session is kept open
+    :param session_kwargs: default :py:class:`~pyssh.session.Session`
+                           parameters (password, passphrase, ...)
+
+    :ivar int hits: number of acquires served with an idle session
+    :ivar int misses: number of acquires that opened a new session
+    :ivar int evictions: number of idle sessions closed by the pool
+    """
+
+    def __init__(self, max_size=4, max_idle=64, idle_ttl=300, **session_kwargs):
+        if max_size < 1:
+            raise ValueError("max_size should be a positive integer")
+
+        self.max_size = max_size
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+        self.session_kwargs = session_kwargs
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        self._lock = threading.Condition()
+        self._closed = False
+
+        # Idle sessions in least recently used order: session -> (key, released at)
+        self._idle = collections.OrderedDict()
+        # Number of sessions (in use and idle) per key
+        self._sizes = collections.defaultdict(int)
+        # Key of each session in use
+        self._in_use = {}
+
+    @staticmethod
+    def _make_key(hostname, port, username):
+        return (compat.to_text(hostname), compat.to_text(str(port)),
+                compat.to_text(username) if username is not None else None)
+
+    @staticmethod
+    def _is_healthy(session):
+        if session._closed:
+            return False
+        if api.library.ssh_is_connected(session.session) == 0:
+            return False
+        return api.library.ssh_send_ignore(session.session, b"") == api.SSH_OK
+
+    def _discard(self, session, key):
+        # Must be called with the lock held
+        self._sizes[key] -= 1
+        if self._sizes[key] == 0:
+            del self._sizes[key]
+
+        self._lock.notify_all()
+
+        if not session._closed:
+            session.close()
+
+    def _evict(self, now=None):
+        # Must be called with the lock held
+        if now is None:
+            now = time.time()
+
+        for session, (key, released_at) in list(self._idle.items()):
+            if len(self._idle) <= self.max_idle and now - released_at < self.idle_ttl:
+                break
+
+            del self._idle[session]
+            self.evictions += 1
+            self._discard(session, key)
+
+    def _pop_idle(self, key):
+        # Most recently used idle session of the key, if any.
+        for session in reversed(list(self._idle)):
+            if self._idle[session][0] == key:
+                del self._idle[session]
+                return session
+        return None
+
+    def acquire(self, hostname="localhost", port=22, username=None, timeout=None, **session_kwargs):
+        """
+        Get a connected session from pool, opening a new one if no healthy
+        idle session is available.
+
+        :param str hostname: remote ip or host
+        :param int port: remote port
+        :param str username: remote user name
+        :param float timeout: maximum seconds waiting for a session when
+                              the per key limit is reached
+        :rtype: :py:class:`pyssh.session.Session`
+        """
+        key = self._make_key(hostname, port, username)
+        deadline = None if timeout is None else time.time() + timeout
+
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise exp.ResourceManagementError("Pool already closed")
+
+                self._evict()
+
+                session = self._pop_idle(key)
+                while session is not None:
+                    if self._is_healthy(session):
+                        self.hits += 1
+                        self._in_use[session] = key
+                        return session
+
+                    self.evictions += 1
+                    self._discard(session, key)
+                    session = self._pop_idle(key)
+
+                if self._sizes[key] < self.max_size:
+                    self._sizes[key] += 1
+                    self.misses += 1
+                    break
+
+                wait = None if deadline is None else deadline - time.time()
+                if wait is not None and wait <= 0:
+                    raise exp.TimeoutError("Timeout waiting for a session from pool")
+                self._lock.wait(wait)
+
+        # Connect outside of the lock
+        params = dict(self.session_kwargs)
+        params.update(session_kwargs)
+
+        try:
+            session = Session(hostname=hostname, port=port, username=username, **params)
+            session._connect_if_not_connected()
+        except Exception:
+            with self._lock:
+                self._sizes[key] -= 1
+                self._lock.notify_all()
+            raise
+
+        with self._lock:
+            self._in_use[session] = key
+        return session
+
+    def release(self, session, discard=False):
+        """
+        Return a session to the pool.
+
+        :param session: session obtained with :py:meth:`acquire`
+        :param bool discard: close the session instead of keeping it
+        """
+        with self._lock:
+            key = self._in_use.pop(session)
+
+            if discard or self._closed or session._closed:
+                self._discard(session, key)
+                return
+
+            self._idle[session] = (key, time.time())
+            self._lock.notify_all()
+            self._evict()
+
+    @contextlib.contextmanager
+    def session(self, hostname="localhost", port=22, username=None, timeout=None, **session_kwargs):
+        """
+        Context manager version of :py:meth:`acquire`. The session is
+        returned to the pool on exit, or closed if a ssh error is raised.
+        """
+        session = self.acquire(hostname, port=port, username=username,
+                               timeout=timeout, **session_kwargs)
+        try:
+            yield session
+        except exp.SshError:
+            self.release(session, discard=True)
+            raise
+        except BaseException:
+            self.release(session)
+            raise
+        else:
+            self.release(session)
+
+    def close(self):
+        """
+        Close all idle sessions. Sessions in use are closed when released.
+        """
+        with self._lock:
+            self._closed = True
+            for session, (key, _) in list(self._idle.items()):
+                del self._idle[session]
+                self._discard(session, key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
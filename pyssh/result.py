@@ -1,54 +1,153 @@
 # -*- coding: utf-8 -*-
 
 from __future__ import unicode_literals
+import codecs
+import collections
 import ctypes
+import json
+import mmap
 import sys
+import tempfile
+import time
 
 from . import api
 from . import compat
+from . import exceptions as exp
+
+
+DEFAULT_CHUNK_SIZE = 64 * 1024
+DEFAULT_STDERR_LIMIT = 64 * 1024
+DEFAULT_SPOOL_SIZE = 16 * 1024 * 1024
+
+# Maximum milliseconds spent filling each chunk of LazyResult in fill mode
+FILL_TIMEOUT = 1000
+
+STDOUT = "stdout"
+STDERR = "stderr"
 
 
 class LazyResult(object):
     """
     Lazy command execution result wrapper.
 
-    This wrapper implements a iterator interface.
+    This wrapper implements a iterator interface over the command
+    standard output. Output is read from the channel in chunks of up
+    to `chunk_size` bytes using a single buffer that is allocated once
+    and reused for every read.
+
+    Standard output and standard error are read as data arrives on any
+    of them, so a command writing a lot to stderr never stalls. While
+    iterating over stdout, the last `stderr_limit` bytes of stderr are
+    kept and available on :py:attr:`stderr`. Use :py:meth:`iter_streams`
+    for receiving both streams interleaved.
+
+    :param int chunk_size: maximum size of each read from the channel
+                           (default: 64 KiB)
+    :param int stderr_limit: maximum number of stderr bytes kept while
+                             iterating over stdout, None for no limit
+                             (default: 64 KiB)
+    :param stdin: iterable of bytes chunks written to the command standard
+                  input, followed by end of file, before reading its output.
+                  Writing stops early if the command closes its input.
+                  The command should not write much output until its input
+                  ends, since it is not read meanwhile.
+    :param float deadline: :py:func:`time.time` value after which waiting
+                           for output raises
+                           :py:class:`~pyssh.exceptions.DeadlineExceeded`
+                           and the channel is closed
+    :param bool fill: wait until `chunk_size` bytes of stdout arrive
+                      before returning a chunk, waiting in libssh without
+                      holding the GIL. A chunk is shorter when the output
+                      ends, stderr has data waiting, or no more stdout
+                      arrives within `FILL_TIMEOUT` milliseconds. Use it
+                      with a large `chunk_size` when many threads read
+                      output at the same time. Stderr is read after each
+                      chunk.
     """
 
     _return_code = None
     _consumed = False
+    _buffer = None
+    _stdin_closed = False
+    deadline = None
+    fill = False
+
+    def __init__(self, session, command, chunk_size=DEFAULT_CHUNK_SIZE,
+                 stderr_limit=DEFAULT_STDERR_LIMIT, stdin=None, deadline=None, fill=False):
+        if chunk_size <= 0:
+            raise ValueError("chunk_size should be a positive integer")
 
-    def __init__(self, session, command):
         self.session = session
         self.command = command
+        self.chunk_size = chunk_size
+        self.stderr_limit = stderr_limit
+        self.stdin = stdin
+        self.deadline = deadline
+        self.fill = fill
+
+        self._pending = collections.deque()
+        self._stderr_data = collections.deque()
+        self._stderr_size = 0
+
+    def _allocate_buffer(self):
+        self._buffer = bytearray(self.chunk_size)
+        self._buffer_view = memoryview(self._buffer)
+        self._buffer_ptr = (ctypes.c_char * self.chunk_size).from_buffer(self._buffer)
 
     def __next__(self):
-        if self._finished:
-            raise StopIteration()
+        while self._pending or not self._finished:
+            if not self._pending:
+                chunks = self._read_streams()
+                if not chunks:
+                    self._close_channel()
+                    break
+                self._pending.extend(chunks)
 
-        data = ctypes.create_string_buffer(10)
-        readed_bytes = api.library.ssh_channel_read(self.channel, ctypes.byref(data),
-                                                    len(data), 0)
-        if readed_bytes > 0:
-            return data.value
+            stream, chunk = self._pending.popleft()
+            if stream == STDOUT:
+                return chunk
 
-        api.library.ssh_channel_send_eof(self.channel);
-        self._return_code = api.library.ssh_channel_get_exit_status(self.channel)
-        api.library.ssh_channel_free(self.channel)
-        self.channel = None
-        self._finished = True
-        raise StopIteration
+            self._capture_stderr(chunk)
+
+        raise StopIteration()
 
     if sys.version_info[0] == 2:
         next = __next__
 
     def __iter__(self):
+        self._open_channel()
+        return self
+
+    def iter_streams(self):
+        """
+        Launch the command and iterate over output of both streams
+        as they arrive.
+
+        :returns: generator of ``(stream, chunk)`` tuples where stream
+                  is ``"stdout"`` or ``"stderr"``
+        """
+        self._open_channel()
+
+        while True:
+            chunks = self._read_streams()
+            if not chunks:
+                break
+
+            for item in chunks:
+                yield item
+
+        self._close_channel()
+
+    def _open_channel(self):
         if self._consumed:
             raise RuntimeError("Result are consumed")
 
         self._consumed = True
         self._finished = False
 
+        if self._buffer is None:
+            self._allocate_buffer()
+
         self.channel = api.library.ssh_channel_new(self.session);
 
         # Open ssh session
@@ -62,26 +161,348 @@ class LazyResult(object):
             msg = api.library.ssh_get_error(self.session)
             raise RuntimeError("Error {0}: {1}".format(ret, msg.decode('utf-8')))
 
-        return self
+        if self.stdin is not None:
+            self._write_stdin(self.stdin)
+
+    def _write_stdin(self, chunks):
+        for chunk in chunks:
+            if not chunk:
+                continue
+
+            if self.deadline is not None:
+                self._time_left()
+
+            written = api.library.ssh_channel_write(self.channel, chunk, len(chunk))
+            if written != len(chunk):
+                # The command does not read its input anymore, its exit
+                # status and stderr tell why.
+                break
+
+        api.library.ssh_channel_send_eof(self.channel)
+        self._stdin_closed = True
+
+    def _abort_channel(self):
+        # Give up a running command, without waiting for its exit status.
+        api.library.ssh_channel_close(self.channel)
+        api.library.ssh_channel_free(self.channel)
+        self.channel = None
+        self._finished = True
+
+    def _time_left(self):
+        try:
+            return time_left(self.deadline)
+        except exp.DeadlineExceeded:
+            self._abort_channel()
+            raise
+
+    def _close_channel(self):
+        if not self._stdin_closed:
+            api.library.ssh_channel_send_eof(self.channel)
+        self._return_code = api.library.ssh_channel_get_exit_status(self.channel)
+        api.library.ssh_channel_free(self.channel)
+        self.channel = None
+        self._finished = True
+
+    def _read_nonblocking(self, is_stderr=0, copy=True):
+        """
+        Read data already available on the channel without waiting.
+
+        :param bool copy: if False, returns a memoryview of the read
+                          buffer, only valid until the next read.
+        :returns: bytes chunk (empty if nothing is available yet)
+                  or None on end of file.
+        """
+        if self.deadline is not None:
+            self._time_left()
+
+        readed_bytes = api.library.ssh_channel_read_nonblocking(self.channel, self._buffer_ptr,
+                                                                self.chunk_size, is_stderr)
+        if readed_bytes > 0:
+            if not copy:
+                return self._buffer_view[:readed_bytes]
+            return self._buffer_view[:readed_bytes].tobytes()
+
+        if readed_bytes == api.SSH_EOF:
+            return None
+
+        if readed_bytes < 0:
+            msg = api.library.ssh_get_error(self.session)
+            raise exp.ConnectionError("Error {0}: {1}".format(readed_bytes, msg.decode('utf-8')))
+
+        if api.library.ssh_channel_is_eof(self.channel) != 0:
+            return None
+
+        return b""
 
-    def as_bytes(self):
+    def _read_filled(self):
+        """
+        Read standard output until the buffer is full, the output ends,
+        stderr has data waiting or `FILL_TIMEOUT` elapses.
+
+        Waits happen in ``ssh_channel_select`` on both streams, so
+        stderr output is returned to the caller (and its share of the
+        channel window released) as soon as it arrives.
+
+        :returns: memoryview of the read buffer (only valid until the next
+                  read, empty if nothing arrived in time) or None on end
+                  of file.
+        """
+        fill_end = time.time() + FILL_TIMEOUT / 1000.0
+        address = ctypes.addressof(self._buffer_ptr)
+        filled = 0
+
+        while filled < self.chunk_size:
+            readed_bytes = api.library.ssh_channel_read_nonblocking(
+                self.channel, address + filled, self.chunk_size - filled, 0)
+
+            if readed_bytes > 0:
+                filled += readed_bytes
+                continue
+
+            if readed_bytes < 0 and readed_bytes != api.SSH_EOF:
+                msg = api.library.ssh_get_error(self.session)
+                raise exp.ConnectionError("Error {0}: {1}".format(readed_bytes, msg.decode('utf-8')))
+
+            if readed_bytes == api.SSH_EOF or api.library.ssh_channel_is_eof(self.channel) != 0:
+                # End of file after some data is reported by the next call
+                if not filled:
+                    return None
+                break
+
+            if api.library.ssh_channel_poll(self.channel, 1) > 0:
+                break
+
+            timeout = fill_end - time.time()
+            if timeout <= 0:
+                break
+
+            self._select(timeout)
+
+        return self._buffer_view[:filled]
+
+    def _read_stderr_available(self):
+        # Stderr chunks already received, without waiting.
+        chunks = []
+        while True:
+            chunk = self._read_nonblocking(1)
+            if not chunk:
+                return chunks
+            chunks.append((STDERR, chunk))
+
+    def _read_available(self):
+        """
+        Read data already available on both streams without waiting.
+
+        :returns: list of ``(stream, chunk)`` tuples (empty if nothing
+                  is available yet) or None on end of file.
+        """
+        chunks = []
+        eof = False
+
+        for is_stderr, stream in ((0, STDOUT), (1, STDERR)):
+            chunk = self._read_nonblocking(is_stderr)
+            if chunk is None:
+                eof = True
+            elif chunk:
+                chunks.append((stream, chunk))
+
+        if chunks or not eof:
+            return chunks
+        return None
+
+    def _read_streams(self):
+        """
+        Wait until any stream has data and read it.
+
+        :returns: non empty list of ``(stream, chunk)`` tuples, or
+                  empty list on end of file.
+        """
+        while self.fill:
+            data = self._read_filled()
+            chunks = [(STDOUT, data.tobytes())] if data else []
+            chunks.extend(self._read_stderr_available())
+            if chunks or data is None:
+                return chunks
+
+        while True:
+            chunks = self._read_available()
+            if chunks is None:
+                return []
+            if chunks:
+                return chunks
+
+            self._select()
+
+    def _select(self, timeout=1.0):
+        """
+        Wait until the channel has data on any stream, reaches end
+        of file or `timeout` seconds elapse.
+        """
+        if self.deadline is not None:
+            timeout = min(timeout, self._time_left())
+
+        seconds = int(timeout)
+        timeval = api.Timeval(seconds, int((timeout - seconds) * 1000000))
+
+        readchans = (ctypes.c_void_p * 2)(self.channel)
+        ret = api.library.ssh_channel_select(readchans, None, None, ctypes.byref(timeval))
+        if ret == api.SSH_ERROR:
+            msg = api.library.ssh_get_error(self.session)
+            raise exp.ConnectionError("Error {0}: {1}".format(ret, msg.decode('utf-8')))
+
+    def _capture_stderr(self, chunk):
+        self._stderr_data.append(chunk)
+        self._stderr_size += len(chunk)
+
+        if self.stderr_limit is None:
+            return
+
+        while self._stderr_size > self.stderr_limit:
+            excess = self._stderr_size - self.stderr_limit
+            oldest = self._stderr_data[0]
+            if len(oldest) <= excess:
+                self._stderr_data.popleft()
+                self._stderr_size -= len(oldest)
+            else:
+                self._stderr_data[0] = oldest[excess:]
+                self._stderr_size -= excess
+
+    @property
+    def stderr(self):
+        """
+        Captured standard error output (bounded by `stderr_limit`).
+
+        :rtype: bytes
+        """
+        return b"".join(self._stderr_data)
+
+    def as_bytes(self, stream=STDOUT):
         """
         Launch the command and return a result as bytes.
 
+        :param str stream: ``"stdout"`` or ``"stderr"``. The stderr
+                           result is bounded by `stderr_limit`.
         :returns: bytes chunk of command execution result
         :rtype: bytes
         """
+        if stream == STDERR:
+            for _ in self:
+                pass
+            return self.stderr
 
         return b"".join([x for x in self])
 
-    def as_str(self):
+    def stream_to(self, fileobj):
+        """
+        Launch the command and write its standard output to a file,
+        socket or callable as it arrives.
+
+        Chunks are written straight from the read buffer, without
+        copying nor collecting them; a callable receives memoryviews only
+        valid during the call. The channel is not read while a write is
+        in progress, so a slow consumer throttles the remote command
+        through the ssh flow control window. Stderr is captured as while
+        iterating (see :py:attr:`stderr`).
+
+        :param fileobj: writable binary file like object, socket or
+                        callable accepting a bytes like object
+        :returns: number of bytes written
+        :rtype: int
+        """
+        write = _writer(fileobj)
+        total = 0
+
+        self._open_channel()
+
+        while self.fill:
+            data = self._read_filled()
+            if data:
+                write(data)
+                total += len(data)
+
+            for _, stderr in self._read_stderr_available():
+                self._capture_stderr(stderr)
+
+            if data is None:
+                self._close_channel()
+                return total
+
+        while True:
+            data = self._read_nonblocking(0, copy=False)
+            if data:
+                write(data)
+                total += len(data)
+                continue
+
+            stderr = self._read_nonblocking(1)
+            if stderr:
+                self._capture_stderr(stderr)
+                continue
+
+            if data is None:
+                break
+
+            self._select()
+
+        self._close_channel()
+        return total
+
+    def _iter_stdout(self):
+        # Standard output chunks, read from the channel
+        return iter(self)
+
+    def iter_text(self, encoding="utf-8", errors="strict"):
+        """
+        Iterate over the standard output decoded to text as it arrives.
+
+        Chunks are decoded with an incremental decoder, so characters
+        split between two chunks are returned once complete.
+
+        :param str encoding: output encoding
+        :param str errors: decoding error handling scheme
+        :returns: generator of unicode strings
+        """
+        return _iter_text(self._iter_stdout(), encoding, errors)
+
+    def iter_lines(self, encoding=None, errors="strict", keepends=False):
+        """
+        Iterate over the lines of the standard output as they arrive.
+
+        Every chunk is scanned once, the pieces of a line split between
+        chunks are only joined when the end of the line arrives.
+
+        :param str encoding: decode lines with this encoding, or return
+                             bytes lines if None
+        :param str errors: decoding error handling scheme
+        :param bool keepends: keep the line breaks
+        :returns: generator of bytes or unicode strings
+        """
+        chunks = self._iter_stdout()
+        if encoding is not None:
+            chunks = _iter_text(chunks, encoding, errors)
+        return _iter_lines(chunks, keepends)
+
+    def iter_json(self, encoding="utf-8"):
+        """
+        Iterate over the records of a JSON lines (NDJSON) output as they
+        arrive. Blank lines are skipped.
+
+        :param str encoding: output encoding
+        :returns: generator of decoded JSON values
+        """
+        for line in self.iter_lines(encoding=encoding):
+            if line.strip():
+                yield json.loads(line)
+
+    def as_str(self, stream=STDOUT):
         """
         Launch the command and return a result as unicode string
 
+        :param str stream: ``"stdout"`` or ``"stderr"``
         :returns: unicode chunk of command execution result
         :rtype: str/unicode
         """
-        return self.as_bytes().decode("utf-8")
+        return self.as_bytes(stream).decode("utf-8")
 
     def wait(self):
         """
@@ -101,24 +522,292 @@ class LazyResult(object):
 class Result(LazyResult):
     """
     Consumed version of LazyResult. Useful for simple command
-    execution.
+    execution. Both stdout and stderr are captured completely.
     """
     _data = None
 
-    def __init__(self, *args, **kwargs):
-        super(Result, self).__init__(*args, **kwargs)
+    def __init__(self, session, command, chunk_size=DEFAULT_CHUNK_SIZE, deadline=None, fill=False):
+        super(Result, self).__init__(session, command, chunk_size=chunk_size,
+                                     stderr_limit=None, deadline=deadline, fill=fill)
 
         # consume iterator and save state
         self._data = list(self)
 
-    def as_bytes(self):
+    def as_bytes(self, stream=STDOUT):
         """
         Return a cached result.
 
+        :param str stream: ``"stdout"`` or ``"stderr"``
         :returns: bytes chunk of command execution result
         :rtype: bytes
         """
+        if stream == STDERR:
+            return self.stderr
         return b"".join(self._data)
 
+    def stream_to(self, fileobj):
+        """
+        Write the cached standard output to a file or socket.
+
+        :param fileobj: writable binary file like object or socket
+        :returns: number of bytes written
+        :rtype: int
+        """
+        write = _writer(fileobj)
+        for chunk in self._data:
+            write(chunk)
+        return sum(len(x) for x in self._data)
+
     def wait(self):
         return self.return_code
+
+    def _iter_stdout(self):
+        return iter(self._data)
+
+
+class SpooledResult(LazyResult):
+    """
+    Evaluated result that keeps standard output in memory up to
+    `spool_size` bytes and spills it to a temporary file above that.
+    Stderr is captured completely, like on :py:class:`Result`.
+
+    :param int spool_size: maximum number of bytes kept in memory
+                           (default: 16 MiB)
+    """
+
+    def __init__(self, session, command, chunk_size=DEFAULT_CHUNK_SIZE,
+                 spool_size=DEFAULT_SPOOL_SIZE, deadline=None, fill=False):
+        super(SpooledResult, self).__init__(session, command, chunk_size=chunk_size,
+                                            stderr_limit=None, deadline=deadline, fill=fill)
+
+        self._spool = tempfile.SpooledTemporaryFile(max_size=spool_size)
+        self.size = self.stream_to(self._spool)
+
+    def as_bytes(self, stream=STDOUT):
+        """
+        Return the spooled result.
+
+        :param str stream: ``"stdout"`` or ``"stderr"``
+        :rtype: bytes
+        """
+        if stream == STDERR:
+            return self.stderr
+
+        self._spool.seek(0)
+        return self._spool.read()
+
+    def stream_to(self, fileobj):
+        if not self._consumed:
+            return super(SpooledResult, self).stream_to(fileobj)
+
+        write = _writer(fileobj)
+        self._spool.seek(0)
+        for chunk in iter(lambda: self._spool.read(self.chunk_size), b""):
+            write(chunk)
+        return self.size
+
+    def _iter_stdout(self):
+        self._spool.seek(0)
+        return iter(lambda: self._spool.read(self.chunk_size), b"")
+
+    def mmap(self):
+        """
+        Map the standard output in memory, read only.
+
+        Output still kept in memory is moved to the temporary file first.
+
+        :rtype: mmap.mmap
+        """
+        if self.size == 0:
+            raise ValueError("Can not map an empty result")
+
+        fd = self._spool.fileno()
+        # Writes still buffered by the file object are not in the map
+        self._spool.flush()
+        return mmap.mmap(fd, 0, access=mmap.ACCESS_READ)
+
+    def close(self):
+        """
+        Release the spooled output.
+        """
+        self._spool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
+
+    def wait(self):
+        return self.return_code
+
+
+def time_left(deadline):
+    """
+    Seconds left until `deadline`, a :py:func:`time.time` value.
+
+    :raises pyssh.exceptions.DeadlineExceeded: if the deadline passed
+    """
+    left = deadline - time.time()
+    if left <= 0:
+        raise exp.DeadlineExceeded("Deadline exceeded")
+    return left
+
+
+def _iter_text(chunks, encoding, errors="strict"):
+    """
+    Decode an iterable of bytes chunks to unicode strings.
+    """
+    decoder = codecs.getincrementaldecoder(encoding)(errors)
+    for chunk in chunks:
+        text = decoder.decode(chunk)
+        if text:
+            yield text
+
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def _iter_lines(chunks, keepends=False):
+    """
+    Split an iterable of bytes or unicode chunks in lines.
+    """
+    pending = []
+    for chunk in chunks:
+        newline = "\n" if isinstance(chunk, compat.text_type) else b"\n"
+
+        start = 0
+        while True:
+            end = chunk.find(newline, start)
+            if end < 0:
+                break
+
+            line = chunk[start:end + 1 if keepends else end]
+            if pending:
+                pending.append(line)
+                line = line[:0].join(pending)
+                pending = []
+
+            yield line
+            start = end + 1
+
+        if start < len(chunk):
+            pending.append(chunk[start:])
+
+    if pending:
+        yield pending[0][:0].join(pending)
+
+
+def _writer(fileobj):
+    """
+    Return a function that completely writes a bytes chunk to a
+    file like object, socket or callable.
+    """
+    if hasattr(fileobj, "sendall"):
+        return fileobj.sendall
+
+    if not hasattr(fileobj, "write") and callable(fileobj):
+        return fileobj
+
+    def write(data):
+        view = memoryview(data)
+        while view:
+            written = fileobj.write(view)
+            # Raw files can write only part of the data. Buffered
+            # files write all of it (and python 2 ones return None).
+            if written is None or written >= len(view):
+                break
+            view = view[written:]
+
+    return write
+
+
+class _MultiplexedResult(Result):
+    """
+    Result filled by :py:func:`execute_many` instead of consuming
+    the channel on construction.
+    """
+
+    def __init__(self, session, command, chunk_size=DEFAULT_CHUNK_SIZE):
+        LazyResult.__init__(self, session, command, chunk_size=chunk_size,
+                            stderr_limit=None)
+        self._data = []
+
+    def _drain(self):
+        """
+        Read all available output. Returns True when the command
+        output is completely read.
+        """
+        while True:
+            chunks = self._read_available()
+            if chunks is None:
+                return True
+            if not chunks:
+                return False
+
+            for stream, chunk in chunks:
+                if stream == STDOUT:
+                    self._data.append(chunk)
+                else:
+                    self._capture_stderr(chunk)
+
+
+def execute_many(session, commands, chunk_size=DEFAULT_CHUNK_SIZE, max_channels=10, poll_interval=1.0):
+    """
+    Execute several commands over one ssh session at same time.
+
+    Each command gets its own channel and all open channels are polled
+    together with ``ssh_channel_select``. Results are yielded as each
+    command finishes.
+
+    :param session: c ssh session pointer
+    :param list commands: list of command bytestrings
+    :param int chunk_size: maximum number of bytes read at once
+    :param int max_channels: maximum number of channels open at same time.
+                             OpenSSH servers allow 10 by default (MaxSessions)
+    :param float poll_interval: maximum seconds blocked on each select call
+
+    :returns: generator of :py:class:`Result` in completion order
+    """
+    if max_channels < 1:
+        raise ValueError("max_channels should be a positive integer")
+
+    pending = collections.deque(commands)
+    running = []
+
+    seconds = int(poll_interval)
+    timeout = api.Timeval(seconds, int((poll_interval - seconds) * 1000000))
+
+    try:
+        while pending or running:
+            while pending and len(running) < max_channels:
+                _result = _MultiplexedResult(session, pending.popleft(), chunk_size=chunk_size)
+                _result._open_channel()
+                running.append(_result)
+
+            channels = [x.channel for x in running]
+            readchans = (ctypes.c_void_p * (len(channels) + 1))(*channels)
+
+            ret = api.library.ssh_channel_select(readchans, None, None, ctypes.byref(timeout))
+            if ret == api.SSH_ERROR:
+                msg = api.library.ssh_get_error(session)
+                raise exp.ConnectionError("Error {0}: {1}".format(ret, msg.decode('utf-8')))
+
+            ready = set()
+            for channel in readchans:
+                if channel is None:
+                    break
+                ready.add(channel)
+
+            for _result in list(running):
+                if _result.channel in ready and _result._drain():
+                    _result._close_channel()
+                    running.remove(_result)
+                    yield _result
+    finally:
+        # Generator closed before all commands finished
+        for _result in running:
+            api.library.ssh_channel_close(_result.channel)
+            api.library.ssh_channel_free(_result.channel)
+            _result.channel = None
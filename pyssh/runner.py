@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+
+from __future__ import unicode_literals
+
+import binascii
+import collections
+import ctypes
+import os
+import time
+
+from . import api
+from . import compat
+from . import result
+from . import exceptions as exp
+
+
+DEFAULT_SHELL = "/bin/sh"
+DEFAULT_BATCH_SIZE = 64
+
+
+class RunnerResult(result.Result):
+    """
+    Result of a command run by :py:class:`ShellRunner`, with the same
+    interface as :py:class:`pyssh.result.Result`.
+    """
+
+    def __init__(self, command, stdout, stderr, return_code):
+        result.LazyResult.__init__(self, None, command, stderr_limit=None)
+
+        self._data = [stdout] if stdout else []
+        if stderr:
+            self._capture_stderr(stderr)
+
+        self._return_code = return_code
+        self._consumed = True
+        self._finished = True
+
+
+class ShellRunner(object):
+    """
+    Run many commands through one long lived remote shell.
+
+    :py:meth:`pyssh.session.Session.execute` opens a channel and sends
+    an exec request per command. A runner opens a single channel running
+    `shell` and writes each command to its input, followed by commands
+    printing a unique marker with the exit code on stdout and stderr, so
+    the output of each command can be told apart. Commands written
+    together with :py:meth:`run_many` share a single round trip.
+
+    Each command runs in a subshell with stdin from ``/dev/null``, so
+    ``exit``, ``cd`` or syntax errors do not affect the following ones.
+
+    :param session: :py:class:`pyssh.session.Session` instance
+    :param str shell: remote shell command
+    :param int chunk_size: maximum number of bytes read at once
+    """
+
+    channel = None
+
+    def __init__(self, session, shell=DEFAULT_SHELL, chunk_size=result.DEFAULT_CHUNK_SIZE):
+        self.session_wrapper = session
+        self.session = session.session
+        self.chunk_size = chunk_size
+
+        self._prefix = b"__pyssh_" + binascii.hexlify(os.urandom(8))
+        self._counter = 0
+        # Commands written whose output is not parsed yet, as
+        # (command, marker) tuples in the order they were written.
+        self._pending = collections.deque()
+
+        self._stdout = bytearray()
+        self._stderr = bytearray()
+        self._chunk = bytearray(chunk_size)
+        self._chunk_ptr = (ctypes.c_char * chunk_size).from_buffer(self._chunk)
+
+        self._broken = False
+
+        self.channel = api.library.ssh_channel_new(self.session)
+        if self.channel is None:
+            raise exp.ConnectionError("Error open new channel")
+
+        ret = api.library.ssh_channel_open_session(self.channel)
+        if ret != api.SSH_OK:
+            raise exp.ConnectionError("Error code: {0}".format(ret))
+
+        ret = api.library.ssh_channel_request_exec(self.channel, compat.to_bytes(shell))
+        if ret != api.SSH_OK:
+            msg = api.library.ssh_get_error(self.session)
+            raise exp.ConnectionError("Error {0}: {1}".format(ret, msg.decode("utf-8")))
+
+    def _frame(self, command):
+        self._counter += 1
+        marker = self._prefix + b"_" + compat.to_bytes(str(self._counter))
+
+        quoted = b"'" + command.replace(b"'", b"'\\''") + b"'"
+        return marker, (b"(eval " + quoted + b") </dev/null\n" +
+                        b"printf '\\n%s %d\\n' " + marker + b" $?\n" +
+                        b"printf '\\n%s\\n' " + marker + b" >&2\n")
+
+    def _write(self, data):
+        written = api.library.ssh_channel_write(self.channel, data, len(data))
+        if written != len(data):
+            self._broken = True
+            raise exp.ConnectionError("Error writing to remote shell")
+
+    def _send(self, commands):
+        frames = []
+        for command in commands:
+            marker, frame = self._frame(compat.to_bytes(command))
+            self._pending.append((command, marker))
+            frames.append(frame)
+        self._write(b"".join(frames))
+
+    def _receive(self, deadline):
+        # Read available output of both streams, waiting for it until
+        # `deadline` if there is none.
+        while True:
+            received = False
+            for is_stderr, buffer in ((0, self._stdout), (1, self._stderr)):
+                readed = api.library.ssh_channel_read_nonblocking(self.channel, self._chunk_ptr,
+                                                                  self.chunk_size, is_stderr)
+                if readed > 0:
+                    buffer += self._chunk[:readed]
+                    received = True
+                elif readed < 0 and readed != api.SSH_EOF:
+                    self._broken = True
+                    raise exp.ConnectionError("Error reading from remote shell")
+
+            if received:
+                return
+
+            if api.library.ssh_channel_is_eof(self.channel):
+                self._broken = True
+                raise exp.ConnectionError("Remote shell exited")
+
+            timeout = 1.0
+            if deadline is not None:
+                timeout = min(timeout, deadline - time.time())
+                if timeout <= 0:
+                    # The following output can not be matched to its
+                    # command anymore.
+                    self._broken = True
+                    raise exp.TimeoutError("Timeout waiting for command output")
+
+            seconds = int(timeout)
+            timeval = api.Timeval(seconds, int((timeout - seconds) * 1000000))
+            readchans = (ctypes.c_void_p * 2)(self.channel)
+            ret = api.library.ssh_channel_select(readchans, None, None, ctypes.byref(timeval))
+            if ret == api.SSH_ERROR:
+                self._broken = True
+                msg = api.library.ssh_get_error(self.session)
+                raise exp.ConnectionError("Error {0}: {1}".format(ret, msg.decode("utf-8")))
+
+    def _collect(self, timeout):
+        # Parse the output of the oldest pending command.
+        command, marker = self._pending[0]
+        deadline = None if timeout is None else time.time() + timeout
+
+        stdout_marker = b"\n" + marker + b" "
+        stderr_marker = b"\n" + marker + b"\n"
+
+        # Output before these offsets was already searched for the markers
+        stdout_scanned = stderr_scanned = 0
+        stdout_end = stderr_end = None
+
+        while True:
+            if stdout_end is None:
+                position = self._stdout.find(stdout_marker, stdout_scanned)
+                if position < 0:
+                    stdout_scanned = max(0, len(self._stdout) - len(stdout_marker) + 1)
+                else:
+                    stdout_scanned = position
+                    newline = self._stdout.find(b"\n", position + len(stdout_marker))
+                    if newline >= 0:
+                        stdout_end = (position, newline)
+
+            if stderr_end is None:
+                position = self._stderr.find(stderr_marker, stderr_scanned)
+                if position < 0:
+                    stderr_scanned = max(0, len(self._stderr) - len(stderr_marker) + 1)
+                else:
+                    stderr_end = position
+
+            if stdout_end is not None and stderr_end is not None:
+                break
+
+            self._receive(deadline)
+
+        self._pending.popleft()
+
+        position, newline = stdout_end
+        stdout = bytes(self._stdout[:position])
+        return_code = int(self._stdout[position + len(stdout_marker):newline])
+        del self._stdout[:newline + 1]
+
+        stderr = bytes(self._stderr[:stderr_end])
+        del self._stderr[:stderr_end + len(stderr_marker)]
+
+        return RunnerResult(command, stdout, stderr, return_code)
+
+    def _check(self):
+        if self.channel is None:
+            raise exp.ResourceManagementError("ShellRunner instance already closed.")
+        if self._broken:
+            raise exp.ConnectionError("Remote shell output is out of sync, open a new runner")
+
+    def run(self, command, timeout=None):
+        """
+        Run a command and wait for its result.
+
+        If `timeout` expires the runner can not be used anymore, since the
+        output of the command may still arrive.
+
+        :param str command: command string
+        :param float timeout: maximum seconds to wait for the command
+        :rtype: :py:class:`RunnerResult`
+        """
+        self._check()
+        self._send([command])
+
+        # Discard results of commands of an abandoned run_many
+        while len(self._pending) > 1:
+            self._collect(timeout)
+        return self._collect(timeout)
+
+    def run_many(self, commands, batch_size=DEFAULT_BATCH_SIZE, timeout=None):
+        """
+        Run several commands, writing them in batches of `batch_size`
+        without waiting for the previous results.
+
+        :param list commands: list of command strings
+        :param int batch_size: number of commands written at once
+        :param float timeout: maximum seconds to wait for each command
+        :returns: generator of :py:class:`RunnerResult` in the order of
+                  `commands`
+        """
+        self._check()
+
+        commands = list(commands)
+        for start in range(0, len(commands), batch_size):
+            while self._pending:
+                self._collect(timeout)
+
+            self._send(commands[start:start + batch_size])
+            while self._pending:
+                yield self._collect(timeout)
+
+    def close(self):
+        """
+        Close the remote shell.
+        """
+        if self.channel is None:
+            return
+
+        if api.library.ssh_channel_is_closed(self.channel) == 0:
+            api.library.ssh_channel_send_eof(self.channel)
+            api.library.ssh_channel_close(self.channel)
+        api.library.ssh_channel_free(self.channel)
+        self.channel = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
@@ -2,6 +2,7 @@
 
 from __future__ import unicode_literals
 import functools
+import time
 import warnings
 
 from . import api
@@ -11,9 +12,15 @@ from . import exceptions as exp
 
 from . import shell
 from . import sftp
+from . import forward
+from . import runner
+from .options import SessionOptions
 from ctypes import byref, c_char_p
 
 
+_DEFAULT_OPTIONS = SessionOptions()
+
+
 def _lazy_connect(func):
     @functools.wraps(func)
     def _decorator(self, *args, **kwargs):
@@ -49,6 +56,22 @@ class Session(object):
     :param func verify_knownhost_callback: function which gets called upon connecting to host. Should return
         True if connection is allowed, False otherwise. The only parameter to the function is remote host key 
         SHA1 hash. WARNING: you should always verify host signature!
+    :param compression: compress the ssh transport (zlib): True, False or a
+        string with the algorithms list in preference order (like
+        ``"zlib@openssh.com,zlib,none"``). By default libssh does not
+        compress. Useful on slow links with compressible data, it only costs
+        cpu on fast ones.
+    :param int compression_level: zlib compression level, from 1 (fast) to 9
+    :param options: :py:class:`~pyssh.options.SessionOptions` with the other
+        libssh options (timeouts, algorithms, config file...). One instance
+        can be shared by any number of sessions. `compression` and
+        `compression_level` take precedence over the same options on it.
+    :param float connect_timeout: seconds waiting for the connection
+        (``SSH_OPTIONS_TIMEOUT``, libssh also uses it for its other
+        blocking waits). Takes precedence over the `timeout` option of
+        `options`.
+    :param float timeout: default maximum seconds of each :py:meth:`execute`
+        and sftp transfer, see their `deadline` parameter
     """
 
     session = None
@@ -58,7 +81,25 @@ class Session(object):
     _closed = False
     _connected = False
 
-    def __init__(self, hostname, port=22, username=None, password=None, passphrase=None, verify_knownhost_callback=None):
+    def __init__(self, hostname, port=22, username=None, password=None, passphrase=None, verify_knownhost_callback=None,
+                 compression=None, compression_level=None, options=None, connect_timeout=None,
+                 timeout=None):
+        if options is None:
+            options = _DEFAULT_OPTIONS
+
+        changes = {}
+        if compression is not None:
+            changes["compression"] = compression
+        if compression_level is not None:
+            changes["compression_level"] = compression_level
+        if connect_timeout is not None:
+            changes["timeout"] = connect_timeout
+        if changes:
+            options = options.replace(**changes)
+
+        self.options = options
+        self.timeout = timeout
+
         self.session = api.library.ssh_new()
 
         if isinstance(hostname, compat.text_type):
@@ -94,8 +135,23 @@ class Session(object):
         api.library.ssh_options_set(self.session, api.SSH_OPTIONS_PORT_STR, self.port)
         api.library.ssh_options_set(self.session, api.SSH_OPTIONS_HOST, self.hostname)
 
+        try:
+            options.apply(self.session)
+        except Exception:
+            api.library.ssh_free(self.session)
+            self.session = None
+            self._closed = True
+            raise
+
         self.verify_knownhost_callback = verify_knownhost_callback
 
+    def _clone(self):
+        # New (not connected) session with the same connection parameters
+        return Session(self.hostname, port=self.port, username=self.username,
+                       password=self.password, passphrase=self.passphrase,
+                       verify_knownhost_callback=self.verify_knownhost_callback,
+                       options=self.options, timeout=self.timeout)
+
     def _connect_if_not_connected(self):
         # Do nothing if it is connected
         if self._connected:
@@ -103,35 +159,67 @@ class Session(object):
 
         self._connected = True
 
+        started = time.time()
         ret = api.library.ssh_connect(self.session)
         if ret != api.SSH_OK:
+            elapsed = time.time() - started
             remote_msg = compat.to_text(api.library.ssh_get_error(self.session))
             msg = ("Unable to connect to remote server. "
                    "(Return code: {0}, Return message: {1})")
 
+            # libssh returns the same error code for every failure, and
+            # its messages change between versions: a failure after
+            # waiting the whole timeout (less the rounding of libssh
+            # to milliseconds) is taken as a timeout.
+            timeout = self.options.timeout
+            if timeout is not None and elapsed >= timeout - 0.01:
+                raise exp.ConnectTimeoutError(msg.format(ret, remote_msg))
             raise exp.ConnectionError(msg.format(ret, remote_msg))
 
-        if self.verify_knownhost_callback is not None:
-            hash = c_char_p()
-            try:
-                hashlen = api.library.ssh_get_pubkey_hash(self.session, byref(hash))
-                if hashlen < 1:
-                    raise exp.HostVerificationError("Error verifying remote host - could not fetch pubkey hash.")
-                if not self.verify_knownhost_callback(hash.value[0:hashlen]):
-                    raise exp.HostVerificationError("Error verifying remote host - host not authentic.")
-            finally:
-                api.library.ssh_clean_pubkey_hash(hash)
+        self._verify_knownhost()
+        self._check_userauth(self._userauth())
+
+    def _deadline(self, deadline=None):
+        # Deadline of an operation starting now: the earliest of the given
+        # one and the end of the per operation timeout.
+        if self.timeout is None:
+            return deadline
+
+        timeout_deadline = time.time() + self.timeout
+        if deadline is None:
+            return timeout_deadline
+        return min(deadline, timeout_deadline)
 
+    def _verify_knownhost(self):
+        if self.verify_knownhost_callback is None:
+            return
+
+        hash = c_char_p()
+        try:
+            hashlen = api.library.ssh_get_pubkey_hash(self.session, byref(hash))
+            if hashlen < 1:
+                raise exp.HostVerificationError("Error verifying remote host - could not fetch pubkey hash.")
+            if not self.verify_knownhost_callback(hash.value[0:hashlen]):
+                raise exp.HostVerificationError("Error verifying remote host - host not authentic.")
+        finally:
+            api.library.ssh_clean_pubkey_hash(hash)
+
+    def _userauth(self):
+        # Single authentication attempt, returns the libssh return code.
         if self.password is not None:
-            ret = api.library.ssh_userauth_password(self.session, None, self.password)
-            if ret != api.SSH_AUTH_SUCCESS:
-                raise exp.AuthenticationError("Error when trying authenticate with password. "
-                                              "(Error code: {0})".format(ret))
-        else:
-            ret = api.library.ssh_userauth_autopubkey(self.session, self.passphrase)
-            if ret != api.SSH_AUTH_SUCCESS:
-                raise exp.AuthenticationError("Error when trying authenticate with pubkey. "
-                                              "(Error code: {0})".format(ret))
+            return api.library.ssh_userauth_password(self.session, None, self.password)
+        return api.library.ssh_userauth_autopubkey(self.session, self.passphrase)
+
+    def _check_userauth(self, ret):
+        if ret == api.SSH_AUTH_SUCCESS:
+            return
+
+        if self.password is not None:
+            raise exp.AuthenticationError("Error when trying authenticate with password. "
+                                          "(Error code: {0})".format(ret))
+        raise exp.AuthenticationError("Error when trying authenticate with pubkey. "
+                                      "(Error code: {0})".format(ret))
+
     def close(self):
         """
         Close initialized ssh connection.
@@ -179,17 +267,120 @@ class Session(object):
 
     @_check_open_session
     @_lazy_connect
-    def execute(self, command, lazy=False):
+    def create_runner(self, shell=runner.DEFAULT_SHELL, chunk_size=result.DEFAULT_CHUNK_SIZE):
+        """
+        Open a remote shell for running many commands without the channel
+        setup of :py:meth:`execute` on each one.
+
+        :param str shell: remote shell command (default: /bin/sh)
+        :param int chunk_size: maximum number of bytes read at once
+
+        :returns: ShellRunner instance
+        :rtype: :py:class:`pyssh.runner.ShellRunner`
+        """
+        return runner.ShellRunner(self, shell=shell, chunk_size=chunk_size)
+
+    @_check_open_session
+    @_lazy_connect
+    def forward_local(self, local_port, remote_host, remote_port, local_host="127.0.0.1"):
+        """
+        Forward connections to a local port to `remote_host`:`remote_port`
+        through the remote server (like ``ssh -L``).
+
+        Connections are relayed from a background thread, so the session
+        should not be used for anything else until the forward is closed.
+
+        :param int local_port: local port to listen on, 0 for any free port
+        :param str remote_host: host to connect to from the remote server
+        :param int remote_port: port to connect to from the remote server
+        :param str local_host: local address to listen on
+
+        :returns: running forward, with byte and latency counters on its
+                  `stats` attribute
+        :rtype: :py:class:`pyssh.forward.LocalForward`
+        """
+        return forward.LocalForward(self, local_port, remote_host, remote_port,
+                                    local_host=local_host).start()
+
+    @_check_open_session
+    @_lazy_connect
+    def forward_remote(self, remote_port, local_host, local_port, remote_host="localhost"):
+        """
+        Forward connections to a port of the remote server to
+        `local_host`:`local_port` (like ``ssh -R``).
+
+        Connections are relayed from a background thread, so the session
+        should not be used for anything else until the forward is closed.
+
+        :param int remote_port: port to listen on the remote server,
+                                0 for any free port
+        :param str local_host: host to connect to from this side
+        :param int local_port: port to connect to from this side
+        :param str remote_host: address to listen on the remote server
+
+        :returns: running forward, with the port listening on the server
+                  on its `remote_port` attribute
+        :rtype: :py:class:`pyssh.forward.RemoteForward`
+        """
+        return forward.RemoteForward(self, remote_port, local_host, local_port,
+                                     remote_host=remote_host).start()
+
+    @_check_open_session
+    @_lazy_connect
+    def socks_proxy(self, local_port=1080, local_host="127.0.0.1"):
+        """
+        Start a SOCKS5 proxy that connects through the remote server
+        (like ``ssh -D``), with one channel of this session per connection.
+
+        Connections are relayed from a background thread, so the session
+        should not be used for anything else until the proxy is closed.
+
+        :param int local_port: local port to listen on, 0 for any free port
+        :param str local_host: local address to listen on
+
+        :rtype: :py:class:`pyssh.forward.SocksProxy`
+        """
+        return forward.SocksProxy(self, local_port, local_host=local_host).start()
+
+    @_check_open_session
+    @_lazy_connect
+    def execute(self, command, lazy=False, chunk_size=result.DEFAULT_CHUNK_SIZE,
+                stderr_limit=result.DEFAULT_STDERR_LIMIT, sink=None, spool_size=None,
+                deadline=None, fill=False):
         """
         Execute command on remote host.
 
         This command can return :py:class:`~pyssh.result.Result` or
         :py:class:`~pyssh.result.LazyResult` depending of lazy parameter.
 
+        With a `sink` the output is written to it as it arrives (see
+        :py:meth:`~pyssh.result.LazyResult.stream_to`) and the returned
+        result only holds the return code and stderr. With a `spool_size`
+        the result is a :py:class:`~pyssh.result.SpooledResult` that
+        spills output larger than `spool_size` bytes to a temporary file.
+
         :param str command: command string
         :param bool lazy: set true for return a lazy result
                           instead a evaluated. Useful for execute
                           commands with large output (default: False)
+        :param int chunk_size: maximum number of bytes read from the
+                               channel at once (default: 64 KiB)
+        :param int stderr_limit: maximum number of stderr bytes kept by
+                                 lazy results, None for no limit
+                                 (default: 64 KiB). Evaluated results
+                                 keep all stderr output.
+        :param sink: writable binary file, socket or callable
+        :param int spool_size: maximum number of output bytes kept in memory
+        :param float deadline: :py:func:`time.time` value after which waiting
+                               for the command raises
+                               :py:class:`~pyssh.exceptions.DeadlineExceeded`
+                               (also bounded by the session `timeout`). On
+                               lazy results it applies to the iteration.
+        :param bool fill: wait for up to `chunk_size` bytes of output
+                          in libssh before returning each chunk (see
+                          :py:class:`~pyssh.result.LazyResult`). Lowers
+                          the GIL contention when many threads execute
+                          commands with large output.
 
         :returns: Result instance
         :rtype: :py:class:`pyssh.result.Result`
@@ -198,8 +389,46 @@ class Session(object):
         if isinstance(command, compat.text_type):
             command = compat.to_bytes(command)
 
-        if lazy:
-            _result = result.LazyResult(self.session, command)
+        deadline = self._deadline(deadline)
+
+        if sink is not None:
+            _result = result.LazyResult(self.session, command, chunk_size=chunk_size,
+                                        stderr_limit=stderr_limit, deadline=deadline,
+                                        fill=fill)
+            _result.stream_to(sink)
+        elif spool_size is not None:
+            _result = result.SpooledResult(self.session, command, chunk_size=chunk_size,
+                                           spool_size=spool_size, deadline=deadline,
+                                           fill=fill)
+        elif lazy:
+            _result = result.LazyResult(self.session, command, chunk_size=chunk_size,
+                                        stderr_limit=stderr_limit, deadline=deadline,
+                                        fill=fill)
         else:
-            _result = result.Result(self.session, command)
+            _result = result.Result(self.session, command, chunk_size=chunk_size,
+                                    deadline=deadline, fill=fill)
         return _result
+
+    @_check_open_session
+    @_lazy_connect
+    def execute_many(self, commands, chunk_size=result.DEFAULT_CHUNK_SIZE, max_channels=10):
+        """
+        Execute several commands at same time over this session.
+
+        Every command runs on its own channel of the same connection, so
+        all of them share one TCP connection and one handshake. Channels
+        are polled together and results are returned as each command
+        finishes (not in the order of `commands`).
+
+        :param list commands: list of command strings
+        :param int chunk_size: maximum number of bytes read from each
+                               channel at once (default: 64 KiB)
+        :param int max_channels: maximum number of channels open at same
+                                 time (OpenSSH servers allow 10 by default)
+
+        :returns: generator of Result instances
+        :rtype: generator of :py:class:`pyssh.result.Result`
+        """
+        commands = [compat.to_bytes(x) for x in commands]
+        return result.execute_many(self.session, commands, chunk_size=chunk_size,
+                                   max_channels=max_channels)
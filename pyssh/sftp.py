@@ -2,16 +2,38 @@
 
 from __future__ import unicode_literals
 
+import collections
 import ctypes
+import hashlib
+import json
+import select
 import stat
 import os
 import io
+import posixpath
+import threading
+import weakref
+import zlib
+
+from six.moves import queue as _queue
+from six.moves import shlex_quote
 
 from . import api
 from . import compat
+from . import result
 from . import exceptions as exp
 
 
+# SftpFile read cache defaults
+DEFAULT_BLOCK_SIZE = 64 * 1024
+DEFAULT_CACHE_BLOCKS = 64
+DEFAULT_READ_AHEAD = 8
+
+# SftpFile.mmap defaults
+DEFAULT_MMAP_PAGES = 256
+DEFAULT_MMAP_PREFETCH = 2
+
+
 class Sftp(object):
     """
     Sftp wrapper.
@@ -29,24 +51,47 @@ class Sftp(object):
     sftp = None
     session = None
 
+    _write_limit = None
+    _closed = False
+
     def __init__(self, session, buffer_size=1024*16):
         self.session_wrapper = session
         self.session = session.session
 
         self.buffer_size = buffer_size
 
+        # Files opened with open() not closed yet, closed before
+        # freeing the sftp session.
+        self._files = weakref.WeakSet()
+
         # TODO: handle exceptions
         self.sftp = api.library.sftp_new(self.session)
         api.library.sftp_init(self.sftp)
 
     def _get_file_metadata(self, file_ptr):
         attrs_ptr = api.library.sftp_fstat(file_ptr)
-        if attrs_ptr is None:
+        if not attrs_ptr:
             msg = api.library.ssh_get_error(self.session)
             raise exp.ConnectionError("Error raised by ssh: {0}".format(msg.decode("utf-8")))
 
-        attrs = ctypes.cast(attrs_ptr, ctypes.POINTER(api.SftpAttributes))
-        return attrs.contents
+        return SftpStat._from_pointer(attrs_ptr)
+
+    def _max_write_length(self):
+        # Largest write accepted by the server, only needed (and known)
+        # with the asynchronous io api: libssh rejects larger ones.
+        if not api.HAS_SFTP_AIO:
+            return None
+
+        if self._write_limit is None:
+            limits = api.library.sftp_limits(self.sftp)
+            if not limits:
+                raise exp.SftpError(self._error_message())
+            try:
+                self._write_limit = limits.contents.max_write_length
+            finally:
+                api.library.sftp_limits_free(limits)
+
+        return self._write_limit
 
     def _open_remote_file(self, path):
         remote_file_ptr = api.library.sftp_open(self.sftp, path, os.O_RDONLY, stat.S_IRWXU)
@@ -57,69 +102,185 @@ class Sftp(object):
 
         return remote_file_ptr
 
-    def get(self, remote_path, local_path):
+    def _open_remote_file_for_write(self, path, access_type):
+        remote_file_ptr = api.library.sftp_open(self.sftp, path, access_type, stat.S_IRWXU)
+
+        if remote_file_ptr is None:
+            msg = api.library.ssh_get_error(self.session)
+            raise exp.ConnectionError("Error raised by ssh: {0}".format(msg.decode("utf-8")))
+
+        return remote_file_ptr
+
+    def get(self, remote_path, local_path, window=None, chunk_size=None,
+            resume=False, verify=False, streams=None, progress=None, compress=None,
+            deadline=None):
         """
         Get a remote file to local.
 
+        By default the file is downloaded with one blocking read at a time.
+        If `window` is greater than 1, up to `window` read requests are kept
+        in flight using the libssh asynchronous read api, so that each chunk
+        does not pay a full network round trip.
+
+        Each chunk costs a few python operations holding the GIL, so when
+        many threads transfer at the same time a larger `chunk_size` (64 KiB
+        is accepted by any OpenSSH server) scales better than the default.
+
+        With `resume`, progress is recorded on a small sidecar file next to
+        the local file (``<local_path>.pyssh-checkpoint``) and a later call
+        continues an interrupted download where it stopped, as long as the
+        remote file size did not change. With `verify`, the checkpoint also
+        keeps a hash of each downloaded block and on resume the local data
+        is checked against them; the download continues from the first
+        block that does not match.
+
+        With `streams` greater than 1, the file is split in that number of
+        byte ranges, each one downloaded through its own sftp channel (with
+        its own flow control window) of this session, and written at its
+        offset of the local file. `progress` is called with the number of
+        bytes transferred (across all streams) and the total size.
+
+        With `compress` (``"gzip"`` or ``"zstd"``) the file is not read
+        through sftp: it is compressed on the fly by that command on the
+        remote host and decompressed here as it arrives. On compressible
+        data and bandwidth limited links this moves much less bytes;
+        ``"zstd"`` needs the `zstandard` package and the remote command.
+
+        With a `deadline` (a :py:func:`time.time` value, also bounded by the
+        session `timeout`) the file is read without blocking and
+        :py:class:`~pyssh.exceptions.DeadlineExceeded` is raised when the
+        transfer is not complete by then.
+
         :param str remote_path: remote file path
         :param str local_path:  local file path
+        :param int window: number of read requests kept in flight
+                           (per stream)
+        :param int chunk_size: size of each read request
+                               (default: sftp buffer_size)
+        :param bool resume: resume a previously interrupted download
+        :param bool verify: keep and check block hashes of local data
+        :param int streams: number of parallel streams
+        :param callable progress: function called with transferred and
+                                  total bytes on multi stream transfers
+        :param str compress: remote compression command
+        :param float deadline: time limit of the whole transfer
         """
         remote_path = compat.to_bytes(remote_path)
+        deadline = self.session_wrapper._deadline(deadline)
 
-        # Create new pointer to remote file
-        remote_file_ptr = self._open_remote_file(remote_path)
-
-        # Obtain metadata with remote file size
-        remote_file_attrs = self._get_file_metadata(remote_file_ptr)
+        if compress is not None:
+            if resume or (streams is not None and streams > 1):
+                raise ValueError("compress is not supported on resumed or multi stream transfers")
+            return self._get_compressed(remote_path, local_path, compress, deadline)
 
-        stats = {
-            "total_readed": 0,
-            "total_size": remote_file_attrs.size,
-            "errors_counter": 0,
-        }
+        if chunk_size is None:
+            chunk_size = self.buffer_size
 
-        def read_pipeline(f):
-            while True:
-                buffer = ctypes.create_string_buffer(self.buffer_size)
-                readed = api.library.sftp_read(remote_file_ptr, ctypes.byref(buffer),
-                                               self.buffer_size)
-                if readed == 0:
-                    if stats["total_readed"] != stats["total_size"]:
-                        stats["errors_counter"] += 1
-                        return False
-                    return True
-
-                elif readed < 0:
-                    raise exp.ConnectionError("Connection interrumped")
+        if streams is not None and streams > 1:
+            if resume:
+                raise ValueError("resume is not supported on multi stream transfers")
+            return self._get_streams(remote_path, local_path, streams,
+                                     window or DEFAULT_STREAM_WINDOW, chunk_size, progress,
+                                     deadline)
 
-                else:
-                    stats["errors_counter"] = 0
-                    stats["total_readed"] += readed
-                    f.write(buffer.raw[:readed])
+        remote_file_ptr = self._open_remote_file(remote_path)
 
         try:
-            with io.open(local_path, "wb") as f:
-                while stats["errors_counter"] < 3:
-                    ok = read_pipeline(f)
-                    if ok:
+            total_size = self._get_file_metadata(remote_file_ptr).st_size
+
+            checkpoint = None
+            if resume:
+                checkpoint = _Checkpoint(local_path, remote_path, total_size, verify=verify)
+
+            mode = "r+b" if resume and os.path.exists(local_path) else "w+b"
+            with io.open(local_path, mode) as f:
+                offset = checkpoint.load(f) if checkpoint is not None else 0
+                f.seek(offset)
+                f.truncate()
+
+                writer = _LocalWriter(f, offset, checkpoint)
+                errors_counter = 0
+
+                while True:
+                    if deadline is not None:
+                        # Non-blocking reads, waiting at most until the deadline
+                        api.library.sftp_file_set_nonblocking(remote_file_ptr)
+                        replies = _read_pipelined(remote_file_ptr, total_size, window or 1,
+                                                  chunk_size, offset=writer.offset)
+                        replies = _round_robin(self.session, [replies], deadline)
+                    elif window is not None and window > 1:
+                        replies = _read_pipelined(remote_file_ptr, total_size, window,
+                                                  chunk_size, offset=writer.offset)
+                    else:
+                        replies = _read_serial(remote_file_ptr, chunk_size, offset=writer.offset)
+
+                    writer.write_all(replies)
+                    if writer.offset >= total_size:
                         break
 
+                    # Short transfer: reopen the remote file and
+                    # continue from the last contiguous offset.
+                    errors_counter += 1
+                    if errors_counter >= 3:
+                        raise exp.ConnectionError("Connection errors repeated more than 3 times")
+
+                    # Not closed again below if reopening fails
                     api.library.sftp_close(remote_file_ptr)
+                    remote_file_ptr = None
                     remote_file_ptr = self._open_remote_file(remote_path)
 
-                if stats["errors_counter"] >= 3:
-                    raise exp.Connection("Connection errors repeated more than 3 times")
-
-        except (exp.ConnectionError, RuntimeError):
-            api.library.sftp_close(remote_file_ptr)
-            raise
+            if checkpoint is not None:
+                checkpoint.remove()
+        finally:
+            if remote_file_ptr is not None:
+                api.library.sftp_close(remote_file_ptr)
 
-    def put(self, path, remote_path):
+    def put(self, path, remote_path, window=None, chunk_size=None,
+            resume=False, verify=False, streams=None, progress=None, compress=None,
+            deadline=None):
         """
         Puts the local file to remote host.
 
+        By default each chunk is written and acknowledged before the next
+        one is read from disk. If `window` is greater than 1 and libssh
+        supports asynchronous sftp io (libssh >= 0.11), up to `window`
+        writes are kept unacknowledged on the wire while the following
+        chunks are read from the local file.
+
+        With `resume`, an existing remote file not larger than the local
+        one is taken as an interrupted upload and the transfer continues
+        at its length (sftp servers apply writes in order, so the remote
+        file is the checkpoint). With `verify`, the last block of the
+        remote file is read back and compared with the local file first;
+        the upload continues from the first differing byte.
+
+        With `streams` greater than 1 (and libssh >= 0.11), the file is
+        split in that number of byte ranges, each one uploaded through its
+        own sftp channel of this session. `progress` is called with the
+        number of bytes transferred (across all streams) and the total size.
+
+        With `compress` (``"gzip"`` or ``"zstd"``) the file is compressed
+        here while it is read and written to the standard input of that
+        command on the remote host, which decompresses it to
+        `remote_path` (see :py:meth:`get`).
+
+        With a `deadline` (see :py:meth:`get`) acknowledgements are waited
+        without blocking when libssh supports asynchronous sftp io, and
+        checked between writes otherwise.
+
         :param str path: local file path
         :param str remote_path: remote file path
+        :param int window: number of unacknowledged writes kept in flight
+                           (per stream)
+        :param int chunk_size: size of each write request
+                               (default: sftp buffer_size)
+        :param bool resume: resume a previously interrupted upload
+        :param bool verify: check the already uploaded tail before resuming
+        :param int streams: number of parallel streams
+        :param callable progress: function called with transferred and
+                                  total bytes on multi stream transfers
+        :param str compress: remote compression command
+        :param float deadline: time limit of the whole transfer
         """
 
         if not os.path.exists(path):
@@ -128,32 +289,471 @@ class Sftp(object):
         if isinstance(remote_path, compat.text_type):
             remote_path = compat.to_bytes(remote_path, "utf-8")
 
-        access_type = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
-        remote_file_ptr = api.library.sftp_open(self.sftp, remote_path, access_type, stat.S_IRWXU)
+        deadline = self.session_wrapper._deadline(deadline)
 
-        if remote_file_ptr is None:
-            msg = api.library.ssh_get_error(self.session)
-            raise exp.ConnectionError("Error raised by ssh: {0}".format(msg.decode("utf-8")))
+        if compress is not None:
+            if resume or (streams is not None and streams > 1):
+                raise ValueError("compress is not supported on resumed or multi stream transfers")
+            return self._put_compressed(path, remote_path, compress, deadline)
+
+        if chunk_size is None:
+            chunk_size = self.buffer_size
+
+        if streams is not None and streams > 1 and api.HAS_SFTP_AIO:
+            if resume:
+                raise ValueError("resume is not supported on multi stream transfers")
+            return self._put_streams(path, remote_path, streams,
+                                     window or DEFAULT_STREAM_WINDOW, chunk_size, progress,
+                                     deadline)
+
+        access_type = os.O_WRONLY | os.O_CREAT
+        if not resume:
+            access_type |= os.O_TRUNC
+
+        remote_file_ptr = self._open_remote_file_for_write(remote_path, access_type)
+
+        try:
+            with io.open(path, "rb") as f:
+                offset = 0
+                if resume:
+                    offset = self._put_resume_offset(remote_path, remote_file_ptr, f,
+                                                     chunk_size, verify)
+                    if offset is None:
+                        # Remote file is not a prefix of this one, start again
+                        api.library.sftp_close(remote_file_ptr)
+                        remote_file_ptr = None
+                        remote_file_ptr = self._open_remote_file_for_write(
+                            remote_path, access_type | os.O_TRUNC)
+                        offset = 0
+
+                    api.library.sftp_seek64(remote_file_ptr, offset)
+                    f.seek(offset)
+
+                chunks = iter(lambda: f.read(chunk_size), b"")
+                _write_chunks(remote_file_ptr, chunks, window,
+                              session=self.session, deadline=deadline,
+                              max_write=self._max_write_length())
+        finally:
+            if remote_file_ptr is not None:
+                api.library.sftp_close(remote_file_ptr)
+
+    def _get_compressed(self, remote_path, local_path, compress, deadline):
+        codec = _compression_codec(compress)
+        command = codec.compress_command + b" " + _quote(remote_path)
+
+        _result = result.LazyResult(self.session, command, chunk_size=COMPRESSED_CHUNK_SIZE,
+                                    deadline=deadline, fill=True)
+        decompressor = codec.decompressor()
+
+        with io.open(local_path, "wb") as f:
+            for chunk in _result:
+                f.write(decompressor.decompress(chunk))
+            f.write(_flush_decompressor(decompressor))
+
+        _check_compressed_result(_result, compress)
+
+    def _put_compressed(self, path, remote_path, compress, deadline):
+        codec = _compression_codec(compress)
+        command = codec.decompress_command + b" > " + _quote(remote_path)
+
+        def compressed_chunks(f):
+            compressor = codec.compressor()
+            for chunk in iter(lambda: f.read(COMPRESSED_CHUNK_SIZE), b""):
+                yield compressor.compress(chunk)
+            yield compressor.flush()
 
         with io.open(path, "rb") as f:
+            _result = result.LazyResult(self.session, command, stdin=compressed_chunks(f),
+                                        deadline=deadline)
+            _result.wait()
+
+        _check_compressed_result(_result, compress)
+
+    def _get_streams(self, remote_path, local_path, streams, window, chunk_size, progress,
+                     deadline=None):
+        remote_file_ptr = self._open_remote_file(remote_path)
+        try:
+            total_size = self._get_file_metadata(remote_file_ptr).st_size
+        finally:
+            api.library.sftp_close(remote_file_ptr)
+
+        ranges = _split_ranges(total_size, streams, chunk_size)
+        channels = []
+        file_ptrs = []
+
+        fd = os.open(local_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666)
+        try:
+            readers = []
+            for start, end in ranges:
+                channel = Sftp(self.session_wrapper, buffer_size=self.buffer_size)
+                channels.append(channel)
+
+                file_ptr = channel._open_remote_file(remote_path)
+                file_ptrs.append(file_ptr)
+
+                api.library.sftp_file_set_nonblocking(file_ptr)
+                readers.append(_read_pipelined(file_ptr, total_size, window, chunk_size,
+                                               offset=start, end=end))
+
+            transferred = 0
+            for offset, data in _round_robin(self.session, readers, deadline):
+                _pwrite(fd, data, offset)
+                transferred += len(data)
+                if progress is not None:
+                    progress(transferred, total_size)
+
+            if transferred < total_size:
+                raise exp.SftpError("Remote file truncated while downloading "
+                                    "({0} of {1} bytes)".format(transferred, total_size))
+        finally:
+            os.close(fd)
+            for file_ptr in file_ptrs:
+                api.library.sftp_close(file_ptr)
+            for channel in channels:
+                api.library.sftp_free(channel.sftp)
+
+    def _put_streams(self, path, remote_path, streams, window, chunk_size, progress,
+                     deadline=None):
+        total_size = os.path.getsize(path)
+        ranges = _split_ranges(total_size, streams, chunk_size)
+
+        # Create or truncate the remote file once, streams only write on it.
+        access_type = os.O_WRONLY | os.O_CREAT | os.O_TRUNC
+        api.library.sftp_close(self._open_remote_file_for_write(remote_path, access_type))
+
+        channels = []
+        file_ptrs = []
+        local_files = []
+        stats = {"transferred": 0}
+
+        def range_chunks(f, start, end):
+            f.seek(start)
+            while start < end:
+                chunk = f.read(min(chunk_size, end - start))
+                if not chunk:
+                    break
+                start += len(chunk)
+                stats["transferred"] += len(chunk)
+                if progress is not None:
+                    progress(stats["transferred"], total_size)
+                yield chunk
+
+        try:
+            writers = []
+            for start, end in ranges:
+                channel = Sftp(self.session_wrapper, buffer_size=self.buffer_size)
+                channels.append(channel)
+
+                file_ptr = channel._open_remote_file_for_write(remote_path, os.O_WRONLY)
+                file_ptrs.append(file_ptr)
+
+                f = io.open(path, "rb")
+                local_files.append(f)
+
+                api.library.sftp_seek64(file_ptr, start)
+                api.library.sftp_file_set_nonblocking(file_ptr)
+                writers.append(_write_pipelined(file_ptr, range_chunks(f, start, end), window,
+                                                channel._max_write_length()))
+
+            for _ in _round_robin(self.session, writers, deadline):
+                pass
+        finally:
+            for f in local_files:
+                f.close()
+            for file_ptr in file_ptrs:
+                api.library.sftp_close(file_ptr)
+            for channel in channels:
+                api.library.sftp_free(channel.sftp)
+
+    def _put_resume_offset(self, remote_path, remote_file_ptr, f, chunk_size, verify):
+        # Returns the offset where an interrupted upload continues, or
+        # None if the remote file is larger than the local one.
+        remote_size = self._get_file_metadata(remote_file_ptr).st_size
+        local_size = os.fstat(f.fileno()).st_size
+
+        if remote_size > local_size:
+            return None
+
+        if not verify or remote_size == 0:
+            return remote_size
+
+        start = max(0, remote_size - CHECKPOINT_BLOCK_SIZE)
+        read_file_ptr = self._open_remote_file(remote_path)
+
+        try:
+            f.seek(start)
+            position = start
+            for offset, data in _read_serial(read_file_ptr, chunk_size, offset=start):
+                if offset >= remote_size:
+                    break
+
+                data = data[:remote_size - offset].tobytes()
+                local = f.read(len(data))
+                if local != data:
+                    mismatch = next(i for i in range(len(data))
+                                    if i >= len(local) or local[i:i + 1] != data[i:i + 1])
+                    return offset + mismatch
+
+                position = offset + len(data)
+
+            return position
+        finally:
+            api.library.sftp_close(read_file_ptr)
+
+    def _error_message(self):
+        msg = api.library.ssh_get_error(self.session)
+        return "Error raised by ssh: {0}".format(msg.decode("utf-8"))
+
+    def _stat(self, func, path):
+        path = compat.to_bytes(path)
+        attrs_ptr = func(self.sftp, path)
+        if not attrs_ptr:
+            if api.library.sftp_get_error(self.sftp) == api.SSH_FX_NO_SUCH_FILE:
+                return None
+            raise exp.SftpError(self._error_message())
+        return SftpStat._from_pointer(attrs_ptr, name=posixpath.basename(path.rstrip(b"/")))
+
+    def stat(self, path):
+        """
+        Get attributes of a remote path, following symbolic links.
+
+        :param str path: remote path
+        :returns: path attributes or None if the path does not exist
+        :rtype: :py:class:`SftpStat`
+        """
+        return self._stat(api.library.sftp_stat, path)
+
+    def lstat(self, path):
+        """
+        Get attributes of a remote path, without following symbolic links.
+
+        :param str path: remote path
+        :returns: path attributes or None if the path does not exist
+        :rtype: :py:class:`SftpStat`
+        """
+        return self._stat(api.library.sftp_lstat, path)
+
+    def listdir_attr(self, path="."):
+        """
+        List a remote directory with the attributes of each entry.
+
+        The server sends the attributes of many entries on each reply,
+        so this takes a few round trips regardless of the number of
+        entries. Symbolic links are not followed.
+
+        :param str path: remote directory path
+        :returns: list of :py:class:`SftpStat` (without "." and "..")
+        :rtype: list
+        """
+        return list(self._iter_dir(path))
+
+    def _iter_dir(self, path):
+        # Entries of a remote directory, read as they are consumed. The
+        # directory is closed when the generator ends or is closed.
+        path = compat.to_bytes(path)
+        dir_ptr = api.library.sftp_opendir(self.sftp, path)
+        if dir_ptr is None:
+            raise exp.SftpError(self._error_message())
+
+        try:
             while True:
-                chuck = f.read(self.buffer_size)
-                if not chuck:
+                attrs_ptr = api.library.sftp_readdir(self.sftp, dir_ptr)
+                if not attrs_ptr:
+                    if api.library.sftp_dir_eof(dir_ptr) == 0:
+                        raise exp.SftpError(self._error_message())
                     break
 
-                written = api.library.sftp_write(remote_file_ptr, chuck, len(chuck))
-                if written != len(chuck):
-                    raise RuntimeError("Can't write file")
+                attrs = SftpStat._from_pointer(attrs_ptr)
+                if attrs.name not in (".", ".."):
+                    yield attrs
+        finally:
+            api.library.sftp_closedir(dir_ptr)
 
-        api.library.sftp_close(remote_file_ptr)
+    def _find_in_dir(self, path, names, limit):
+        """
+        Look for `names` in the first `limit` entries of a directory.
 
-    def open(self, path, mode):
+        :returns: ``(found, complete)``, dict of name -> attributes and
+                  whether every name is either found or known missing.
+        """
+        found = {}
+        entries = self._iter_dir(path)
+        try:
+            for count, attrs in enumerate(entries, 1):
+                if attrs.name in names:
+                    found[attrs.name] = attrs
+                    if len(found) == len(names):
+                        return found, True
+                if count >= limit:
+                    return found, False
+        except exp.SftpError:
+            # Missing or unreadable parent, stat the paths one by one
+            return {}, False
+        finally:
+            entries.close()
+
+        return found, True
+
+    def stat_many(self, paths):
+        """
+        Get attributes of many remote paths.
+
+        There is no asynchronous stat in libssh, so instead of paying a
+        round trip per path, paths that share a parent directory are
+        looked up in a listing of the parent, where each reply brings
+        many entries. The listing stops once all the names are found or
+        after `STAT_LISTING_RATIO` entries per requested path, so large
+        directories are not read for a few names. Paths not reached by
+        the listing, symbolic links and paths with few requested siblings
+        are stated one by one.
+
+        :param list paths: remote paths
+        :returns: dict of path -> :py:class:`SftpStat`, or None for the
+                  paths that do not exist
+        :rtype: dict
+        """
+        by_parent = collections.OrderedDict()
+        for path in paths:
+            parent, name = posixpath.split(compat.to_bytes(path).rstrip(b"/"))
+            by_parent.setdefault(parent or b".", []).append((path, compat.to_name(name)))
+
+        result = {}
+        for parent, entries in by_parent.items():
+            listing, complete = {}, False
+            names = set(name for _, name in entries) - set(["", ".", ".."])
+            if len(entries) >= STAT_BATCH_MIN_SIZE and names:
+                listing, complete = self._find_in_dir(parent, names,
+                                                      len(entries) * STAT_LISTING_RATIO)
+
+            for path, name in entries:
+                attrs = listing.get(name)
+                if attrs is not None and not attrs.is_symlink():
+                    result[path] = attrs
+                elif attrs is None and complete and name in names:
+                    result[path] = None
+                else:
+                    result[path] = self.stat(path)
+
+        return result
+
+    def _walk_remote(self, remote_dir):
+        # Map of relative path -> attributes of a remote tree.
+        tree = {}
+        pending = [b""]
+        while pending:
+            relative_dir = pending.pop()
+            for attrs in self.listdir_attr(posixpath.join(remote_dir, relative_dir)):
+                relative_path = posixpath.join(relative_dir, compat.to_bytes(attrs.name))
+                tree[relative_path] = attrs
+                if attrs.is_dir():
+                    pending.append(relative_path)
+        return tree
+
+    def _mkdir(self, path, mode=0o755):
+        ret = api.library.sftp_mkdir(self.sftp, path, mode)
+        if ret != api.SSH_OK:
+            raise exp.SftpError(self._error_message())
+
+    def _set_mtime(self, path, mtime):
+        times = (api.Timeval * 2)(api.Timeval(int(mtime), 0), api.Timeval(int(mtime), 0))
+        ret = api.library.sftp_utimes(self.sftp, path, times)
+        if ret != api.SSH_OK:
+            raise exp.SftpError(self._error_message())
+
+    def sync(self, local_dir, remote_dir, workers=4, window=None):
+        """
+        Recursively copy a local directory to a remote one, only
+        transferring files that are missing or differ in size or
+        modification time.
+
+        Both trees are listed up front, missing remote directories are
+        created and changed files are uploaded by `workers` threads, each
+        one with its own session to the same host. Uploaded files get the
+        modification time of the local file, so unchanged files are skipped
+        on the next sync.
+
+        :param str local_dir: local directory path
+        :param str remote_dir: remote directory path
+        :param int workers: number of parallel uploads
+        :param int window: number of unacknowledged writes kept in flight
+                           per upload (needs libssh >= 0.11)
+
+        :returns: dict with the ``transferred`` relative paths, number of
+                  ``skipped`` files, ``directories`` created and ``bytes``
+                  uploaded
+        :rtype: dict
+        """
+        local_dir = compat.to_bytes(local_dir)
+        remote_dir = compat.to_bytes(remote_dir)
+
+        stats = {"transferred": [], "skipped": 0, "directories": 0, "bytes": 0}
+
+        if self.stat(remote_dir) is not None:
+            remote_tree = self._walk_remote(remote_dir)
+        else:
+            self._mkdir(remote_dir)
+            stats["directories"] += 1
+            remote_tree = {}
+
+        directories = []
+        changed = []
+
+        for root, dirnames, filenames in os.walk(local_dir):
+            relative_root = os.path.relpath(root, local_dir)
+            if relative_root == b".":
+                relative_root = b""
+
+            for name in sorted(dirnames):
+                relative_path = posixpath.join(relative_root, name)
+                remote = remote_tree.get(relative_path)
+                if remote is None:
+                    directories.append(relative_path)
+                elif not remote.is_dir():
+                    raise exp.SftpError("Remote path {0} is not a directory".format(
+                        compat.to_text(relative_path)))
+
+            for name in filenames:
+                relative_path = posixpath.join(relative_root, name)
+                local_stat = os.stat(os.path.join(root, name))
+                remote = remote_tree.get(relative_path)
+
+                if (remote is not None and remote.st_size == local_stat.st_size and
+                        remote.st_mtime == int(local_stat.st_mtime)):
+                    stats["skipped"] += 1
+                    continue
+
+                changed.append((relative_path, local_stat.st_size, local_stat.st_mtime))
+
+        # os.walk lists parents before children
+        for relative_path in directories:
+            self._mkdir(posixpath.join(remote_dir, relative_path))
+            stats["directories"] += 1
+
+        def upload(sftp_wrapper, item):
+            relative_path, size, mtime = item
+            remote_path = posixpath.join(remote_dir, relative_path)
+            sftp_wrapper.put(os.path.join(local_dir, relative_path), remote_path, window=window)
+            sftp_wrapper._set_mtime(remote_path, mtime)
+            return relative_path, size
+
+        for relative_path, size in _run_workers(self, changed, upload, workers):
+            stats["transferred"].append(compat.to_text(relative_path))
+            stats["bytes"] += size
+
+        return stats
+
+    def open(self, path, mode, block_size=DEFAULT_BLOCK_SIZE,
+             cache_blocks=DEFAULT_CACHE_BLOCKS, read_ahead=DEFAULT_READ_AHEAD):
         """
         Open a remote file.
 
         :param str path: remote file path
         :param int mode: open file model
                          (see http://docs.python.org/3.3/library/os.html#open-flag-constants)
+        :param int block_size: size of cached blocks
+        :param int cache_blocks: maximum number of cached blocks, 0 disables
+                                 the read cache
+        :param int read_ahead: number of blocks fetched on sequential reads
 
         :returns: SFTP File wrapper
         :rtype: pyssh.SftpFile
@@ -161,100 +761,863 @@ class Sftp(object):
         if isinstance(path, compat.text_type):
             path = compat.to_bytes(path, "utf-8")
 
-        return SftpFile(path, mode, self)
+        f = SftpFile(path, mode, self, block_size=block_size,
+                     cache_blocks=cache_blocks, read_ahead=read_ahead)
+        self._files.add(f)
+        return f
+
+    def close(self):
+        """
+        Close the files left open and the sftp session.
+        """
+        if self._closed:
+            return
+
+        for f in list(self._files):
+            f.close()
+
+        self._closed = True
+        api.library.sftp_free(self.sftp)
 
     def __enter__(self):
         return self
 
     def __exit__(self, *args, **kwargs):
-        api.library.sftp_free(self.sftp)
+        self.close()
 
 
-class SftpFile(object):
+def _read_serial(file_ptr, chunk_size, offset=0):
     """
-    SFTP File wrapper
+    Generator reading an opened remote file from `offset` to its end,
+    one blocking read at a time.
+
+    Yields ``(offset, data)`` tuples, where `data` is a memoryview of a
+    reused buffer only valid until the next iteration.
     """
+    buffer = bytearray(chunk_size)
+    buffer_view = memoryview(buffer)
+    buffer_ptr = (ctypes.c_char * chunk_size).from_buffer(buffer)
 
-    _closed = False
+    api.library.sftp_seek64(file_ptr, offset)
+
+    while True:
+        readed = api.library.sftp_read(file_ptr, buffer_ptr, chunk_size)
+        if readed == 0:
+            break
+
+        if readed < 0:
+            raise exp.ConnectionError("Connection interrumped")
+
+        yield offset, buffer_view[:readed]
+        offset += readed
+
+
+def _read_pipelined(file_ptr, total_size, window, chunk_size, offset=0, end=None):
+    """
+    Generator driving pipelined asynchronous reads of an opened remote file
+    from `offset` to its end, or to `end` if given.
+
+    Keeps up to `window` read requests in flight and yields the replies as
+    ``(offset, data)`` tuples, where `data` is a memoryview of a reused
+    buffer only valid until the next iteration. On a non-blocking file it
+    yields None when the next reply has not arrived yet.
+    """
+    buffer = bytearray(chunk_size)
+    buffer_view = memoryview(buffer)
+    buffer_ptr = (ctypes.c_char * chunk_size).from_buffer(buffer)
+
+    # Queue of in flight requests as (request id, offset, length)
+    # tuples. libssh delivers replies in request order.
+    pending = collections.deque()
+    next_offset = offset
+    eof = False
+
+    api.library.sftp_seek64(file_ptr, offset)
+
+    def begin_read(length):
+        request_id = api.library.sftp_async_read_begin(file_ptr, length)
+        if request_id < 0:
+            raise exp.ConnectionError("Connection interrumped")
+        return request_id
+
+    while True:
+        # Past the known size keep only one request in flight,
+        # enough to detect the end of file or a growing file.
+        while (not eof and len(pending) < window and
+               (next_offset < total_size or not pending) and
+               (end is None or next_offset < end)):
+            length = chunk_size if end is None else min(chunk_size, end - next_offset)
+            pending.append((begin_read(length), next_offset, length))
+            next_offset += length
+
+        if not pending:
+            break
+
+        request_id, offset, length = pending[0]
+        readed = api.library.sftp_async_read(file_ptr, buffer_ptr, length, request_id)
+        if readed == api.SSH_AGAIN:
+            yield None
+            continue
+
+        pending.popleft()
+
+        if readed < 0:
+            raise exp.ConnectionError("Connection interrumped")
+
+        if readed == 0:
+            eof = True
+            continue
+
+        yield offset, buffer_view[:readed]
+
+        if readed < length and offset + readed < total_size:
+            # Short read in the middle of the file, request the missing
+            # range again and restore the offset used by the following
+            # requests.
+            api.library.sftp_seek64(file_ptr, offset + readed)
+            missing = length - readed
+            pending.append((begin_read(missing), offset + readed, missing))
+            api.library.sftp_seek64(file_ptr, next_offset)
+
+
+DEFAULT_STREAM_WINDOW = 16
+
+# Minimum number of paths with the same parent directory that
+# Sftp.stat_many resolves with a listing instead of one stat each.
+STAT_BATCH_MIN_SIZE = 4
+
+# Maximum directory entries read by Sftp.stat_many per requested path
+# before stating the rest one by one (OpenSSH sends up to 100 entries
+# per reply, so about one round trip per path at worst).
+STAT_LISTING_RATIO = 100
+
+# Size of the chunks read from the local file or the remote command
+# on compressed transfers.
+COMPRESSED_CHUNK_SIZE = 256 * 1024
+
+_Codec = collections.namedtuple("_Codec", ["compress_command", "decompress_command",
+                                           "compressor", "decompressor"])
+
+
+def _compression_codec(name):
+    """
+    Remote commands and local (de)compressor factories of a compressed
+    transfer. The remote commands favour speed over ratio, as the
+    compression runs while the data is sent.
+    """
+    if name == "gzip":
+        return _Codec(b"gzip -1 -c --", b"gzip -d -c",
+                      lambda: zlib.compressobj(1, zlib.DEFLATED, 16 + zlib.MAX_WBITS),
+                      lambda: zlib.decompressobj(16 + zlib.MAX_WBITS))
+
+    if name == "zstd":
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstd compression needs the zstandard package")
+
+        return _Codec(b"zstd -1 -q -c --", b"zstd -d -q -c",
+                      lambda: zstandard.ZstdCompressor(level=1).compressobj(),
+                      lambda: zstandard.ZstdDecompressor().decompressobj())
+
+    raise ValueError("Unsupported compression: {0!r}".format(name))
+
+
+def _flush_decompressor(decompressor):
+    # zstandard decompression objects only have flush on recent versions
+    flush = getattr(decompressor, "flush", None)
+    return flush() if flush is not None else b""
+
+
+def _quote(path):
+    return compat.to_bytes(shlex_quote(compat.to_text(path)))
+
+
+def _check_compressed_result(_result, compress):
+    if _result.return_code != 0:
+        raise exp.SftpError("Remote {0} command failed with exit status {1}: {2}".format(
+            compress, _result.return_code, _result.stderr.decode("utf-8", "replace").strip()))
+
+
+def _split_ranges(size, streams, chunk_size):
+    """
+    Split `size` bytes in up to `streams` contiguous ``(start, end)``
+    ranges aligned to `chunk_size`.
+    """
+    per_stream = -(-size // streams)
+    per_stream = max(chunk_size, -(-per_stream // chunk_size) * chunk_size)
+    return [(start, min(start + per_stream, size))
+            for start in range(0, size, per_stream)] or [(0, 0)]
+
+
+def _round_robin(session, transfers, deadline=None):
+    """
+    Drive several non-blocking transfer generators (see
+    :py:func:`_read_pipelined` and :py:func:`_write_pipelined`) on the same
+    session, yielding the items they produce. When none of them can make
+    progress, waits until the session socket is readable.
+
+    Raises :py:class:`~pyssh.exceptions.DeadlineExceeded` if the transfers
+    are not finished by `deadline`.
+    """
+    active = list(transfers)
+    wait = 0.1
+
+    while active:
+        if deadline is not None:
+            wait = min(0.1, result.time_left(deadline))
+
+        progressed = False
+
+        for transfer in list(active):
+            try:
+                item = next(transfer)
+            except StopIteration:
+                active.remove(transfer)
+                progressed = True
+                continue
+
+            if item is not None:
+                progressed = True
+                yield item
+
+        if active and not progressed:
+            select.select([api.library.ssh_get_fd(session)], [], [], wait)
+
+
+def _pwrite(fd, data, offset):
+    """
+    Write all `data` at `offset` of a file descriptor.
+    """
+    view = memoryview(data)
+    while view:
+        if hasattr(os, "pwrite"):
+            written = os.pwrite(fd, view, offset)
+        else:
+            os.lseek(fd, offset, os.SEEK_SET)
+            written = os.write(fd, view)
+
+        view = view[written:]
+        offset += written
+
+
+def _run_workers(sftp_wrapper, items, func, workers):
+    """
+    Call ``func(sftp, item)`` for each item, from `workers` threads each
+    one with its own session and sftp channel (libssh sessions can not
+    be shared between threads), and yield the results.
+    """
+    if workers <= 1 or len(items) <= 1:
+        for item in items:
+            yield func(sftp_wrapper, item)
+        return
+
+    pending = _queue.Queue()
+    for item in items:
+        pending.put(item)
+
+    results = _queue.Queue()
+
+    def worker():
+        try:
+            with sftp_wrapper.session_wrapper._clone() as session, session.create_sftp() as sftp:
+                while True:
+                    try:
+                        item = pending.get_nowait()
+                    except _queue.Empty:
+                        break
+                    results.put((func(sftp, item), None))
+        except Exception as e:
+            results.put((None, e))
+        finally:
+            results.put(_WORKER_DONE)
+
+    threads = [threading.Thread(target=worker) for _ in range(min(workers, len(items)))]
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+
+    running = len(threads)
+    error = None
+    while running:
+        item = results.get()
+        if item is _WORKER_DONE:
+            running -= 1
+            continue
+
+        result, e = item
+        if e is not None:
+            # Stop the other workers and raise once all of them finished
+            error = error or e
+            while True:
+                try:
+                    pending.get_nowait()
+                except _queue.Empty:
+                    break
+            continue
+
+        yield result
+
+    if error is not None:
+        raise error
+
+
+_WORKER_DONE = object()
+
+
+CHECKPOINT_SUFFIX = ".pyssh-checkpoint"
+CHECKPOINT_BLOCK_SIZE = 8 * 1024 * 1024
+
+
+class _Checkpoint(object):
+    """
+    Sidecar file recording the progress of a resumable download.
+
+    Progress is saved each time a new block of `block_size` bytes is
+    completely transferred. With `verify`, a sha1 hash of each block is
+    saved too and checked against the local file on resume.
+    """
+
+    def __init__(self, local_path, remote_path, size, verify=False,
+                 block_size=CHECKPOINT_BLOCK_SIZE):
+        # Suffix of the same type as the path, bytes paths may not be
+        # valid in any encoding.
+        suffix = CHECKPOINT_SUFFIX
+        if isinstance(local_path, compat.binary_type):
+            suffix = compat.to_bytes(suffix)
+
+        self.path = local_path + suffix
+        self.remote_path = compat.to_name(compat.to_bytes(remote_path))
+        self.size = size
+        self.verify = verify
+        self.block_size = block_size
+
+        self.hashes = []
+        self._saved_offset = 0
+
+    def load(self, f):
+        """
+        Read the sidecar file and return the offset where the download
+        continues, or 0 if there is nothing to resume.
+        """
+        try:
+            with io.open(self.path, "r", encoding="utf-8") as fp:
+                state = json.load(fp)
+        except (IOError, OSError, ValueError):
+            return 0
+
+        if (state.get("remote_path") != self.remote_path or
+                state.get("size") != self.size or
+                state.get("block_size") != self.block_size):
+            return 0
+
+        f.seek(0, io.SEEK_END)
+        offset = min(state.get("offset", 0), f.tell())
+
+        if self.verify:
+            valid = 0
+            f.seek(0)
+            for expected in state.get("hashes") or []:
+                block = f.read(self.block_size)
+                if len(block) < self.block_size or hashlib.sha1(block).hexdigest() != expected:
+                    break
+                valid += 1
+
+            self.hashes = state["hashes"][:valid]
+            offset = min(offset, valid * self.block_size)
+
+        self._saved_offset = offset
+        return offset
+
+    def update(self, f, offset):
+        """
+        Record that the first `offset` bytes are transferred.
+        """
+        if self.verify and (len(self.hashes) + 1) * self.block_size <= offset:
+            position = f.tell()
+            f.flush()
+
+            while (len(self.hashes) + 1) * self.block_size <= offset:
+                f.seek(len(self.hashes) * self.block_size)
+                self.hashes.append(hashlib.sha1(f.read(self.block_size)).hexdigest())
+
+            f.seek(position)
+
+        if offset - self._saved_offset >= self.block_size:
+            self.save(f, offset)
+
+    def save(self, f, offset):
+        f.flush()
+
+        state = {
+            "remote_path": self.remote_path,
+            "size": self.size,
+            "block_size": self.block_size,
+            "offset": offset,
+            "hashes": self.hashes,
+        }
+
+        # Write and rename so an interruption never leaves a broken file
+        temp_path = self.path + ".tmp"
+        with io.open(temp_path, "w", encoding="utf-8") as fp:
+            fp.write(compat.to_text(json.dumps(state)))
+        os.rename(temp_path, self.path)
+
+        self._saved_offset = offset
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class _LocalWriter(object):
+    """
+    Write ``(offset, data)`` replies of a remote file read to a local file.
+
+    Keeps track of the length transferred without holes (`offset`), even
+    when replies arrive out of order, and reports it to the checkpoint.
+    """
+
+    def __init__(self, f, offset=0, checkpoint=None):
+        self.f = f
+        self.offset = offset
+        self.checkpoint = checkpoint
+
+        self._position = offset
+        self._ahead = {}
+
+    def write(self, offset, data):
+        if offset != self._position:
+            self.f.seek(offset)
+
+        self.f.write(data)
+        self._position = offset + len(data)
+
+        if offset != self.offset:
+            self._ahead[offset] = len(data)
+            return
+
+        self.offset += len(data)
+        while self.offset in self._ahead:
+            self.offset += self._ahead.pop(self.offset)
+
+        if self.checkpoint is not None:
+            self.checkpoint.update(self.f, self.offset)
+            self._position = self.f.tell()
+
+    def write_all(self, replies):
+        try:
+            for offset, data in replies:
+                self.write(offset, data)
+        finally:
+            if self.checkpoint is not None:
+                self.checkpoint.save(self.f, self.offset)
+
+
+def _write_pipelined(file_ptr, chunks, window, max_write=None):
+    """
+    Generator driving pipelined asynchronous writes of an iterable of
+    bytes chunks to an opened remote file.
+
+    A new write is sent without waiting for the previous ones and
+    acknowledgements are checked (oldest first) only when the window
+    is full or all chunks are sent. On a non-blocking file it yields
+    None while waiting for an acknowledgement.
+
+    Chunks larger than `max_write` (the server limit, see
+    :py:meth:`Sftp._max_write_length`) are sent as several writes.
+    """
+    # Queue of in flight writes as (aio handle, length, data) tuples. The
+    # data reference is kept until the write is acknowledged.
+    pending = collections.deque()
+
+    try:
+        chunks = iter(chunks)
+        exhausted = False
+
+        # Chunk being sent and number of its bytes already sent
+        chunk = None
+        sent = 0
+
+        while chunk is not None or not exhausted or pending:
+            if len(pending) < window and (chunk is not None or not exhausted):
+                if chunk is None:
+                    chunk = next(chunks, None)
+                    sent = 0
+                    if chunk is None:
+                        exhausted = True
+                        continue
+                    if not chunk:
+                        chunk = None
+                        continue
+
+                length = len(chunk) - sent
+                if max_write is not None:
+                    length = min(length, max_write)
+                data = chunk if length == len(chunk) else chunk[sent:sent + length]
+
+                aio = ctypes.c_void_p()
+                ret = api.library.sftp_aio_begin_write(file_ptr, data, length, ctypes.byref(aio))
+                if ret <= 0:
+                    raise RuntimeError("Can't write file")
+
+                # Bytes not taken by this write go on the next one
+                pending.append((aio, ret, data))
+                sent += ret
+                if sent >= len(chunk):
+                    chunk = None
+                continue
+
+            aio, length, data = pending[0]
+            written = api.library.sftp_aio_wait_write(ctypes.byref(aio))
+            if written == api.SSH_AGAIN:
+                yield None
+                continue
+
+            pending.popleft()
+            if written != length:
+                raise RuntimeError("Can't write file")
+    finally:
+        # On errors release handles of writes that never were waited.
+        while pending:
+            aio, _, _ = pending.popleft()
+            api.library.sftp_aio_free(aio)
+
+
+def _write_chunks(file_ptr, chunks, window=None, session=None, deadline=None, max_write=None):
+    """
+    Write an iterable of bytes chunks to an opened remote file.
+
+    With a `window` greater than 1 and asynchronous sftp io available
+    in libssh, writes are pipelined (see :py:func:`_write_pipelined`),
+    each one of `max_write` bytes at most.
+    With a `deadline` the writes are pipelined on the non-blocking file
+    and the acknowledgements are waited in `session` until the deadline.
+    """
+    if deadline is not None and api.HAS_SFTP_AIO:
+        api.library.sftp_file_set_nonblocking(file_ptr)
+        writer = _write_pipelined(file_ptr, chunks, window or 1, max_write)
+        for _ in _round_robin(session, [writer], deadline):
+            pass
+        return
+
+    if window is None or window <= 1 or not api.HAS_SFTP_AIO:
+        for chunk in chunks:
+            if deadline is not None:
+                result.time_left(deadline)
+            written = api.library.sftp_write(file_ptr, chunk, len(chunk))
+            if written != len(chunk):
+                raise RuntimeError("Can't write file")
+        return
+
+    for _ in _write_pipelined(file_ptr, chunks, window, max_write):
+        pass
+
+
+class SftpStat(object):
+    """
+    Attributes of a remote file, named like the :py:func:`os.stat` ones.
+
+    :ivar str name: file name. Bytes not valid in utf-8 are decoded with
+                    ``surrogateescape`` (kept as bytes on python 2), so
+                    the name can be passed back to other methods.
+    :ivar int type: one of the ``pyssh.api.SSH_FILEXFER_TYPE_*`` constants
+    :ivar int st_mode: file type and permission bits
+    :ivar int st_size: size in bytes
+    :ivar int st_uid: owner user id
+    :ivar int st_gid: owner group id
+    :ivar int st_atime: last access time
+    :ivar int st_mtime: last modification time
+    :ivar str owner: owner user name (only sent by sftp v4+ servers)
+    :ivar str group: owner group name (only sent by sftp v4+ servers)
+    """
+
+    __slots__ = ("name", "type", "st_mode", "st_size", "st_uid", "st_gid",
+                 "st_atime", "st_mtime", "owner", "group")
+
+    def __init__(self, name, type, st_mode, st_size, st_uid, st_gid,
+                 st_atime, st_mtime, owner=None, group=None):
+        self.name = name
+        self.type = type
+        self.st_mode = st_mode
+        self.st_size = st_size
+        self.st_uid = st_uid
+        self.st_gid = st_gid
+        self.st_atime = st_atime
+        self.st_mtime = st_mtime
+        self.owner = owner
+        self.group = group
+
+    @classmethod
+    def _from_pointer(cls, attrs_ptr, name=None):
+        # Copy the fields and free the libssh attributes structure.
+        try:
+            attrs = attrs_ptr.contents
+            if attrs.name is not None:
+                name = attrs.name
+
+            return cls(compat.to_name(name) if name is not None else None,
+                       attrs.type, attrs.permissions, attrs.size,
+                       attrs.uid, attrs.gid, attrs.atime, attrs.mtime,
+                       compat.to_text(attrs.owner) if attrs.owner is not None else None,
+                       compat.to_text(attrs.group) if attrs.group is not None else None)
+        finally:
+            api.library.sftp_attributes_free(attrs_ptr)
+
+    def is_dir(self):
+        return self.type == api.SSH_FILEXFER_TYPE_DIRECTORY
+
+    def is_file(self):
+        return self.type == api.SSH_FILEXFER_TYPE_REGULAR
+
+    def is_symlink(self):
+        return self.type == api.SSH_FILEXFER_TYPE_SYMLINK
+
+    def __repr__(self):
+        return "<SftpStat {0!r} mode={1:o} size={2} mtime={3}>".format(
+            self.name, self.st_mode, self.st_size, self.st_mtime)
+
+
+class SftpFile(io.RawIOBase):
+    """
+    SFTP File wrapper.
+
+    Implements :py:class:`io.RawIOBase`, so it can be used wherever a
+    binary file object is expected (``tarfile``, ``zipfile``, pandas...)
+    or wrapped in :py:class:`io.BufferedReader`.
+
+    Reads are served from a least recently used cache of `cache_blocks`
+    blocks of `block_size` bytes. A miss on the block following a cached
+    one is taken as a sequential read and fetches `read_ahead` blocks with
+    pipelined requests, in one round trip. Other misses only fetch the
+    blocks they need. Writes drop the cached blocks they overlap.
+
+    :param int block_size: size of cached blocks
+    :param int cache_blocks: maximum number of cached blocks, 0 disables
+                             the cache and read-ahead
+    :param int read_ahead: number of blocks fetched on sequential reads
+    """
+
+    file = None
+
+    def __init__(self, path, mode, sftp_wrapper, block_size=DEFAULT_BLOCK_SIZE,
+                 cache_blocks=DEFAULT_CACHE_BLOCKS, read_ahead=DEFAULT_READ_AHEAD):
+        super(SftpFile, self).__init__()
 
-    def __init__(self, path, mode, sftp_wrapper):
         self.sftp_wrapper = sftp_wrapper
         self.sftp = sftp_wrapper.sftp
+        self.name = compat.to_text(path)
 
-        self.file = api.library.sftp_open(self.sftp, path, mode, stat.S_IRWXU)
+        self.block_size = block_size
+        self.cache_blocks = cache_blocks
+        self.read_ahead = max(1, min(read_ahead, cache_blocks or 1))
 
-        if self.file is None:
-            self._closed = True
-            raise ext.SftpError("Can't open file {0}".format(path.decode("utf-8")))
+        self._flags = mode
+        self._pos = 0
+        self._size = None
+        self._cache = collections.OrderedDict()
 
-    def __enter__(self):
-        return self
+        self.file = api.library.sftp_open(self.sftp, path, mode, stat.S_IRWXU)
 
-    def __exit__(self, *args, **kwargs):
-        self.close()
+        if self.file is None:
+            raise exp.SftpError("Can't open file {0}".format(path.decode("utf-8")))
+
+    def _check_open(self):
+        if self.closed:
+            raise ValueError("I/O operation on closed file.")
+
+    def _get_size(self):
+        if self._size is None:
+            self._size = self.sftp_wrapper._get_file_metadata(self.file).st_size
+        return self._size
+
+    def _fetch(self, start, end):
+        # Read the [start, end) range with pipelined requests of one block.
+        data = bytearray(end - start)
+        filled = 0
+
+        for offset, chunk in _read_pipelined(self.file, self._get_size(), DEFAULT_STREAM_WINDOW,
+                                             self.block_size, start, end):
+            data[offset - start:offset - start + len(chunk)] = chunk
+            filled = max(filled, offset - start + len(chunk))
+
+        del data[filled:]
+        return data
+
+    def _cache_get(self, index):
+        block = self._cache.pop(index, None)
+        if block is not None:
+            self._cache[index] = block
+        return block
+
+    def _cache_load(self, index, wanted):
+        # Fetch block `index`, and the following ones up to `wanted` bytes
+        # or the read-ahead on sequential reads, and return the first one.
+        count = -(-wanted // self.block_size)
+        if index - 1 in self._cache:
+            count = max(count, self.read_ahead)
+        count = min(count, self.cache_blocks)
+
+        # Do not fetch again the blocks already cached
+        needed = 1
+        while needed < count and index + needed not in self._cache:
+            needed += 1
+
+        start = index * self.block_size
+        data = self._fetch(start, start + needed * self.block_size)
+
+        for i in range(0, len(data), self.block_size):
+            self._cache[index + i // self.block_size] = bytes(data[i:i + self.block_size])
+        while len(self._cache) > self.cache_blocks:
+            self._cache.popitem(last=False)
+
+        return self._cache.get(index, b"")
+
+    def _invalidate(self, start, end):
+        for index in list(self._cache):
+            if index * self.block_size < end and (index + 1) * self.block_size > start:
+                del self._cache[index]
+        self._size = None
+
+    def readable(self):
+        return (self._flags & os.O_ACCMODE) in (os.O_RDONLY, os.O_RDWR)
+
+    def writable(self):
+        return (self._flags & os.O_ACCMODE) in (os.O_WRONLY, os.O_RDWR)
+
+    def seekable(self):
+        return True
 
-    def write(self, data):
+    def write(self, data, window=None):
         """
-        Write bytes to remote file.
+        Write bytes to remote file at the current position.
+
+        Data larger than the sftp buffer size is split in chunks. If
+        `window` is greater than 1, up to `window` of these chunks are
+        kept unacknowledged on the wire (needs libssh >= 0.11).
 
         :param bytes data: bytes chunk of data
+        :param int window: number of unacknowledged writes kept in flight
         :returns: number of bytes are written
         :rtype: int
         """
-        written = api.library.sftp_write(self.file, data, len(data))
-        if written != len(data):
-            raise RuntimeError("Can't write file")
+        self._check_open()
+        if not isinstance(data, bytes):
+            data = memoryview(data).tobytes()
+
+        api.library.sftp_seek64(self.file, self._pos)
+        self._invalidate(self._pos, self._pos + len(data))
+
+        if window is None or window <= 1 or len(data) <= self.sftp_wrapper.buffer_size:
+            written = api.library.sftp_write(self.file, data, len(data))
+            if written != len(data):
+                raise RuntimeError("Can't write file")
+        else:
+            chunk_size = self.sftp_wrapper.buffer_size
+            chunks = (data[i:i + chunk_size] for i in range(0, len(data), chunk_size))
+            _write_chunks(self.file, chunks, window,
+                          max_write=self.sftp_wrapper._max_write_length())
+
+        self._pos += len(data)
+        return len(data)
+
+    def readinto(self, buffer):
+        """
+        Read up to ``len(buffer)`` bytes from the current position into
+        `buffer`.
+
+        :returns: number of bytes read, 0 at end of file
+        :rtype: int
+        """
+        self._check_open()
+        view = memoryview(buffer)
+        total = len(view)
+
+        if not self.cache_blocks:
+            data = self._fetch(self._pos, self._pos + total)
+            view[:len(data)] = data
+            self._pos += len(data)
+            return len(data)
+
+        readed = 0
+        while readed < total:
+            index, start = divmod(self._pos, self.block_size)
+
+            block = self._cache_get(index)
+            if block is None:
+                block = self._cache_load(index, start + total - readed)
+
+            chunk = block[start:start + total - readed]
+            if not chunk:
+                break
 
-        return written
+            view[readed:readed + len(chunk)] = chunk
+            readed += len(chunk)
+            self._pos += len(chunk)
 
-    def read(self, num=None, buffer_length=1024):
+            if len(block) < self.block_size and start + len(chunk) == len(block):
+                # Short block, end of file
+                break
+
+        return readed
+
+    def read(self, num=None):
         """
         Read from remote file.
 
         :param int num: number of bytes to read, if num is None reads all.
-        :returns: readed bytes chunk
+        :returns: readed bytes chunk, shorter than `num` at end of file
         :rtype: bytes
         """
-        if num is None:
-            buffer_len = buffer_length
-        else:
-            buffer_len = num
+        if num is None or num < 0:
+            return self.readall()
 
-        buffer = ctypes.create_string_buffer(buffer_len)
-        readed = api.library.sftp_read(self.file, ctypes.byref(buffer),  buffer_len);
-
-        if readed == 0:
-            return b""
+        buffer = bytearray(num)
+        readed = self.readinto(buffer)
+        del buffer[readed:]
+        return bytes(buffer)
 
-        if num is not None and num > 0:
-            if buffer_len != readed:
-                raise RuntimeError("Error on read")
-            return buffer.raw
+    def readall(self):
+        """
+        Read from the current position to the end of the remote file.
 
-        readed_data = [buffer.raw]
+        :rtype: bytes
+        """
+        chunks = []
         while True:
-            buffer = ctypes.create_string_buffer(buffer_len)
-
-            readed = api.library.sftp_read(self.file, ctypes.byref(buffer),  buffer_len);
-            if readed == 0:
+            chunk = self.read(self.block_size * self.read_ahead)
+            if not chunk:
                 break
+            chunks.append(chunk)
+        return b"".join(chunks)
 
-            readed_data.append(buffer.raw[:readed])
-        return b"".join(readed_data)
-
-    def seek(self, offset):
+    def seek(self, offset, whence=io.SEEK_SET):
         """
         Change position on a remote file.
 
-        :param int offset: file position
-        :returns: boolean value if seek is success or not
-        :rtype: bool
+        :param int offset: file position, relative to `whence`
+        :param int whence: one of ``io.SEEK_SET``, ``io.SEEK_CUR`` or
+                           ``io.SEEK_END``
+        :returns: the new absolute position
+        :rtype: int
         """
-        ret = api.library.sftp_seek64(self.file, offset);
-        if ret != api.SSH_OK:
-            return False
+        self._check_open()
+
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._pos + offset
+        elif whence == io.SEEK_END:
+            self._size = None
+            position = self._get_size() + offset
+        else:
+            raise ValueError("Invalid whence ({0})".format(whence))
 
-        return True
+        if position < 0:
+            raise ValueError("Negative seek position {0}".format(position))
+
+        self._pos = position
+        return position
 
     def tell(self):
         """
@@ -263,14 +1626,156 @@ class SftpFile(object):
         :returns: a current position.
         :rtype: int
         """
-        return api.library.sftp_tell64(self.file)
+        self._check_open()
+        return self._pos
+
+    def mmap(self, page_size=DEFAULT_BLOCK_SIZE, cache_pages=DEFAULT_MMAP_PAGES,
+             prefetch=DEFAULT_MMAP_PREFETCH):
+        """
+        Map the remote file in a read only, lazily loaded buffer.
+
+        Only the pages touched by indexing or slicing the returned object
+        are transferred, so sparse reads of large files (file headers,
+        footers or indexes) stay cheap.
+
+        :param int page_size: size of the pages fetched on demand
+        :param int cache_pages: maximum number of pages kept in memory
+        :param int prefetch: number of missing pages fetched on each side
+                             of the faulting one
+        :rtype: :py:class:`SftpMmap`
+        """
+        self._check_open()
+        return SftpMmap(self, page_size, cache_pages, prefetch)
 
     def close(self):
         """
         Close a opened file.
         """
+        if self.file is not None:
+            # Once the sftp or ssh session is freed (a file left to the
+            # garbage collector) the handle is gone with it.
+            if not self.sftp_wrapper._closed and not self.sftp_wrapper.session_wrapper._closed:
+                api.library.sftp_close(self.file)
+            self.file = None
+            self._cache.clear()
+
+        super(SftpFile, self).close()
+
+
+class SftpMmap(object):
+    """
+    Read only view of a remote file with the indexing and slicing
+    interface of :py:class:`mmap.mmap`, see :py:meth:`SftpFile.mmap`.
+
+    The file is split in pages of `page_size` bytes. Accessing a page not
+    in memory fetches it, together with up to `prefetch` missing pages on
+    each side, with pipelined reads. Pages are kept in a least recently
+    used cache of `cache_pages` pages. The size of the view is the size
+    of the file when it was mapped.
+
+    :ivar int size: mapped size in bytes
+    :ivar int faults: number of fetches done on page misses
+    """
+
+    def __init__(self, sftp_file, page_size, cache_pages, prefetch):
+        self.sftp_file = sftp_file
+        self.page_size = page_size
+        self.cache_pages = max(1, cache_pages)
+        # The faulting page and its prefetched neighbours must fit the cache
+        self.prefetch = max(0, min(prefetch, (self.cache_pages - 1) // 2))
+
+        sftp_file._size = None
+        self.size = sftp_file._get_size()
+        self.faults = 0
+
+        self._pages = collections.OrderedDict()
+        self._closed = False
+
+    def _store(self, index, page):
+        self._pages[index] = page
+        while len(self._pages) > self.cache_pages:
+            self._pages.popitem(last=False)
+
+    def _page(self, index):
+        page = self._pages.pop(index, None)
+        if page is not None:
+            self._pages[index] = page
+            return page
+
+        # Extend the fetched range over the contiguous missing pages
+        # around the faulting one.
+        last_page = -(-self.size // self.page_size)
+        first, last = index, index + 1
+        while first > max(0, index - self.prefetch) and first - 1 not in self._pages:
+            first -= 1
+        while last < min(last_page, index + 1 + self.prefetch) and last not in self._pages:
+            last += 1
+
+        data = self.sftp_file._fetch(first * self.page_size,
+                                     min(last * self.page_size, self.size))
+        self.faults += 1
+
+        for i in range(first, last):
+            if i != index:
+                offset = (i - first) * self.page_size
+                self._store(i, bytes(data[offset:offset + self.page_size]))
+
+        offset = (index - first) * self.page_size
+        page = bytes(data[offset:offset + self.page_size])
+        self._store(index, page)
+        return page
+
+    def _read(self, start, stop):
+        chunks = []
+        while start < stop:
+            index, offset = divmod(start, self.page_size)
+            chunk = self._page(index)[offset:offset + stop - start]
+            if not chunk:
+                break
+            chunks.append(chunk)
+            start += len(chunk)
+        return b"".join(chunks)
+
+    def __len__(self):
+        return self.size
+
+    def __getitem__(self, key):
         if self._closed:
-            raise ext.ResourceManagementError("SftpFile instance already closed.")
+            raise ValueError("mmap closed or invalid")
+
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            if step == 1:
+                return self._read(start, stop)
+
+            indices = range(start, stop, step)
+            if not indices:
+                return b""
+
+            low, high = min(indices), max(indices)
+            data = self._read(low, high + 1)
+            return data[start - low::step]
+
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError("mmap index out of range")
+
+        return bytearray(self._read(key, key + 1))[0]
+
+    @property
+    def closed(self):
+        return self._closed
 
+    def close(self):
+        """
+        Release the cached pages. The remote file is left open.
+        """
         self._closed = True
-        api.library.sftp_close(self.file)
+        self._pages.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args, **kwargs):
+        self.close()
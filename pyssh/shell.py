@@ -4,18 +4,35 @@ from __future__ import unicode_literals
 
 import warnings
 import ctypes
+import time
 
 from . import api
 from . import compat
 from . import exceptions as exp
 
 
+CHUNK_SIZE = 64 * 1024
+
+# Default maximum length of a regular expression match in Shell.expect:
+# output already searched is only searched again this far back.
+SEARCH_WINDOW = 64 * 1024
+
+
 class Shell(object):
     """
     Shell session.
+
+    Output is read into an internal buffer, so it can be consumed by
+    size (:py:meth:`read`) or up to a pattern (:py:meth:`read_until`,
+    :py:meth:`expect`). Waiting for output blocks in libssh, without
+    polling, until data arrives or the timeout expires.
+
+    :ivar match: regular expression match object of the last
+        :py:meth:`expect` call, or None if a plain pattern matched
     """
 
     _channel = None
+    match = None
 
     def __init__(self, session, pty_size, env):
         self.session_wrapper = session
@@ -23,6 +40,15 @@ class Shell(object):
         self.pty_size = pty_size
         self.env = env
 
+        # Unread output is buffer[start:], consumed data is only
+        # discarded from time to time so appends and reads stay O(n).
+        self._buffer = bytearray()
+        self._start = 0
+        self._eof = False
+
+        self._chunk = bytearray(CHUNK_SIZE)
+        self._chunk_ptr = (ctypes.c_char * CHUNK_SIZE).from_buffer(self._chunk)
+
     @property
     def channel(self):
         if self._channel is not None:
@@ -89,32 +115,172 @@ class Shell(object):
             raise RuntimeError("Error on write")
         return written
 
-    def read(self, n):
+    def _fill(self, timeout):
+        # Wait up to `timeout` seconds (None for no limit) for output and
+        # append it to the buffer. Returns False at end of file.
+        if self._eof:
+            return False
+
+        timeout_ms = -1 if timeout is None else max(0, int(timeout * 1000))
+        available = api.library.ssh_channel_poll_timeout(self.channel, timeout_ms, 0)
+        if available == api.SSH_EOF:
+            self._eof = True
+            return False
+
+        if available == api.SSH_ERROR:
+            msg = api.library.ssh_get_error(self.session)
+            raise exp.ConnectionError("Error raised by ssh: {0}".format(msg.decode("utf-8")))
+
+        if available == 0:
+            return True
+
+        readed = api.library.ssh_channel_read_nonblocking(self.channel, self._chunk_ptr, CHUNK_SIZE, 0)
+        if readed == api.SSH_EOF:
+            self._eof = True
+            return False
+
+        if readed < 0:
+            raise RuntimeError("Error on read")
+
+        self._buffer += self._chunk[:readed]
+        return True
+
+    def _consume(self, end):
+        data = bytes(self._buffer[self._start:end])
+        self._start = end
+
+        if self._start >= CHUNK_SIZE and self._start * 2 >= len(self._buffer):
+            del self._buffer[:self._start]
+            self._start = 0
+        return data
+
+    @property
+    def eof(self):
+        """
+        True once the remote shell ended and all its output was read.
+        """
+        return self._eof and self._start == len(self._buffer)
+
+    def read(self, n, timeout=0):
         """
         Read bytes from remote shell.
 
-        This method always return value, if not bytes available to read
-        it returns an empty bytestring.
+        Returns the buffered output, or waits up to `timeout` seconds for
+        new output if there is none. With the default timeout it never
+        waits and returns an empty bytestring if no bytes are available,
+        which also happens at end of file (see :py:attr:`eof`).
 
-        :param int n: number of bytes to read
+        :param int n: maximum number of bytes to read
+        :param float timeout: seconds to wait for output, None waits
+                              until some output arrives
         :returns: bytestring of readed data.
         :rtype: bytes
         """
+        if self._start == len(self._buffer):
+            if self._eof:
+                return b""
 
-        res = api.library.ssh_channel_is_open(self.channel)
-        if res == 0:
-            raise RuntimeError("Channel is closed")
+            res = api.library.ssh_channel_is_open(self.channel)
+            if res == 0:
+                raise RuntimeError("Channel is closed")
 
-        res = api.library.ssh_channel_is_eof(self.channel)
-        if res != 0:
-            return b""
+            self._fill(timeout)
 
-        buffer = ctypes.create_string_buffer(n)
-        readed = api.library.ssh_channel_read_nonblocking(self.channel, buffer, n, 0)
-        if readed < 0:
-            raise RuntimeError("Error on read")
+        return self._consume(min(len(self._buffer), self._start + n))
+
+    def _search(self, patterns, scanned, search_window):
+        # Earliest match of any pattern as (index, start, end, match).
+        # Only the data added since the previous search (`scanned`) is
+        # searched, plus the bytes before it a match could start on: the
+        # pattern length for plain patterns, `search_window` for regexes.
+        best = None
+        for index, pattern in enumerate(patterns):
+            if isinstance(pattern, bytes):
+                position = self._buffer.find(pattern, max(self._start, scanned - len(pattern) + 1))
+                if position < 0:
+                    continue
+                found = (index, position, position + len(pattern), None)
+            else:
+                position = max(self._start, scanned - search_window)
+
+                # Searched on a copy, the match object must outlive
+                # changes of the buffer.
+                match = pattern.search(bytes(self._buffer[position:]))
+                if match is None:
+                    continue
+                found = (index, position + match.start(), position + match.end(), match)
+
+            if best is None or found[1] < best[1]:
+                best = found
+        return best
+
+    def expect(self, patterns, timeout=None, search_window=None):
+        """
+        Wait until the output matches one of `patterns`.
+
+        Patterns are strings (matched literally) or compiled bytes regular
+        expressions. The earliest match in the output wins. The output up
+        to the end of the match is consumed and returned, and the regular
+        expression match object is stored in :py:attr:`match`.
+
+        Each wakeup only searches the new output, so waiting through a
+        large output takes linear time. Regular expressions also search
+        the last `search_window` bytes of the output already seen, which
+        bounds the length of their matches (plain patterns can have any
+        length).
+
+        :param list patterns: list of strings or compiled regexes
+        :param float timeout: maximum seconds to wait, None for no limit
+        :param int search_window: maximum length of a regular expression
+                                  match (default: `SEARCH_WINDOW`, 64 KiB)
+
+        :returns: index of the matching pattern and the consumed output
+        :rtype: tuple
+        :raises pyssh.exceptions.TimeoutError: if there is no match before
+            `timeout` (the output is kept for the next read)
+        :raises pyssh.exceptions.ConnectionError: if the shell ends first
+        """
+        if not isinstance(patterns, (list, tuple)):
+            patterns = [patterns]
+        patterns = [compat.to_bytes(x) if isinstance(x, compat.text_type) else x
+                    for x in patterns]
+
+        if search_window is None:
+            search_window = SEARCH_WINDOW
+
+        deadline = None if timeout is None else time.time() + timeout
+        scanned = self._start
+
+        while True:
+            found = self._search(patterns, scanned, search_window)
+            if found is not None:
+                index, _, end, self.match = found
+                return index, self._consume(end)
+
+            scanned = len(self._buffer)
+
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise exp.TimeoutError("Timeout waiting for shell output")
 
-        return buffer.value
+            if not self._fill(remaining):
+                raise exp.ConnectionError("Shell output ended before matching")
+
+    def read_until(self, pattern, timeout=None):
+        """
+        Read until `pattern` is found in the output.
+
+        :param str pattern: string or compiled bytes regular expression
+        :param float timeout: maximum seconds to wait, None for no limit
+        :returns: output up to the end of the pattern (included)
+        :rtype: bytes
+        :raises pyssh.exceptions.TimeoutError: if the pattern is not found
+            before `timeout`
+        :raises pyssh.exceptions.ConnectionError: if the shell ends first
+        """
+        return self.expect([pattern], timeout=timeout)[1]
 
     def __enter__(self):
         return self
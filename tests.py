@@ -9,6 +9,7 @@ import shutil
 import unittest
 import importlib
 import hashlib
+import json
 
 
 class PythonLibsshTest(unittest.TestCase):
@@ -71,6 +72,331 @@ class PythonLibsshTest(unittest.TestCase):
             with self.assertRaises(RuntimeError):
                 result = r.as_bytes()
 
+    def test_execute_lazy_with_chunk_size(self):
+        with self.pyssh.new_session() as s:
+            r = s.execute("head -c 100000 /dev/zero", lazy=True, chunk_size=4096)
+            chunks = list(r)
+
+            self.assertEqual(sum(len(x) for x in chunks), 100000)
+            self.assertTrue(all(0 < len(x) <= 4096 for x in chunks))
+            self.assertEqual(r.return_code, 0)
+
+    def test_session_options(self):
+        options = self.pyssh.SessionOptions(timeout=10, nodelay=True,
+                                            ciphers=["aes128-ctr", "aes256-ctr"])
+        for i in range(3):
+            with self.pyssh.new_session(options=options) as s:
+                self.assertEqual(s.execute("echo ok").as_bytes(), b"ok\n")
+
+        with self.assertRaises(TypeError):
+            self.pyssh.SessionOptions(nodelay="yes")
+        with self.assertRaises(TypeError):
+            self.pyssh.SessionOptions(unexisting_option=1)
+        with self.assertRaises(ValueError):
+            self.pyssh.new_session(options=options.replace(ciphers="unexisting-cipher"))
+
+    def test_timeouts(self):
+        import socket
+        import time
+
+        # Server that accepts the connection but never sends its banner
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(1)
+        try:
+            session = self.pyssh.new_session("127.0.0.1", port=server.getsockname()[1],
+                                             connect_timeout=1)
+            with self.assertRaises(self.pyssh_exp.ConnectTimeoutError):
+                session._connect_if_not_connected()
+            session.close()
+
+            # Refused right away: not a timeout
+            port = server.getsockname()[1]
+            server.close()
+            session = self.pyssh.new_session("127.0.0.1", port=port, connect_timeout=5)
+            with self.assertRaises(self.pyssh_exp.ConnectionError) as context:
+                session._connect_if_not_connected()
+            self.assertNotIsInstance(context.exception, self.pyssh_exp.ConnectTimeoutError)
+            session.close()
+        finally:
+            server.close()
+
+        with self.pyssh.new_session() as s:
+            started = time.time()
+            with self.assertRaises(self.pyssh_exp.DeadlineExceeded):
+                s.execute("sleep 10", deadline=time.time() + 0.5)
+            self.assertLess(time.time() - started, 5)
+
+            # The session is still usable
+            self.assertEqual(s.execute("echo ok").as_bytes(), b"ok\n")
+
+            with s.create_sftp() as sftp:
+                with self.assertRaises(self.pyssh_exp.DeadlineExceeded):
+                    sftp.get("/tmp/py-libssh.temp.file", "/tmp/py-libssh.temp.file.2",
+                             deadline=time.time())
+
+        with self.pyssh.Session("localhost", timeout=0.5) as s:
+            with self.assertRaises(self.pyssh_exp.TimeoutError):
+                s.execute("sleep 10")
+
+        os.remove("/tmp/py-libssh.temp.file.2")
+
+    def test_execute_fill(self):
+        command = "head -c 3000000 /dev/zero; echo error >&2"
+
+        with self.pyssh.new_session() as s:
+            chunks = list(s.execute(command, lazy=True, chunk_size=1024 * 1024, fill=True))
+            self.assertEqual(sum(len(x) for x in chunks), 3000000)
+            # Chunks are filled across many packets, not one per read
+            self.assertLessEqual(len(chunks), 6)
+            self.assertEqual(max(len(x) for x in chunks), 1024 * 1024)
+
+            _result = s.execute(command, fill=True)
+            self.assertEqual(_result.as_bytes(), b"\0" * 3000000)
+            self.assertEqual(_result.stderr, b"error\n")
+            self.assertEqual(_result.return_code, 0)
+
+            sink = io.BytesIO()
+            s.execute(command, sink=sink, chunk_size=1024 * 1024, fill=True)
+            self.assertEqual(len(sink.getvalue()), 3000000)
+
+    def test_execute_fill_stderr(self):
+        import time
+
+        # Stderr is read as it arrives, not once per FILL_TIMEOUT
+        started = time.time()
+        with self.pyssh.new_session() as s:
+            _result = s.execute("head -c 10000000 /dev/zero >&2; echo done",
+                                chunk_size=1024 * 1024, fill=True)
+            self.assertEqual(_result.as_bytes(), b"done\n")
+            self.assertEqual(len(_result.stderr), 10000000)
+        self.assertLess(time.time() - started, 5)
+
+    def test_fanout_execute(self):
+        fanout = importlib.import_module("pyssh.fanout")
+
+        results = fanout.execute(["localhost", "127.0.0.1", "unknown.invalid"],
+                                 "uname", concurrency=2)
+        by_host = dict((x.hostname, x) for x in results)
+
+        self.assertEqual(by_host["localhost"].result.as_bytes(), b"Linux\n")
+        self.assertEqual(by_host["127.0.0.1"].result.return_code, 0)
+        self.assertIsInstance(by_host["unknown.invalid"].error, self.pyssh_exp.ConnectionError)
+        self.assertEqual(results.stats.succeeded, 2)
+        self.assertEqual(results.stats.failed, 1)
+
+    def test_session_pool_reuse(self):
+        with self.pyssh.SessionPool(max_size=2) as pool:
+            with pool.session("localhost") as s1:
+                self.assertEqual(s1.execute("uname").as_bytes(), b"Linux\n")
+
+            with pool.session("localhost") as s2:
+                self.assertIs(s1, s2)
+
+            self.assertEqual(pool.hits, 1)
+            self.assertEqual(pool.misses, 1)
+
+    def test_execute_many(self):
+        with self.pyssh.new_session() as s:
+            commands = ["sleep 0.{0}; echo {0}".format(x) for x in range(12)]
+            results = list(s.execute_many(commands, max_channels=4))
+
+            self.assertEqual(len(results), 12)
+            self.assertEqual(sorted(x.as_bytes() for x in results),
+                             sorted("{0}\n".format(x).encode("ascii") for x in range(12)))
+            self.assertTrue(all(x.return_code == 0 for x in results))
+
+    @unittest.skipIf(sys.version_info < (3, 5), "asyncio front-end needs python >= 3.5")
+    def test_aio_execute(self):
+        aio = importlib.import_module("pyssh.aio")
+        asyncio = importlib.import_module("asyncio")
+
+        loop = asyncio.new_event_loop()
+        try:
+            s = aio.new_session()
+            results = loop.run_until_complete(asyncio.gather(
+                s.execute("uname"), s.execute("echo foo")))
+
+            self.assertEqual(results[0].as_bytes(), b"Linux\n")
+            self.assertEqual(results[1].as_bytes(), b"foo\n")
+            self.assertEqual(results[1].return_code, 0)
+            s.close()
+        finally:
+            loop.close()
+
+    @unittest.skipIf(sys.version_info < (3, 4), "needs selectors module")
+    def test_forward_local(self):
+        import socket
+        import threading
+
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+
+        def echo():
+            for _ in range(3):
+                conn, _ = server.accept()
+                while True:
+                    data = conn.recv(65536)
+                    if not data:
+                        break
+                    conn.sendall(data)
+                conn.close()
+
+        thread = threading.Thread(target=echo)
+        thread.daemon = True
+        thread.start()
+
+        data = os.urandom(1000000)
+        with self.pyssh.new_session() as s:
+            with s.forward_local(0, "127.0.0.1", server.getsockname()[1]) as forward:
+                for _ in range(3):
+                    client = socket.create_connection(("127.0.0.1", forward.local_port))
+                    client.sendall(data)
+                    client.shutdown(socket.SHUT_WR)
+
+                    received = []
+                    while True:
+                        chunk = client.recv(65536)
+                        if not chunk:
+                            break
+                        received.append(chunk)
+                    client.close()
+                    self.assertEqual(b"".join(received), data)
+
+                self.assertEqual(forward.stats.connections, 3)
+                self.assertEqual(forward.stats.bytes_sent, 3000000)
+                self.assertEqual(forward.stats.bytes_received, 3000000)
+
+        server.close()
+
+    @unittest.skipIf(sys.version_info < (3, 4), "needs selectors module")
+    def test_forward_remote_and_socks_proxy(self):
+        import socket
+        import struct
+        import threading
+
+        server = socket.socket()
+        server.bind(("127.0.0.1", 0))
+        server.listen(5)
+        server_port = server.getsockname()[1]
+
+        def hello():
+            for _ in range(2):
+                conn, _ = server.accept()
+                conn.sendall(b"hello " + conn.recv(100))
+                conn.close()
+
+        thread = threading.Thread(target=hello)
+        thread.daemon = True
+        thread.start()
+
+        def receive_all(sock):
+            chunks = []
+            while True:
+                chunk = sock.recv(65536)
+                if not chunk:
+                    return b"".join(chunks)
+                chunks.append(chunk)
+
+        with self.pyssh.new_session() as s:
+            with s.forward_remote(0, "127.0.0.1", server_port) as forward:
+                client = socket.create_connection(("127.0.0.1", forward.remote_port))
+                client.sendall(b"remote")
+                self.assertEqual(receive_all(client), b"hello remote")
+                client.close()
+
+        with self.pyssh.new_session() as s:
+            with s.socks_proxy(0) as proxy:
+                client = socket.create_connection(("127.0.0.1", proxy.local_port))
+                client.sendall(b"\x05\x01\x00")
+                self.assertEqual(client.recv(2), b"\x05\x00")
+                client.sendall(b"\x05\x01\x00\x03\x09localhost" + struct.pack(">H", server_port))
+                self.assertEqual(client.recv(10)[:2], b"\x05\x00")
+                client.sendall(b"socks")
+                self.assertEqual(receive_all(client), b"hello socks")
+                client.close()
+
+        server.close()
+
+    def test_shell_runner(self):
+        with self.pyssh.new_session() as s, s.create_runner() as runner:
+            r = runner.run("echo -n hello; echo oops >&2; exit 3")
+            self.assertEqual(r.as_bytes(), b"hello")
+            self.assertEqual(r.as_bytes(stream="stderr"), b"oops\n")
+            self.assertEqual(r.return_code, 3)
+
+            results = list(runner.run_many(["echo {0}".format(i) for i in range(200)], batch_size=50))
+            self.assertEqual([x.as_bytes() for x in results],
+                             ["{0}\n".format(i).encode("ascii") for i in range(200)])
+            self.assertTrue(all(x.return_code == 0 for x in results))
+
+            # Syntax errors and stdin reads do not break the shell
+            self.assertNotEqual(runner.run("if").return_code, 0)
+            self.assertEqual(runner.run("cat").as_bytes(), b"")
+            self.assertEqual(runner.run("printf 'a\\0b'").as_bytes(), b"a\0b")
+
+    def test_execute_iter_lines_and_json(self):
+        with self.pyssh.new_session() as s:
+            command = "for i in $(seq 1000); do echo '{\"n\": '$i', \"s\": \"\u00e9\"}'; done"
+
+            lines = list(s.execute(command, lazy=True, chunk_size=10).iter_lines(encoding="utf-8"))
+            self.assertEqual(len(lines), 1000)
+            self.assertEqual(lines[0], '{"n": 1, "s": "\u00e9"}')
+
+            records = list(s.execute(command, lazy=True, chunk_size=7).iter_json())
+            self.assertEqual([x["n"] for x in records], list(range(1, 1001)))
+            self.assertEqual(records[0]["s"], "\u00e9")
+
+            text = "".join(s.execute("printf '\\303\\251t\\303\\251'", lazy=True, chunk_size=1).iter_text())
+            self.assertEqual(text, "\u00e9t\u00e9")
+
+    def test_execute_with_stderr(self):
+        with self.pyssh.new_session() as s:
+            r = s.execute("echo out; echo err >&2")
+            self.assertEqual(r.as_bytes(), b"out\n")
+            self.assertEqual(r.as_bytes(stream="stderr"), b"err\n")
+            self.assertEqual(r.stderr, b"err\n")
+
+            r = s.execute("head -c 1000000 /dev/zero >&2; echo done", lazy=True,
+                          stderr_limit=1000)
+            self.assertEqual(r.as_bytes(), b"done\n")
+            self.assertEqual(len(r.stderr), 1000)
+
+            r = s.execute("echo out; echo err >&2", lazy=True)
+            streams = {}
+            for stream, chunk in r.iter_streams():
+                streams[stream] = streams.get(stream, b"") + chunk
+            self.assertEqual(streams, {"stdout": b"out\n", "stderr": b"err\n"})
+
+    def test_execute_binary_output(self):
+        with self.pyssh.new_session() as s:
+            r = s.execute("printf 'a\\000b\\000'")
+            self.assertEqual(r.as_bytes(), b"a\x00b\x00")
+
+            output = io.BytesIO()
+            r = s.execute("head -c 300000 /dev/zero", lazy=True)
+            self.assertEqual(r.stream_to(output), 300000)
+            self.assertEqual(output.getvalue(), b"\x00" * 300000)
+            self.assertEqual(r.return_code, 0)
+
+    def test_execute_with_sink_and_spool(self):
+        with self.pyssh.new_session() as s:
+            received = []
+            r = s.execute("head -c 300000 /dev/zero", sink=lambda x: received.append(len(x)))
+            self.assertEqual(sum(received), 300000)
+            self.assertEqual(r.return_code, 0)
+
+            with s.execute("head -c 300000 /dev/zero", spool_size=1024) as r:
+                self.assertIsInstance(r, self.pyssh_result.SpooledResult)
+                self.assertEqual(r.size, 300000)
+                self.assertEqual(r.mmap()[:], b"\x00" * 300000)
+
+            expected = "".join("{0}\n".format(x) for x in range(1, 50001)).encode("ascii")
+            with s.execute("seq 1 50000", spool_size=1024) as r:
+                self.assertEqual(r.size, len(expected))
+                self.assertEqual(r.mmap()[:], expected)
+
     #def test_new_session_and_execute_command_02(self):
     #    s = self.pyssh.new_session()
     #    r = s.execute("echo $FOO", env={"FOO": "Hello"})
@@ -98,6 +424,26 @@ class PythonLibsshTest(unittest.TestCase):
         os.remove("/tmp/py-libssh.temp.file.2")
         os.remove("/tmp/py-libssh.temp.file.3")
 
+    def test_new_session_and_put_pipelined(self):
+        sha1_1 = hashlib.sha1()
+        with io.open("/tmp/py-libssh.temp.file.2", "wb") as f:
+            data = os.urandom(1000000)
+            sha1_1.update(data)
+            f.write(data)
+
+        with self.pyssh.new_session() as s, s.create_sftp() as sftp:
+            sftp.put("/tmp/py-libssh.temp.file.2", "/tmp/py-libssh.temp.file.3",
+                     window=8, chunk_size=8192)
+
+        sha1_2 = hashlib.sha1()
+        with io.open("/tmp/py-libssh.temp.file.3", "rb") as f:
+            sha1_2.update(f.read())
+
+        self.assertEqual(sha1_2.hexdigest(), sha1_1.hexdigest())
+
+        os.remove("/tmp/py-libssh.temp.file.2")
+        os.remove("/tmp/py-libssh.temp.file.3")
+
     def test_new_session_and_get(self):
         sha1_1 = hashlib.sha1()
         with io.open("/tmp/py-libssh.temp.file.2", "wb") as f:
@@ -141,12 +487,264 @@ class PythonLibsshTest(unittest.TestCase):
         os.remove("/tmp/py-libssh.temp.file.2")
         os.remove("/tmp/py-libssh.temp.file.3")
 
+    def test_new_session_and_get_pipelined(self):
+        sha1_1 = hashlib.sha1()
+
+        with io.open("/tmp/py-libssh.temp.file.2", "wb") as f:
+            data = os.urandom(1000000)
+            sha1_1.update(data)
+            f.write(data)
+
+        with self.pyssh.new_session() as s, s.create_sftp() as sftp:
+            sftp.get("/tmp/py-libssh.temp.file.2", "/tmp/py-libssh.temp.file.3",
+                     window=8, chunk_size=8192)
+
+        sha1_2 = hashlib.sha1()
+        with io.open("/tmp/py-libssh.temp.file.3", "rb") as f:
+            sha1_2.update(f.read())
+
+        self.assertEqual(sha1_2.hexdigest(), sha1_1.hexdigest())
+
+        os.remove("/tmp/py-libssh.temp.file.2")
+        os.remove("/tmp/py-libssh.temp.file.3")
+
+    def test_multi_stream_get_and_put(self):
+        data = os.urandom(3000000)
+        with io.open("/tmp/py-libssh.temp.file.2", "wb") as f:
+            f.write(data)
+
+        progress = []
+        with self.pyssh.new_session() as s, s.create_sftp() as sftp:
+            sftp.get("/tmp/py-libssh.temp.file.2", "/tmp/py-libssh.temp.file.3", streams=4,
+                     progress=lambda done, total: progress.append((done, total)))
+            sftp.put("/tmp/py-libssh.temp.file.3", "/tmp/py-libssh.temp.file.4", streams=3)
+
+        for path in ("/tmp/py-libssh.temp.file.3", "/tmp/py-libssh.temp.file.4"):
+            with io.open(path, "rb") as f:
+                self.assertEqual(f.read(), data)
+            os.remove(path)
+
+        self.assertEqual(progress[-1], (3000000, 3000000))
+        os.remove("/tmp/py-libssh.temp.file.2")
+
+    def test_compressed_get_and_put(self):
+        data = "".join("line {0} of a compressible file\n".format(i) for i in range(100000))
+        data = data.encode("ascii")
+        with io.open("/tmp/py-libssh temp file 2", "wb") as f:
+            f.write(data)
+
+        with self.pyssh.new_session(compression=True, compression_level=9) as s, \
+                s.create_sftp() as sftp:
+            sftp.get("/tmp/py-libssh temp file 2", "/tmp/py-libssh.temp.file.3", compress="gzip")
+            sftp.put("/tmp/py-libssh.temp.file.3", "/tmp/py-libssh.temp.file.4", compress="gzip")
+
+            with self.assertRaises(self.pyssh_exp.SftpError):
+                sftp.get("/tmp/py-libssh.unexisting", "/tmp/py-libssh.temp.file.5", compress="gzip")
+
+        for path in ("/tmp/py-libssh.temp.file.3", "/tmp/py-libssh.temp.file.4"):
+            with io.open(path, "rb") as f:
+                self.assertEqual(f.read(), data)
+            os.remove(path)
+
+        os.remove("/tmp/py-libssh temp file 2")
+        os.remove("/tmp/py-libssh.temp.file.5")
+
+    def test_resume_put_and_get(self):
+        data = os.urandom(1000000)
+        with io.open("/tmp/py-libssh.temp.file.2", "wb") as f:
+            f.write(data)
+
+        with self.pyssh.new_session() as s, s.create_sftp() as sftp:
+            # Interrupted upload: remote file only has the first half
+            with io.open("/tmp/py-libssh.temp.file.3", "wb") as f:
+                f.write(data[:500000])
+            sftp.put("/tmp/py-libssh.temp.file.2", "/tmp/py-libssh.temp.file.3",
+                     resume=True, verify=True)
+
+            with io.open("/tmp/py-libssh.temp.file.3", "rb") as f:
+                self.assertEqual(f.read(), data)
+
+            # Interrupted download: local file and checkpoint with 300000 bytes
+            with io.open("/tmp/py-libssh.temp.file.4", "wb") as f:
+                f.write(data[:300000])
+            with io.open("/tmp/py-libssh.temp.file.4.pyssh-checkpoint", "w") as f:
+                f.write(json.dumps({"remote_path": "/tmp/py-libssh.temp.file.2",
+                                    "size": 1000000, "block_size": 8388608,
+                                    "offset": 300000, "hashes": []}))
+
+            sftp.get("/tmp/py-libssh.temp.file.2", "/tmp/py-libssh.temp.file.4", resume=True)
+
+            with io.open("/tmp/py-libssh.temp.file.4", "rb") as f:
+                self.assertEqual(f.read(), data)
+            self.assertFalse(os.path.exists("/tmp/py-libssh.temp.file.4.pyssh-checkpoint"))
+
+            # Bytes local path
+            os.remove("/tmp/py-libssh.temp.file.4")
+            sftp.get(b"/tmp/py-libssh.temp.file.2", b"/tmp/py-libssh.temp.file.4", resume=True)
+            with io.open("/tmp/py-libssh.temp.file.4", "rb") as f:
+                self.assertEqual(f.read(), data)
+
+        os.remove("/tmp/py-libssh.temp.file.2")
+        os.remove("/tmp/py-libssh.temp.file.3")
+        os.remove("/tmp/py-libssh.temp.file.4")
+
+    def test_sync_directory(self):
+        local_dir = "/tmp/py-libssh.sync.local"
+        remote_dir = "/tmp/py-libssh.sync.remote"
+        for path in (local_dir, remote_dir):
+            shutil.rmtree(path, ignore_errors=True)
+
+        os.makedirs(os.path.join(local_dir, "a", "b"))
+        for name in ("one", "a/two", "a/b/three"):
+            with io.open(os.path.join(local_dir, name), "wb") as f:
+                f.write(os.urandom(100000))
+
+        with self.pyssh.new_session() as s, s.create_sftp() as sftp:
+            stats = sftp.sync(local_dir, remote_dir, workers=2)
+            self.assertEqual(sorted(stats["transferred"]), ["a/b/three", "a/two", "one"])
+            self.assertEqual(stats["directories"], 3)
+
+            for name in ("one", "a/two", "a/b/three"):
+                with io.open(os.path.join(local_dir, name), "rb") as f1, \
+                        io.open(os.path.join(remote_dir, name), "rb") as f2:
+                    self.assertEqual(f1.read(), f2.read())
+
+            with io.open(os.path.join(local_dir, "a/two"), "wb") as f:
+                f.write(b"changed")
+
+            stats = sftp.sync(local_dir, remote_dir, workers=2)
+            self.assertEqual(stats["transferred"], ["a/two"])
+            self.assertEqual(stats["skipped"], 2)
+
+        shutil.rmtree(local_dir)
+        shutil.rmtree(remote_dir)
+
+    def test_stat_and_listdir_attr(self):
+        remote_dir = "/tmp/py-libssh.stat"
+        shutil.rmtree(remote_dir, ignore_errors=True)
+        os.makedirs(os.path.join(remote_dir, "sub"))
+
+        paths = []
+        for i in range(10):
+            path = os.path.join(remote_dir, "file-{0}".format(i))
+            with io.open(path, "wb") as f:
+                f.write(b"x" * i)
+            paths.append(path)
+
+        with self.pyssh.new_session() as s, s.create_sftp() as sftp:
+            attrs = sftp.stat(paths[3])
+            self.assertEqual(attrs.name, "file-3")
+            self.assertEqual(attrs.st_size, 3)
+            self.assertEqual(attrs.st_mtime, int(os.stat(paths[3]).st_mtime))
+            self.assertTrue(attrs.is_file())
+            self.assertIsNone(sftp.stat(os.path.join(remote_dir, "missing")))
+
+            entries = dict((a.name, a) for a in sftp.listdir_attr(remote_dir))
+            self.assertEqual(len(entries), 11)
+            self.assertTrue(entries["sub"].is_dir())
+
+            missing = os.path.join(remote_dir, "missing")
+            result = sftp.stat_many(paths + [missing])
+            self.assertIsNone(result[missing])
+            self.assertEqual([result[p].st_size for p in paths], list(range(10)))
+
+        # Few names in a large directory: listed partially, the rest stated
+        for i in range(10, 1000):
+            io.open(os.path.join(remote_dir, "file-{0}".format(i)), "wb").close()
+        wanted = [os.path.join(remote_dir, "file-{0}".format(i)) for i in (1, 2, 998, 999)]
+
+        with self.pyssh.new_session() as s, s.create_sftp() as sftp:
+            result = sftp.stat_many(wanted + [missing])
+            self.assertIsNone(result[missing])
+            self.assertEqual([result[p].st_size for p in wanted], [1, 2, 0, 0])
+
+        # Names not valid in utf-8
+        if sys.version_info[0] >= 3:
+            io.open(os.path.join(remote_dir, "caf\udce9"), "wb").close()
+            with self.pyssh.new_session() as s, s.create_sftp() as sftp:
+                names = [a.name for a in sftp.listdir_attr(remote_dir)]
+                self.assertIn("caf\udce9", names)
+                attrs = sftp.stat(os.path.join(remote_dir, "caf\udce9"))
+                self.assertEqual(attrs.name, "caf\udce9")
+
+        shutil.rmtree(remote_dir)
 
     def test_read_remote_file(self):
         with self.pyssh.new_session() as s, s.create_sftp() as sftp:
             f = sftp.open("/tmp/py-libssh.temp.file", os.O_RDONLY)
             self.assertEqual(b"aaaaaaaaa\n", f.read(10))
 
+    def test_remote_file_random_access(self):
+        data = os.urandom(1000000)
+        with io.open("/tmp/py-libssh.temp.file.2", "wb") as f:
+            f.write(data)
+
+        with self.pyssh.new_session() as s, s.create_sftp() as sftp:
+            with sftp.open("/tmp/py-libssh.temp.file.2", os.O_RDONLY, block_size=4096) as f:
+                self.assertTrue(f.readable())
+                self.assertTrue(f.seekable())
+                self.assertEqual(f.seek(-100, io.SEEK_END), 999900)
+                self.assertEqual(f.read(1000), data[-100:])
+                self.assertEqual(f.read(10), b"")
+
+                f.seek(5000)
+                self.assertEqual(f.read(100000), data[5000:105000])
+                f.seek(-50000, io.SEEK_CUR)
+                self.assertEqual(f.tell(), 55000)
+                self.assertEqual(f.read(), data[55000:])
+
+            with sftp.open("/tmp/py-libssh.temp.file.2", os.O_RDONLY, cache_blocks=0) as f:
+                self.assertEqual(io.BufferedReader(f).read(), data)
+
+        os.remove("/tmp/py-libssh.temp.file.2")
+
+    def test_remote_file_mmap(self):
+        data = os.urandom(1000000)
+        with io.open("/tmp/py-libssh.temp.file.2", "wb") as f:
+            f.write(data)
+
+        with self.pyssh.new_session() as s, s.create_sftp() as sftp:
+            with sftp.open("/tmp/py-libssh.temp.file.2", os.O_RDONLY) as f:
+                with f.mmap(page_size=4096, prefetch=1) as m:
+                    self.assertEqual(len(m), 1000000)
+                    self.assertEqual(m[-8:], data[-8:])
+                    self.assertEqual(m[0:10], data[0:10])
+                    self.assertEqual(m[4090:4100], data[4090:4100])
+                    self.assertEqual(m[500000], bytearray(data)[500000])
+                    self.assertEqual(m[10:100:3], data[10:100:3])
+                    self.assertEqual(m.faults, 3)
+
+        os.remove("/tmp/py-libssh.temp.file.2")
+
+    def test_shell_read_until_and_expect(self):
+        import re
+        import time
+
+        with self.pyssh.new_session() as s, s.create_shell() as shell:
+            shell.write("echo pyssh-$((40 + 2))\n")
+            self.assertTrue(shell.read_until("pyssh-42", timeout=10).endswith(b"pyssh-42"))
+
+            shell.write("echo status-$((6 * 7))\n")
+            index, data = shell.expect(["never", re.compile(b"status-(\\d+)")], timeout=10)
+            self.assertEqual(index, 1)
+            self.assertEqual(shell.match.group(1), b"42")
+
+            with self.assertRaises(self.pyssh_exp.TimeoutError):
+                shell.read_until("never", timeout=0.5)
+
+            # Large output matching at the end: only new output is searched
+            started = time.time()
+            shell.write("head -c 30000000 /dev/zero | tr '\\0' x; echo end-$((6 * 7))\n")
+            index, data = shell.expect([re.compile(b"end-(\\d+)")], timeout=60)
+            self.assertEqual(shell.match.group(1), b"42")
+            self.assertGreaterEqual(data.count(b"x"), 30000000)
+            self.assertLess(time.time() - started, 30)
+
+            shell.write("exit\n")
+            with self.assertRaises(self.pyssh_exp.ConnectionError):
+                shell.read_until("never", timeout=10)
+            self.assertTrue(shell.eof)
+
     #def test_shell_01(self):
     #    import pdb; pdb.set_trace()
     #    session = self.pyssh.new_session()